@@ -3,137 +3,160 @@
 import json
 import argparse
 import os
-import matplotlib.pyplot as plt
+import time
+import resource
+from multiprocessing import Pool, cpu_count
 
-from utils import *
+from har_io import iter_hars, sniff_format
+from har_columns import load_timing_store, columnar_size, columnar_copies
+from har_cache import HarCache, signature
+from timing_store import TimingStore
+from sketch import SketchSet
+from plots import plot_stats
+
+# Timings plotted by the parser
+STATS_KEYS = ("totalTime", "queueTime", "latency",
+              "blocked", "dns", "connect", "send", "wait", "receive")
+
+'''
+Gather the statistics of a timing store: only entries of pages with a valid
+total time and whose response has no error are considered.
+'''
+def get_stats(store, no_https):
+    
+    return store.stats(keys=STATS_KEYS, no_https=no_https,
+                       skip_errors=True, valid_pages_only=True)
 
 def parse_hars(hars, no_https):
     
-    # Gather statistics
-    stats = {
-             "totalTime":[],
-             "blocked":[],
-             "dns":[],
-             "connect":[],
-             "send":[],
-             "wait":[],
-             "receive":[]
-             }
+    return get_stats(TimingStore().add_hars(hars), no_https)
+
+'''
+Parse a single HAR file streaming its HARs, or read only the columns of
+the timings of a columnar copy of HARs.
+Returns the timing store of the file and a report with its size,
+the number of pages and entries, the time spent to parse it and the peak
+memory of the process that parsed it, over all the files it parsed so far.
+'''
+def parse_har_file(file_path):
     
-    for har in hars:
-        
-        if har["log"]["totalTime"]!=-1:
-            stats["totalTime"].append(har["log"]["totalTime"])
-        
-            for entry in har["log"]["entries"]:
-                
-                if ((not no_https or not entry["request"]["url"].lower().startswith("https://")) and
-                    "response" in entry and not "_error" in entry["response"]):
-                
-                    # Queuing
-                    if entry["timings"]["blocked"]!=-1:
-                        stats["blocked"].append(entry["timings"]["blocked"])
-                        
-                    # DNS resolution
-                    if entry["timings"]["dns"]!=-1:
-                        stats["dns"].append(entry["timings"]["dns"])
-                        
-                    # TCP Connection
-                    if entry["timings"]["connect"]!=-1:
-                        stats["connect"].append(entry["timings"]["connect"])
-                        
-                    # HTTP Request send
-                    if entry["timings"]["send"]!=-1:
-                        stats["send"].append(entry["timings"]["send"])
-                        
-                    # Wait the server
-                    if entry["timings"]["wait"]!=-1:
-                        stats["wait"].append(entry["timings"]["wait"])
-                        
-                    # HTTP Response receive
-                    if entry["timings"]["receive"]!=-1:
-                        stats["receive"].append(entry["timings"]["receive"])
-                        
-    return stats
-                
-def plot_stats(stats, out_folder):
+    start_time = time.time()
+    
+    file_format = sniff_format(file_path)
+    
+    if file_format == "columnar":
+        store = load_timing_store(file_path)
+        size = columnar_size(file_path)
+    elif file_format == "store":
+        store = TimingStore.load(file_path)
+        size = os.path.getsize(file_path)
+    else:
+        store = TimingStore().add_hars(iter_hars(file_path))
+        size = os.path.getsize(file_path)
     
-    fig_total = plt.figure()
-    axes_total = fig_total.add_subplot(111)
+    elapsed = time.time() - start_time
+    
+    report = {
+              "file": file_path,
+              "bytes": size,
+              "pages": store.pages_num,
+              "entries": len(store.columns["page"]),
+              "seconds": elapsed,
+              # Peak resident memory of the process parsing the file since it
+              # started, in KB: a pooled worker parses several files
+              "worker_peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+              }
+    
+    return store, report
+
+'''
+Parse HAR files in a pool of processes, collecting the timing store
+of each file as soon as it is available. With a HarCache, the stores of
+the files parsed before and not changed since are read from the cache,
+and only the other files are parsed (and added to the cache).
+Returns the merged timing store and an ingestion report.
+'''
+def ingest_har_files(files, jobs, cache=None):
     
-    fig_timings = plt.figure()
-    axes_timings = fig_timings.add_subplot(1,1,1)
+    start_time = time.time()
     
-    fig_timings_log = plt.figure()
-    axes_timings_log = fig_timings_log.add_subplot(1,1,1)
+    stores = {}
+    reports = {}
     
-    for key in stats:
-        if len(set(stats[key]))>1:
-            cdf = compute_cdf(stats[key])
+    if cache:
+        for file_path in files:
             
-            x = np.linspace(min(stats[key]), max(stats[key]), num=10000, endpoint=True)
-        
-            # Plot the cdf
-            if key=="totalTime":
-                axes_total.plot(x/1000, cdf[0](x), label=key)
-            else:
-                
-                if key=="dns":
-                    color="#6b6b6b"
-                elif key=="connect":
-                    color="#ff1494"
-                elif key=="send":
-                    color="#66cc00"
-                elif key=="wait":
-                    color="#ff8c00"
-                elif key=="receive":
-                    color="#1f8fff"
-                else:
-                    color=None
+            cached = cache.get(file_path)
+            
+            if cached:
                 
-                axes_timings.plot(x, cdf[0](x), label=key, color=color)
+                stores[file_path], report = cached
+                reports[file_path] = dict(report, cached=True)
                 
-                # zero is not valid with log axes
-                if min(stats[key])==0:
-                    non_zero_min = find_non_zero_min(stats[key])
-                    
-                    if non_zero_min == 0:
-                        continue
-                    
-                    x = np.linspace(non_zero_min, max(stats[key]), num=10000, endpoint=True)
-                    
-                axes_timings_log.plot(x, cdf[0](x), label=key, color=color)
+                print("Read "+file_path+" from the cache: "+str(report["pages"])+" pages")
+    
+    to_parse = [file_path for file_path in files if file_path not in stores]
+    
+    # Taken before parsing, so a file changed meanwhile is parsed again next time
+    signatures = {file_path: signature(file_path) for file_path in to_parse} if cache else {}
+    
+    if jobs > 1 and len(to_parse) > 1:
+        pool = Pool(min(jobs, len(to_parse)))
+        results = pool.imap(parse_har_file, to_parse)
+    else:
+        pool = None
+        results = map(parse_har_file, to_parse)
+    
+    try:
+        for file_path, (store, report) in zip(to_parse, results):
             
-    axes_total.set_ylim((0,1))
-    axes_total.set_xlabel("Seconds")
-    axes_total.set_ylabel("CDF")
-    axes_total.set_xscale("log")
-    axes_total.set_title("Page load time")
-    axes_total.grid(True, which="both", axis="x")
-    axes_total.grid(True, which="major", axis="y")
-    
-    fig_total.savefig(os.path.join(out_folder,"page_load_cdf.png"))
-    
-    axes_timings.set_ylim((0,1))
-    axes_timings.set_xlabel("Milliseconds")
-    axes_timings.set_ylabel("CDF")
-    axes_timings.set_title("Single resource timings")
-    axes_timings.grid(True)
-    axes_timings.legend(loc='best')
-    
-    axes_timings_log.set_ylim((0,1))
-    axes_timings_log.set_xlabel("Milliseconds")
-    axes_timings_log.set_ylabel("CDF")
-    axes_timings_log.set_xscale("log")
-    axes_timings_log.set_title("Single resource timings")
-    axes_timings_log.grid(True, which="both", axis="x")
-    axes_timings_log.grid(True, which="major", axis="y")
-    
-    axes_timings_log.legend(loc='best')
-    
-    fig_timings.savefig(os.path.join(out_folder,"timings_cdf.png"))
-    fig_timings_log.savefig(os.path.join(out_folder,"timings_cdf_log.png"))
+            stores[file_path] = store
+            reports[file_path] = report
+            
+            print("Parsed "+report["file"]+": "+str(report["pages"])+" pages in "+
+                  "{:.2f}".format(report["seconds"])+" sec")
+            
+            if cache:
+                cache.put(file_path, signatures[file_path], store, report)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        
+        if cache:
+            cache.save()
+    
+    # Merge the stores in the order of the files, whether cached or parsed
+    store = TimingStore.concatenate([stores[file_path] for file_path in files])
+    
+    files_reports = [reports[file_path] for file_path in files]
+    parsed_reports = [report for report in files_reports if not report.get("cached")]
+    
+    elapsed = time.time() - start_time
+    
+    # The throughput counts only the files parsed
+    total_bytes = sum(r["bytes"] for r in parsed_reports)
+    pages = sum(r["pages"] for r in parsed_reports)
     
+    report = {
+              "files": len(files_reports),
+              "cached_files": len(files_reports) - len(parsed_reports),
+              "jobs": jobs,
+              "bytes": sum(r["bytes"] for r in files_reports),
+              "parsed_bytes": total_bytes,
+              "pages": sum(r["pages"] for r in files_reports),
+              "parsed_pages": pages,
+              "entries": sum(r["entries"] for r in files_reports),
+              "seconds": elapsed,
+              "mb_per_second": total_bytes / 1e6 / elapsed if elapsed else 0,
+              "pages_per_second": pages / elapsed if elapsed else 0,
+              "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              "max_worker_rss_kb": max([r["worker_peak_rss_kb"] for r in parsed_reports], default=0),
+              "per_file": files_reports
+              }
+    
+    return store, report
+                
 if __name__=="__main__":
     
     version="0.1"
@@ -143,11 +166,19 @@ if __name__=="__main__":
     parser.add_argument('--version',action='version',version='%(prog)s '+ version)
     
     parser.add_argument('input', metavar='input', type=str, 
-                       help='HAR file, or folder with HAR files.')
+                       help='HAR file (JSON, JSON-lines or columnar), timing store (stats.npz), '+
+                            'or folder with HAR files.')
     parser.add_argument('out_folder', metavar='output_folder', type=str,
                        help='output statistics folder name.')
     parser.add_argument('--no-https', action='store_const', const=True, default=False,
                        help='do not plot requests on https.')
+    parser.add_argument('--jobs', metavar='<number>', type=int, default = cpu_count(),
+                       help='number of processes parsing the input files. Default is the number of CPUs')
+    parser.add_argument('--sketches', action='store_const', const=True, default=False,
+                       help='save mergeable quantile sketches of the timings in sketches.json.')
+    parser.add_argument('--no-cache', action='store_const', const=True, default=False,
+                       help='parse all the input files, without reading or updating the cache '+
+                            'of the parsed files in the output folder.')
     
     args = vars(parser.parse_args())
     
@@ -158,34 +189,107 @@ if __name__=="__main__":
     
     no_https = args['no_https']
 
-    hars = []
+    jobs = args['jobs']
+    
+    sketches = args['sketches']
+    
+    use_cache = not args['no_cache']
     
     if os.path.isdir(har_file):
-        for file in os.listdir(har_file):
-                    
-            file_path = os.path.join(har_file, file)
-            
-            with open(file_path,"r") as f:
-                hars.extend(json.load(f))
+        inputs = [os.path.join(har_file, file) for file in sorted(os.listdir(har_file))]
     
     elif os.path.isfile(har_file):
-        
-        with open(har_file,"r") as f:
-                hars.extend(json.load(f))
+        inputs = [har_file]
     
     else:
         print ("Invalid input: " + har_file)
         exit()
+    
+    files = []
+    sketch_files = []
+    
+    for file_path in inputs:
+        
+        file_format = sniff_format(file_path) if os.path.isfile(file_path) else None
+        
+        if file_format == "sketches":
+            sketch_files.append(file_path)
+        elif file_format == "store" and len(inputs) > 1:
+            # The timings of the HAR files of a run are also in its stats.npz
+            print("Skipping "+file_path+": timing store, pass it alone to plot it")
+        elif file_format in ("array", "lines") and any(sniff_format(copy) == "columnar"
+                                                       for copy in columnar_copies(file_path)
+                                                       if copy in inputs):
+            # Read the same HARs only once, from their columnar copy
+            print("Skipping "+file_path+": its columnar copy is in the input")
+        elif file_format:
+            files.append(file_path)
+        else:
+            print("Skipping "+file_path+": not a HAR file")
+    
+    # The sketches saved by a run summarize its HARs: counting them twice
+    # would double every count
+    for file_path in list(sketch_files):
+        
+        run_hars = os.path.join(os.path.dirname(file_path), "HARs.json")
+        
+        if any(path in files for path in [run_hars] + columnar_copies(run_hars)):
+            print("Skipping "+file_path+": the HARs of its run are in the input")
+            sketch_files.remove(file_path)
+    
+    if not files and not sketch_files:
+        print ("No HAR files in: " + har_file)
+        exit()
         
     if not os.path.exists(out_folder):
         os.makedirs(out_folder)
     
-    print("Pages requested: ",len(hars))
+    stats = None
     
-    stats = parse_hars(hars,no_https)
-    
-    with open(os.path.join(out_folder,"stats.json"),"w") as f:
-        json.dump(stats,f)
+    if files:
+        
+        # A timing store given alone is read as it is, there is nothing to cache
+        if use_cache and not (len(files) == 1 and sniff_format(files[0]) == "store"):
+            cache = HarCache(os.path.join(out_folder,"har_cache"))
+        else:
+            cache = None
+        
+        store, report = ingest_har_files(files, jobs, cache)
+        
+        if report["cached_files"]:
+            print("Files read from the cache: ",report["cached_files"])
+        
+        print("Pages requested: ",report["pages"])
+        print("Ingestion: {:.1f} MB/s, {:.1f} pages/s, peak memory {:.1f} MB".format(
+              report["mb_per_second"], report["pages_per_second"],
+              max(report["max_rss_kb"], report["max_worker_rss_kb"])/1024))
+        
+        with open(os.path.join(out_folder,"ingest_report.json"),"w") as f:
+            json.dump(report,f,indent=2)
+        
+        stats = get_stats(store, no_https)
+        
+        store.save(os.path.join(out_folder,"stats.npz"))
+        
+        with open(os.path.join(out_folder,"stats.json"),"w") as f:
+            json.dump({key: stats[key].tolist() for key in stats},f)
+        
+        # Save statistics
+        plot_stats(stats, out_folder)
     
-    # Save statistics
-    plot_stats(stats, out_folder)
+    # Combine the sketches of the parsed HARs with the sketch files
+    if sketches or sketch_files:
+        
+        sketch_set = SketchSet()
+        
+        if stats:
+            sketch_set.add_stats(stats)
+        
+        for file_path in sketch_files:
+            sketch_set.merge(SketchSet.load(file_path))
+        
+        sketch_set.save(os.path.join(out_folder,"sketches.json"))
+        
+        for key, percentiles in sketch_set.percentiles().items():
+            print(key+": "+", ".join(p+"="+"{:.1f}".format(v) for p, v in percentiles.items()
+                                     if p != "count"))
@@ -0,0 +1,39 @@
+#!/usr/bin/python3
+
+import argparse
+import os
+
+from distributed import Agent
+from profile_template import DEFAULT_CACHE_FOLDER
+
+if __name__=="__main__":
+
+    version="0.1"
+
+    parser = argparse.ArgumentParser(description='Web Traffic Generator agent')
+
+    parser.add_argument('--version',action='version',version='%(prog)s '+ version)
+
+    parser.add_argument('coordinator', metavar='coordinator', type=str,
+                       help='address of the Web Traffic Generator started with --agents, as host:port.')
+    parser.add_argument('--browsers', metavar='<number>', type=int, default = 3,
+                       help='number of browsers to open. Default is 3')
+    parser.add_argument('--spare-browsers', metavar='<number>', type=int, default = 0,
+                       help='number of pre-warmed browsers kept by each browser to replace it after a failure. Default is 0')
+    parser.add_argument('--profile-cache', metavar='<folder>', type=str, default = DEFAULT_CACHE_FOLDER,
+                       help='folder where Firefox profile templates are kept across runs. Default is '+DEFAULT_CACHE_FOLDER)
+    parser.add_argument('--proxy-shards', metavar='<number>', type=int, default = 1,
+                       help='number of proxy servers, browsers are assigned to them in turn. Default is 1')
+    parser.add_argument('--proxy-port', metavar='<port>', type=int, default = 8080,
+                       help='port of the first proxy server, the following ones use the next thousands. Default is 8080')
+
+    args = vars(parser.parse_args())
+
+    browser_mob_proxy_location = os.environ.get("BROWSERMOBPROXY_BIN")
+
+    if not browser_mob_proxy_location:
+        browser_mob_proxy_location = "./browsermob-proxy/bin/browsermob-proxy"
+
+    Agent(args['coordinator'], args['browsers'], args['spare_browsers'],
+          args['proxy_shards'], args['proxy_port'], args['profile_cache'],
+          browser_mob_proxy_location).run()
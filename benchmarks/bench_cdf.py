@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from scipy.interpolate import interp1d
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils import compute_cdf
+
+'''
+The CDF implementation replaced by utils.ECDF, kept as a reference:
+one histogram bin for each distinct value and two interp1d objects.
+'''
+def legacy_compute_cdf(data):
+    
+    data_size=len(data)
+    
+    data_set=sorted(set(data))
+    bins=np.append(data_set, data_set[-1]+1)
+    
+    counts, bin_edges = np.histogram(data, bins=bins, density=False)
+    
+    counts=counts.astype(float)/data_size
+    
+    cdf_samples = np.cumsum(counts)
+    
+    cdf = interp1d(bin_edges[0:-1], cdf_samples)
+    
+    inverse_cdf = interp1d(cdf_samples,bin_edges[0:-1])
+    
+    return cdf, inverse_cdf, cdf_samples
+
+'''
+Synthetic timings in milliseconds: log-normal, rounded to the millisecond
+as in the HARs unless continuous is set
+'''
+def make_sample(size, continuous, rng):
+    
+    data = rng.lognormal(mean=4, sigma=1.5, size=size)
+    
+    if not continuous:
+        data = np.round(data)
+    
+    return data
+
+'''
+Time the construction of the CDF and its evaluation on 10000 points,
+as done by plot_stats
+'''
+def bench(cdf_function, data):
+    
+    start_time = time.perf_counter()
+    
+    cdf = cdf_function(data)
+    
+    build_time = time.perf_counter() - start_time
+    
+    x = np.linspace(np.min(data), np.max(data), num=10000, endpoint=True)
+    
+    start_time = time.perf_counter()
+    
+    cdf[0](x)
+    
+    eval_time = time.perf_counter() - start_time
+    
+    return {"build_seconds": build_time, "eval_seconds": eval_time}
+
+if __name__=="__main__":
+    
+    parser = argparse.ArgumentParser(description='CDF micro-benchmarks')
+    
+    parser.add_argument('--min-exp', metavar='<exp>', type=int, default = 4,
+                       help='smallest sample size is 10^<exp>. Default is 4')
+    parser.add_argument('--max-exp', metavar='<exp>', type=int, default = 8,
+                       help='largest sample size is 10^<exp>. Default is 8')
+    parser.add_argument('--legacy-max-exp', metavar='<exp>', type=int, default = 6,
+                       help='run the legacy implementation up to 10^<exp> samples. Default is 6')
+    parser.add_argument('--continuous', action='store_const', const=True, default=False,
+                       help='do not round the samples (all values distinct).')
+    parser.add_argument('--output', metavar='<file>', type=str,
+                       help='save the results in a JSON file.')
+    
+    args = vars(parser.parse_args())
+    
+    rng = np.random.default_rng(0)
+    
+    results = []
+    
+    for exp in range(args['min_exp'], args['max_exp']+1):
+        
+        data = make_sample(10**exp, args['continuous'], rng)
+        
+        implementations = [("ecdf", compute_cdf)]
+        
+        if exp <= args['legacy_max_exp']:
+            implementations.append(("legacy", legacy_compute_cdf))
+        
+        for name, cdf_function in implementations:
+            
+            result = bench(cdf_function, data)
+            result.update({"implementation": name, "samples": 10**exp})
+            results.append(result)
+            
+            print("{:>7} 10^{}: build {:.4f} s, eval {:.4f} s".format(
+                  name, exp, result["build_seconds"], result["eval_seconds"]))
+        
+        del data
+    
+    if args['output']:
+        with open(args['output'],"w") as f:
+            json.dump(results,f,indent=2)
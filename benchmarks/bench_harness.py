@@ -0,0 +1,419 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import json
+import time
+import argparse
+import socket
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+import numpy as np
+from multiprocessing import Queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from browser_pool import BrowserPool
+from circuit_breaker import CircuitBreakers
+from metrics import Metrics
+from checkpoint import Checkpoint
+from scheduler import ArrivalScheduler
+from phase_timer import overhead_report
+from history import load_history
+from utils import compute_cdf
+from plots import plot_stats
+from HARparser import ingest_har_files, get_stats
+from synthetic import write_history, write_har_corpus
+from har_proxy import HarProxy
+from fakes import SyntheticSite, FakeProxyShards, install_fake_firefox
+
+BENCHMARKS = ("dispatch", "browsers", "proxy", "history", "cdf", "parse_hars", "plot_stats")
+
+'''
+Rate at which the scheduler dispatches URLs to the pool, with the live
+metrics and the checkpoint of a real run and no browsers: the queue is
+drained by a thread
+'''
+def bench_dispatch(args, temp_dir):
+    
+    urls_queue = Queue()
+    hars_queue = Queue()
+    
+    pool = BrowserPool([], urls_queue, hars_queue, None, CircuitBreakers(), Metrics(),
+                       Checkpoint(os.path.join(temp_dir, "checkpoint.json")))
+    
+    def drain():
+        while urls_queue.get() is not None:
+            pass
+    
+    drainer = threading.Thread(target=drain, daemon=True)
+    drainer.start()
+    
+    urls = ["http://www.site%d.com/" % (i % 1000) for i in range(args['dispatch_urls'])]
+    
+    items, scheduler = pool.checkpoint.remaining(urls, ArrivalScheduler.immediate(len(urls)))
+    
+    def dispatch(item, intended_start):
+        pool.checkpoint.dispatched(*item)
+        pool.dispatch(item[1], intended_start)
+    
+    start_time = time.perf_counter()
+    
+    scheduler.run(items, dispatch, pool.wait)
+    
+    elapsed = time.perf_counter() - start_time
+    
+    urls_queue.put(None)
+    drainer.join()
+    
+    return {"urls": len(urls), "seconds": elapsed, "urls_per_second": len(urls) / elapsed}
+
+'''
+Pages per second and harness overhead of Browser.run, with FakeFirefox and
+fake proxies loading pages from a local site
+'''
+def bench_browsers(args, temp_dir):
+    
+    try:
+        uninstall = install_fake_firefox()
+    except ImportError:
+        return {"skipped": "selenium is not installed"}
+    
+    from browser import Browser
+    from profile_template import ProfileTemplate
+    
+    site = SyntheticSite(args['latency'], args['resources']).start()
+    
+    proxy_shards = FakeProxyShards(1)
+    proxy_shards.start()
+    
+    urls_queue = Queue()
+    hars_queue = Queue()
+    
+    template = ProfileTemplate("warm", os.path.join(temp_dir, "profiles"))
+    
+    browsers = [Browser(i, proxy_shards.shard_for(i), urls_queue, hars_queue,
+                        30, False, temp_dir, os.path.join(temp_dir, "HARs_%d.jsonl" % i),
+                        template, 0, args['capture'])
+                for i in range(args['browsers'])]
+    
+    pool = BrowserPool(browsers, urls_queue, hars_queue)
+    
+    try:
+        pool.start()
+        pool.wait_ready(60)
+        
+        urls = [site.url(i) for i in range(args['pages'])]
+        
+        start_time = time.perf_counter()
+        
+        ArrivalScheduler.immediate(len(urls)).run(urls, pool.dispatch, pool.wait)
+        
+        pool.finish()
+        
+        elapsed = time.perf_counter() - start_time
+        
+        pool.join()
+    
+    finally:
+        pool.close()
+        proxy_shards.stop()
+        site.stop()
+        uninstall()
+    
+    overhead = overhead_report({browser: record["phases"] for browser, record in pool.finished.items()
+                                if "phases" in record})["total"]
+    
+    overhead_seconds = sum(phase["seconds"] for name, phase in overhead["phases"].items()
+                           if name not in ("page_load", "queue_get"))
+    
+    return {
+            "browsers": len(browsers),
+            "pages": pool.pages,
+            "failures": sum(pool.failures.values()),
+            "seconds": elapsed,
+            "pages_per_second": pool.pages / elapsed,
+            "overhead_ms_per_page": overhead_seconds / pool.pages * 1000 if pool.pages else None,
+            "overhead_per_page_fraction": overhead["overhead_per_page_fraction"],
+            "phases_mean_ms": {name: phase["mean_ms"] for name, phase in overhead["phases"].items()}
+            }
+
+'''
+GET the pages of the local site on one kept-alive connection, directly or
+through the proxy at address. Returns the seconds spent and the statuses.
+'''
+def get_pages(site, requests, address=None):
+    
+    connection = http.client.HTTPConnection(*(address or ("127.0.0.1", site.port)))
+    
+    statuses = []
+    
+    start_time = time.perf_counter()
+    
+    for i in range(requests):
+        
+        # A proxy gets the absolute URL
+        connection.request("GET", site.url(i) if address else "/page/%d" % i)
+        
+        response = connection.getresponse()
+        response.read()
+        
+        statuses.append(response.status)
+    
+    elapsed = time.perf_counter() - start_time
+    
+    connection.close()
+    
+    return elapsed, statuses
+
+'''
+Requests per second and per-request overhead of the asyncio HAR proxy in
+front of the local site, checking the HAR it records: an entry for each
+request with its status, dns and connect only on the first request (the
+connection to the site is reused) and, for a CONNECT tunnel, a new
+connection and -1 for the timings the proxy cannot measure
+'''
+def bench_proxy(args, temp_dir):
+    
+    site = SyntheticSite(args['latency'], 0).start()
+    
+    proxy = HarProxy()
+    
+    try:
+        direct_seconds, _ = get_pages(site, args['proxy_requests'])
+        
+        proxy.new_har(ref="bench")
+        
+        proxy_seconds, statuses = get_pages(site, args['proxy_requests'], (proxy.host, proxy.port))
+        
+        entries = proxy.har["log"]["entries"]
+        
+        # A tunnel to the site, closed as soon as it is established
+        with socket.create_connection((proxy.host, proxy.port)) as client:
+            
+            client.sendall(("CONNECT 127.0.0.1:%d HTTP/1.1\r\n\r\n" % site.port).encode())
+            
+            tunnel_reply = client.recv(1024)
+        
+        tunnel = proxy.har["log"]["entries"][len(entries):]
+    
+    finally:
+        proxy.close()
+        site.stop()
+    
+    errors = []
+    
+    if len(entries) != len(statuses):
+        errors.append("%d entries for %d requests" % (len(entries), len(statuses)))
+    
+    if [entry["response"]["status"] for entry in entries] != statuses or set(statuses) != {200}:
+        errors.append("statuses of the entries differ from those of the responses")
+    
+    new_connections = [i for i, entry in enumerate(entries) if entry["timings"]["connect"] != -1]
+    
+    if new_connections != [0]:
+        errors.append("connections opened by the requests: %s" % new_connections[:10])
+    
+    if any(entry["timings"][key] < 0 for entry in entries for key in ("blocked", "send", "wait", "receive")):
+        errors.append("negative timings of a forwarded request")
+    
+    if not tunnel_reply.startswith(b"HTTP/1.1 200") or len(tunnel) != 1:
+        errors.append("tunnel not established or not recorded")
+    elif any(tunnel[0]["timings"][key] != -1 for key in ("blocked", "send", "wait", "receive")):
+        errors.append("timings not measured on the tunnel are not -1: %s" % tunnel[0]["timings"])
+    elif tunnel[0]["timings"]["connect"] == -1:
+        errors.append("tunnel opened on an idle connection of the requests")
+    
+    if errors:
+        raise RuntimeError("HAR proxy: " + "; ".join(errors))
+    
+    return {
+            "requests": len(statuses),
+            "seconds": proxy_seconds,
+            "requests_per_second": len(statuses) / proxy_seconds,
+            "overhead_ms_per_request": (proxy_seconds - direct_seconds) / len(statuses) * 1000,
+            "direct_requests_per_second": len(statuses) / direct_seconds
+            }
+
+'''
+Lines per second of the history loader, plain and gzip, without and with
+its cache
+'''
+def bench_history(args, temp_dir):
+    
+    rng = np.random.default_rng(0)
+    
+    results = {}
+    
+    for compress in (False, True):
+        
+        path = os.path.join(temp_dir, "history" + (".gz" if compress else ".txt"))
+        
+        write_history(path, args['history_lines'], rng, compress=compress)
+        
+        result = {"lines": args['history_lines'], "bytes": os.path.getsize(path)}
+        
+        for name, cache in (("uncached", False), ("cache_miss", True), ("cache_hit", True)):
+            
+            start_time = time.perf_counter()
+            
+            load_history(path, 30, cache=cache)
+            
+            result[name + "_seconds"] = time.perf_counter() - start_time
+        
+        result["lines_per_second"] = args['history_lines'] / result["uncached_seconds"]
+        
+        results["gzip" if compress else "plain"] = result
+    
+    return results
+
+'''
+Construction time of the CDF of log-normal samples
+'''
+def bench_cdf(args, temp_dir):
+    
+    rng = np.random.default_rng(0)
+    
+    results = []
+    
+    for exp in range(4, args['max_exp']+1):
+        
+        data = np.round(rng.lognormal(4, 1.5, 10**exp))
+        
+        start_time = time.perf_counter()
+        
+        compute_cdf(data)
+        
+        elapsed = time.perf_counter() - start_time
+        
+        results.append({"samples": 10**exp, "seconds": elapsed, "samples_per_second": 10**exp / elapsed})
+    
+    return results
+
+'''
+Ingestion rate of the HAR parser on a synthetic corpus, one JSON-lines
+file for each job
+'''
+def bench_parse_hars(args, temp_dir):
+    
+    rng = np.random.default_rng(0)
+    
+    files = [os.path.join(temp_dir, "corpus_%d.jsonl" % i) for i in range(args['jobs'])]
+    
+    for path in files:
+        write_har_corpus(path, args['har_pages'] // len(files), args['entries'], rng)
+    
+    start_time = time.perf_counter()
+    
+    store, report = ingest_har_files(files, args['jobs'])
+    
+    get_stats(store, False)
+    
+    elapsed = time.perf_counter() - start_time
+    
+    return {
+            "files": len(files),
+            "jobs": args['jobs'],
+            "bytes": report["bytes"],
+            "pages": report["pages"],
+            "entries": report["entries"],
+            "seconds": elapsed,
+            "mb_per_second": report["bytes"] / 1e6 / elapsed,
+            "pages_per_second": report["pages"] / elapsed
+            }
+
+'''
+Time to plot the CDFs of all the timings, with samples values each
+'''
+def bench_plot_stats(args, temp_dir):
+    
+    rng = np.random.default_rng(0)
+    
+    keys = ("totalTime", "queueTime", "latency", "blocked", "dns", "connect", "send", "wait", "receive")
+    
+    stats = {key: rng.lognormal(3, 1.5, args['samples']) for key in keys}
+    
+    start_time = time.perf_counter()
+    
+    plot_stats(stats, temp_dir)
+    
+    elapsed = time.perf_counter() - start_time
+    
+    return {"timings": len(keys), "samples": args['samples'], "seconds": elapsed,
+            "samples_per_second": len(keys) * args['samples'] / elapsed}
+
+def commit():
+    
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__=="__main__":
+    
+    parser = argparse.ArgumentParser(description='Synthetic-load benchmarks of the harness')
+    
+    parser.add_argument('benchmarks', metavar='benchmark', type=str, nargs='*', default=list(BENCHMARKS),
+                       help='benchmarks to run: '+", ".join(BENCHMARKS)+'. Default is all of them')
+    parser.add_argument('--dispatch-urls', metavar='<number>', type=int, default = 100000,
+                       help='URLs dispatched by the dispatch benchmark. Default is 100000')
+    parser.add_argument('--browsers', metavar='<number>', type=int, default = 4,
+                       help='fake browsers of the browsers benchmark. Default is 4')
+    parser.add_argument('--pages', metavar='<number>', type=int, default = 500,
+                       help='pages loaded by the browsers benchmark. Default is 500')
+    parser.add_argument('--latency', metavar='<seconds>', type=float, default = 0.0,
+                       help='latency of each response of the local site. Default is 0')
+    parser.add_argument('--resources', metavar='<number>', type=int, default = 10,
+                       help='resources of each page of the local site. Default is 10')
+    parser.add_argument('--capture', metavar='<mode>', type=str, choices=("proxy", "timing"), default = "proxy",
+                       help='capture mode of the fake browsers. Default is proxy')
+    parser.add_argument('--proxy-requests', metavar='<number>', type=int, default = 5000,
+                       help='requests sent through the asyncio HAR proxy. Default is 5000')
+    parser.add_argument('--history-lines', metavar='<number>', type=int, default = 1000000,
+                       help='lines of the synthetic history. Default is 1000000')
+    parser.add_argument('--max-exp', metavar='<exp>', type=int, default = 7,
+                       help='largest sample of the cdf benchmark is 10^<exp>. Default is 7')
+    parser.add_argument('--har-pages', metavar='<number>', type=int, default = 20000,
+                       help='pages of the synthetic HAR corpus. Default is 20000')
+    parser.add_argument('--entries', metavar='<number>', type=int, default = 20,
+                       help='entries of each synthetic HAR. Default is 20')
+    parser.add_argument('--jobs', metavar='<number>', type=int, default = 2,
+                       help='files of the HAR corpus and processes parsing them. Default is 2')
+    parser.add_argument('--samples', metavar='<number>', type=int, default = 1000000,
+                       help='samples of each timing plotted by the plot_stats benchmark. Default is 1000000')
+    parser.add_argument('--output', metavar='<file>', type=str,
+                       help='save the results in a JSON file.')
+    
+    args = vars(parser.parse_args())
+    
+    for name in args['benchmarks']:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark: "+name)
+    
+    results = {}
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        
+        for name in args['benchmarks']:
+            
+            print("Running "+name)
+            
+            results[name] = globals()["bench_"+name](args, temp_dir)
+            
+            print(json.dumps(results[name], indent=2))
+    
+    if args['output']:
+        with open(args['output'],"w") as f:
+            json.dump({
+                       "commit": commit(),
+                       "time": time.time(),
+                       "python": platform.python_version(),
+                       "numpy": np.__version__,
+                       "cpus": os.cpu_count(),
+                       "parameters": args,
+                       "results": results
+                       },f,indent=2)
@@ -0,0 +1,339 @@
+import os
+import re
+import json
+import time
+import socket
+import threading
+import http.client
+import contextlib
+
+from urllib.parse import urlsplit
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from proxy_shards import ProxyShard, ProxyShards
+from resource_timing import RESOURCE_TIMING_SCRIPT
+
+'''
+Local stand-ins for Firefox, BrowserMob Proxy and the web, to measure the
+harness without them.
+
+SyntheticSite serves pages with a given number of resources, each answered
+after a given latency. FakeFirefox loads a page and its resources over HTTP
+and reports them to its FakeProxy (found through the proxy port written in
+its profile, as Firefox does) or, in timing capture mode, returns them as
+Resource Timing entries. FakeServer creates FakeProxy objects as
+browsermobproxy.Server creates its clients.
+'''
+
+# Proxy port -> FakeProxy, in the process of a browser
+_proxies = {}
+
+class SyntheticSite:
+
+    def __init__(self, latency=0.0, resources=10, size=1000):
+
+        self.latency = latency
+        self.resources = resources
+        self.size = size
+
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = "HTTP/1.1"
+
+            # Headers and body are separate writes: with Nagle, the body of each
+            # response on a kept-alive connection waits for a delayed ACK
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+
+                time.sleep(site.latency)
+
+                if self.path.startswith("/page/"):
+                    page = self.path[len("/page/"):]
+                    body = ("<html><body>" +
+                            "".join('<img src="/res/%s/%d">' % (page, i) for i in range(site.resources)) +
+                            "</body></html>").encode()
+                    mime = "text/html"
+                else:
+                    body = b"x" * site.size
+                    mime = "image/png"
+
+                self.send_response(200)
+                self.send_header("Content-Type", mime)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.server.request_queue_size = 1024
+
+        self.port = self.server.server_address[1]
+
+    def start(self):
+
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        return self
+
+    def stop(self):
+
+        self.server.shutdown()
+        self.server.server_close()
+
+    def url(self, page):
+
+        return "http://127.0.0.1:%d/page/%d" % (self.port, page)
+
+class FakeProxy:
+
+    def __init__(self, port):
+
+        self.port = port
+        self.proxy = "127.0.0.1:%d" % port
+        self.timeouts = {}
+
+        self._har = None
+
+        _proxies[port] = self
+
+    def new_har(self, ref=None, options=None):
+
+        self._har = {"log": {
+                             "version": "1.2",
+                             "creator": {"name": "FakeProxy", "version": "0.1"},
+                             "pages": [{"id": ref, "title": ref, "startedDateTime": "", "pageTimings": {}}],
+                             "entries": []
+                             }}
+
+    def record(self, fetch):
+
+        if self._har is None:
+            return
+
+        self._har["log"]["entries"].append({
+            "pageref": self._har["log"]["pages"][0]["id"],
+            "startedDateTime": "",
+            "time": fetch["wait"] + fetch["receive"],
+            "request": {"method": "GET", "url": fetch["url"], "httpVersion": "HTTP/1.1",
+                        "cookies": [], "headers": [], "queryString": [],
+                        "headersSize": -1, "bodySize": 0},
+            "response": {"status": fetch["status"], "statusText": "", "httpVersion": "HTTP/1.1",
+                         "cookies": [], "headers": [],
+                         "content": {"size": fetch["size"], "mimeType": fetch["mime"]},
+                         "redirectURL": "", "headersSize": -1, "bodySize": fetch["size"]},
+            "cache": {},
+            "timings": {"blocked": 0, "dns": -1, "connect": -1, "ssl": -1,
+                        "send": 0, "wait": fetch["wait"], "receive": fetch["receive"]}
+            })
+
+    @property
+    def har(self):
+
+        # A copy, as the JSON decoded by the real client
+        return json.loads(json.dumps(self._har))
+
+    def close(self):
+
+        _proxies.pop(self.port, None)
+
+class FakeServer:
+
+    def __init__(self, path=None, options=None):
+
+        self.port = (options or {}).get("port", 8080)
+        self.command = []
+
+        self.next_port = self.port + 1
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def create_proxy(self):
+
+        proxy = FakeProxy(self.next_port)
+
+        self.next_port += 1
+
+        return proxy
+
+'''
+Stand-in for selenium.webdriver.Firefox, with the same constructor: the
+arguments of geckodriver go in the Service
+'''
+class FakeFirefox:
+
+    CONTEXT_CHROME = "chrome"
+    CONTEXT_CONTENT = "content"
+
+    def __init__(self, options=None, service=None, keep_alive=True):
+
+        self.proxy = None
+        self.timeout = 30
+
+        self.connections = {}
+        self.fetches = []
+        self.time_origin = time.time()
+
+        arguments = options.arguments if options else []
+
+        # Find the proxy in the preferences of the profile, as Firefox does
+        if "-profile" in arguments:
+
+            user_js = os.path.join(arguments[arguments.index("-profile") + 1], "user.js")
+
+            if os.path.isfile(user_js):
+                with open(user_js) as f:
+                    port = re.search(r'"network\.proxy\.http_port", (\d+)', f.read())
+
+                if port:
+                    self.proxy = _proxies.get(int(port.group(1)))
+
+    def set_page_load_timeout(self, timeout):
+
+        self.timeout = timeout
+
+    def get(self, url):
+
+        from selenium.common.exceptions import TimeoutException
+
+        if url == "about:blank":
+            return
+
+        self.fetches = []
+        self.time_origin = time.time()
+
+        deadline = time.time() + self.timeout
+
+        try:
+            page = self.fetch(url, deadline)
+
+            for resource in re.findall(rb'src="([^"]+)"', page):
+                self.fetch(urlsplit(url)._replace(path=resource.decode(), query="").geturl(), deadline)
+
+        except socket.timeout:
+            raise TimeoutException("Timeout loading page after %d ms" % (self.timeout * 1000))
+
+    '''
+    GET url on a kept-alive connection, recording its timings
+    '''
+    def fetch(self, url, deadline):
+
+        parts = urlsplit(url)
+
+        connection = self.connections.get(parts.netloc)
+
+        if connection is None:
+            connection = self.connections[parts.netloc] = http.client.HTTPConnection(parts.netloc)
+
+        connection.timeout = max(0.001, deadline - time.time())
+
+        if connection.sock:
+            connection.sock.settimeout(connection.timeout)
+
+        start = time.time()
+
+        try:
+            connection.request("GET", parts.path or "/")
+            response = connection.getresponse()
+        except (ConnectionError, http.client.HTTPException):
+            connection.close()
+            connection.request("GET", parts.path or "/")
+            response = connection.getresponse()
+
+        first_byte = time.time()
+
+        body = response.read()
+
+        end = time.time()
+
+        fetch = {"url": url, "status": response.status, "size": len(body),
+                 "mime": response.getheader("Content-Type", ""), "start": start,
+                 "wait": (first_byte - start) * 1000, "receive": (end - first_byte) * 1000}
+
+        self.fetches.append(fetch)
+
+        if self.proxy:
+            self.proxy.record(fetch)
+
+        return body
+
+    @contextlib.contextmanager
+    def context(self, context):
+
+        yield
+
+    def execute_script(self, script):
+
+        if script != RESOURCE_TIMING_SCRIPT:
+            return None
+
+        origin = self.time_origin * 1000
+
+        entries = []
+
+        for fetch in self.fetches:
+
+            start = fetch["start"] * 1000 - origin
+
+            entries.append({"name": fetch["url"], "startTime": start,
+                            "duration": fetch["wait"] + fetch["receive"],
+                            "fetchStart": start, "domainLookupStart": start, "domainLookupEnd": start,
+                            "connectStart": start, "connectEnd": start, "requestStart": start,
+                            "responseStart": start + fetch["wait"],
+                            "responseEnd": start + fetch["wait"] + fetch["receive"],
+                            "responseStatus": fetch["status"], "decodedBodySize": fetch["size"],
+                            "nextHopProtocol": "http/1.1"})
+
+        return json.dumps({"timeOrigin": origin, "entries": entries})
+
+    def quit(self):
+
+        for connection in self.connections.values():
+            connection.close()
+
+'''
+Proxy shards with FakeServer in place of browsermobproxy.Server
+'''
+class FakeProxyShard(ProxyShard):
+
+    def start(self):
+
+        self.server = FakeServer(self.path, options={"port": self.port})
+        self.server.start()
+
+    def healthy(self, timeout=5):
+
+        return True
+
+class FakeProxyShards(ProxyShards):
+
+    def __init__(self, shards_num, base_port=8080):
+
+        super().__init__(None, shards_num, base_port)
+
+        self.shards = [FakeProxyShard(shard.index, None, shard.port) for shard in self.shards]
+
+'''
+Make the browsers use FakeFirefox: the browser processes are forked, so
+they inherit the patch. Returns a function that undoes it.
+'''
+def install_fake_firefox():
+
+    from selenium import webdriver
+
+    firefox = webdriver.Firefox
+    webdriver.Firefox = FakeFirefox
+
+    def uninstall():
+        webdriver.Firefox = firefox
+
+    return uninstall
@@ -0,0 +1,103 @@
+import os
+import gzip
+import json
+import numpy as np
+
+from har_io import HarShardWriter
+from timing_store import TIMINGS
+
+'''
+Synthetic inputs of configurable size: browser histories and HAR corpora
+'''
+
+'''
+Write a history of lines visits ("<timestamp in us> <url>"), separated by
+log-normal thinking times. A fraction of the visits are on https, and a
+fraction on local files and private addresses, that the loader drops.
+With compress the file is written with gzip.
+'''
+def write_history(path, lines, rng, https_fraction=0.3, private_fraction=0.05,
+                  compress=False, hosts=1000):
+
+    timestamps = 1.6e15 + np.cumsum(rng.lognormal(1, 1.5, lines) * 1e6)
+
+    kinds = rng.random(lines)
+    host_ids = rng.integers(0, hosts, lines)
+
+    with (gzip.open(path, "wt") if compress else open(path, "w")) as f:
+
+        for timestamp, kind, host in zip(timestamps.astype(np.int64), kinds, host_ids):
+
+            if kind < private_fraction / 2:
+                url = "file:///home/user/page%d.html" % host
+            elif kind < private_fraction:
+                url = "http://192.168.1.%d/" % (host % 256)
+            elif kind < private_fraction + https_fraction:
+                url = "https://www.site%d.com/path/%d" % (host, timestamp % 1000)
+            else:
+                url = "http://www.site%d.com/path/%d" % (host, timestamp % 1000)
+
+            f.write("%d %s\n" % (timestamp, url))
+
+'''
+A HAR of a page with entries resources, with log-normal timings
+'''
+def make_har(page, entries, rng, headers=False):
+
+    url = "http://www.site%d.com/" % page
+
+    values = rng.lognormal(2, 1.5, (entries, len(TIMINGS)))
+
+    return {"log": {
+                    "version": "1.2",
+                    "creator": {"name": "synthetic", "version": "0.1"},
+                    "pages": [{"id": url, "title": url, "startedDateTime": "", "pageTimings": {}}],
+                    "entries": [{
+                                 "pageref": url,
+                                 "startedDateTime": "",
+                                 "time": float(row.sum()),
+                                 "request": {"method": "GET", "url": url + "res/%d" % i,
+                                             "headers": [{"name": "Accept", "value": "*/*"}] if headers else [],
+                                             "headersSize": -1, "bodySize": 0},
+                                 "response": {"status": 200,
+                                              "headers": [{"name": "Content-Type", "value": "image/png"}] if headers else [],
+                                              "content": {"size": 1000, "mimeType": "image/png"},
+                                              "headersSize": -1, "bodySize": 1000},
+                                 "timings": dict(zip(TIMINGS, row.round(3).tolist()))
+                                 } for i, row in enumerate(values)],
+                    "totalTime": float(rng.lognormal(7, 1)),
+                    "queueTime": 0.0,
+                    "latency": float(rng.lognormal(7, 1))
+                    }}
+
+'''
+Write pages HARs in a file, as a JSON array (as HARs.json) or as JSON-lines
+(as the shards of the browsers). Returns the size of the file.
+'''
+def write_har_corpus(path, pages, entries, rng, file_format="lines", headers=False):
+
+    if file_format == "lines":
+
+        writer = HarShardWriter(path)
+
+        for page in range(pages):
+            writer.write(make_har(page, entries, rng, headers))
+
+        writer.close()
+
+    else:
+
+        with open(path, "w") as f:
+
+            f.write("[")
+
+            for page in range(pages):
+
+                if page:
+                    f.write(", ")
+
+                json.dump(make_har(page, entries, rng, headers), f)
+
+            f.write("]")
+
+    return os.path.getsize(path)
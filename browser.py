@@ -1,18 +1,79 @@
 import os
 import json
 import time
-import errno
+import threading
 
 from socket import error as socket_error
 from multiprocessing import Process
 
 from selenium import webdriver
-from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.firefox.service import Service
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+from har_io import HarShardWriter
+from profile_template import ProfilePool, CLEAR_CACHE_SCRIPT, proxy_preferences, free_port
+from resource_timing import RESOURCE_TIMING_SCRIPT, timing_har
+from timing_store import TIMINGS
+from phase_timer import PhaseTimer, start_profiler
+
+'''
+Browser launched in a background thread on a proxy created by the browser
+process, ready to replace a failed one. The thread only starts Firefox:
+waiting for a proxy server and giving up belong to the process, and a
+failed launch is raised to the process when it takes the spare.
+'''
+class WarmSpare(threading.Thread):
+    
+    def __init__(self, proxy, launch_driver, close):
+        
+        super().__init__(daemon=True)
+        
+        self.proxy = proxy
+        self.launch_driver = launch_driver
+        self.close_instance = close
+        
+        self.instance = None
+        self.error = None
+        
+        self.start()
+    
+    def run(self):
+        
+        try:
+            self.instance = self.proxy, self.launch_driver(self.proxy)
+        except Exception as e:
+            self.error = e
+            
+            if self.proxy:
+                try:
+                    self.proxy.close()
+                except Exception:
+                    pass
+    
+    '''
+    Wait for the launch to complete and return the proxy and the browser
+    '''
+    def take(self):
+        
+        self.join()
+        
+        if self.error:
+            raise self.error
+        
+        return self.instance
+    
+    def close(self):
+        
+        self.join()
+        
+        if self.instance:
+            self.close_instance(*self.instance)
 
 class Browser(Process):
     
-    def __init__(self, id, proxy_server, urls_queue, hars_queue, barrier,
-                 timeout, save_headers, temp_dir):
+    def __init__(self, id, proxy_server, urls_queue, hars_queue,
+                 timeout, save_headers, temp_dir, har_shard, profile_template,
+                 spares_num=0, capture="proxy", profiler=None):
         
         super().__init__()
         
@@ -20,143 +81,361 @@ class Browser(Process):
         self.server = proxy_server
         self.urls_queue = urls_queue
         self.hars_queue = hars_queue
-        self.barrier = barrier
         self.timeout = timeout
         self.save_headers = save_headers
         
         self.temp_dir = temp_dir
+        
+        # Template of the Firefox profiles, cloned at each launch
+        self.profile_template = profile_template
+        
+        # JSON-lines file where the HARs are written as soon as they are captured
+        self.har_shard = har_shard
+        
+        # Number of pre-warmed browsers kept ready to replace a failed one
+        self.spares_num = spares_num
+        self.spares = []
+        
+        # proxy: record HARs with the proxy, timing: build them from the
+        # Navigation and Resource Timing entries of the browser, with no proxy
+        self.capture = capture
+        
+        # Wall time of each step of the page cycle, and optional profiler of the loop
+        self.timer = PhaseTimer()
+        self.profiler = profiler
     
     '''
-    Restart browser and proxy
+    Launch a new proxy and a new browser using it
     '''
-    def start_browser(self):
+    def launch(self):
+        
+        proxy = self.launch_proxy()
+        
+        try:
+            driver = self.launch_driver(proxy)
+        except:
+            if proxy:
+                proxy.close()
+            raise
+        
+        return proxy, driver
+    
+    '''
+    Create a new proxy on the proxy server of this browser, waiting for the
+    server to be restarted if it is offline. None in timing capture mode.
+    '''
+    def launch_proxy(self):
+        
+        if self.capture == "timing":
+            return None
         
         try:
-            self.proxy = self.server.create_proxy()
+            proxy = self.server.create_proxy()
         except Exception as e:
-            print("Browser "+ str(self.id) +": Proxy server is offline: ", e)
+            print("Browser "+ str(self.id) +": Proxy server "+ str(self.server.index) +" is offline: ", e)
             
-            try:
-                self.barrier.wait(3*self.timeout)
-            except BrokenBarrierError: 
-                print("Browser "+ str(self.id) +": Timed out waiting for a browser", e)
+            # Wait for the main process to restart the proxy server of this shard
+            if not self.server.wait_restart(3*self.timeout):
+                print("Browser "+ str(self.id) +": Timed out waiting for the proxy server", e)
                 exit(1)
             
-            self.proxy = self.server.create_proxy()
-            
+            proxy = self.server.create_proxy()
         
-        self.proxy.timeouts = {
-                               'request': 5,
-                               'read': 5,
-                               'connection': 5,
-                               'dns': 5
+        proxy.timeouts = {
+                          'request': 5,
+                          'read': 5,
+                          'connection': 5,
+                          'dns': 5
         } 
         
-        self.profile = webdriver.FirefoxProfile()
-        
-        # Download files
-        self.profile.set_preference("browser.download.folderList", 2)
-        self.profile.set_preference("browser.download.dir", self.temp_dir)
-        
-        # A comma-separated list of MIME types to save to disk without asking
-        # what to use to open the file
-        self.profile.set_preference("browser.helperApps.neverAsk.saveToDisk",
-                                    "application/x-msexcel,"+
-                                    "application/excel,"+
-                                    "application/x-excel,"+
-                                    "application/vnd.ms-excel,"+
-                                    "application/pdf,"+
-                                    "application/msword,"+
-                                    "application/xml,"+
-                                    "application/octet-stream,"+
-                                    "image/png,"+
-                                    "image/jpeg,"+
-                                    "text/html,"+
-                                    "text/plain,"+
-                                    "text/csv")
-                                    
-        # Do not show the Download Manager                  
-        self.profile.set_preference("browser.download.manager.showWhenStarting", False)
-        self.profile.set_preference("browser.download.manager.focusWhenStarting", False)
-        self.profile.set_preference("browser.download.manager.useWindow", False)
-        self.profile.set_preference("browser.download.manager.showAlertOnComplete", False)
-        self.profile.set_preference("browser.download.manager.closeWhenDone", False)
-        
-        # Do not ask what to do with an unknown MIME type
-        self.profile.set_preference("browser.helperApps.alwaysAsk.force", False)
-        
-        self.profile.set_proxy(self.proxy.selenium_proxy())
-        
-        self.driver = webdriver.Firefox(firefox_profile=self.profile)
-        
-        self.driver.set_page_load_timeout(self.timeout)
+        return proxy
+    
+    def launch_driver(self, proxy):
+        
+        marionette_port = free_port()
+        
+        # Only the preferences of this launch are patched in the clone of the template
+        preferences = proxy_preferences(proxy.proxy) if proxy else {}
+        preferences["browser.download.dir"] = self.temp_dir
+        preferences["marionette.port"] = marionette_port
+        
+        profile_path = self.profiles.acquire(preferences)
+        
+        # Run Firefox directly on the cloned profile, so Selenium does not
+        # copy and serialize it
+        options = webdriver.FirefoxOptions()
+        options.add_argument("-profile")
+        options.add_argument(profile_path)
+        
+        if self.profile_template.cache_mode == "cold":
+            # Let clear_cache run scripts in the chrome context
+            options.add_argument("-remote-allow-system-access")
+        
+        service = Service(service_args=["--marionette-port", str(marionette_port)])
+        
+        try:
+            driver = webdriver.Firefox(options=options, service=service)
+        except:
+            self.profiles.release(profile_path)
+            raise
+        
+        driver.profile_path = profile_path
+        
+        driver.set_page_load_timeout(self.timeout)
+        
+        return driver
+    
+    '''
+    Close a browser and its proxy
+    '''
+    def close_browser(self, proxy, driver, error=None):
+        
+        try:
+            driver.quit()
+        except:
+            print("Browser "+ str(self.id) +": - Unable to close the browser: ", error)
+        
+        self.profiles.release(driver.profile_path)
+        
+        try:
+            if proxy:
+                proxy.close()
+        except:
+            print("Browser "+ str(self.id) +": - Unable to close the proxy: ", error)
+    
+    '''
+    Start browser and proxy
+    '''
+    def start_browser(self):
+        
+        with self.timer.phase("start_browser"):
+            self.proxy, self.driver = self.launch()
+    
+    '''
+    Replace browser and proxy, with a warm spare if there is one ready.
+    Returns the time spent in seconds.
+    '''
+    def restart_browser(self, error):
+        
+        start_time = time.time()
+        
+        self.close_browser(self.proxy, self.driver, error)
+        
+        self.proxy = self.driver = None
+        
+        from_spare = False
+        
+        while self.spares and not from_spare:
+            
+            spare = self.spares.pop(0)
+            
+            try:
+                self.proxy, self.driver = spare.take()
+                from_spare = True
+            except Exception as e:
+                print("Browser "+ str(self.id) +": - Spare browser failed: ", e)
+        
+        # Closing and taking a spare, a new browser is timed as start_browser
+        self.timer.add("restart", time.time()-start_time)
+        
+        if not from_spare:
+            self.start_browser()
+        
+        self.fill_spares()
+        
+        restart_time = time.time()-start_time
+        
+        self.hars_queue.put({"type": "restart",
+                             "browser": self.id,
+                             "seconds": restart_time,
+                             "spare": from_spare})
+        
+        return restart_time
+    
+    '''
+    Empty the cache of the browser, so the next page is loaded from the network
+    '''
+    def clear_cache(self):
+        
+        with self.driver.context(self.driver.CONTEXT_CHROME):
+            self.driver.execute_script(CLEAR_CACHE_SCRIPT)
+    
+    '''
+    Stop loading the current page and leave it, keeping browser and proxy
+    '''
+    def soft_reset(self):
+        
+        self.driver.execute_script("window.stop();")
+        self.driver.get("about:blank")
+    
+    '''
+    Recover from a failed page with the cheapest step that works: a timeout
+    only needs a soft reset, while a dead browser or proxy (or a failed soft
+    reset) needs a hard restart. The failure is sent back as a record.
+    '''
+    def recover(self, url, error):
+        
+        start_time = time.time()
+        
+        kind = failure_kind(error)
+        
+        recovery = "soft"
+        
+        if kind == "timeout":
+            try:
+                with self.timer.phase("soft_reset"):
+                    self.soft_reset()
+            except Exception:
+                recovery = "hard"
+        else:
+            recovery = "hard"
+        
+        if recovery == "hard":
+            self.restart_browser(error)
         
+        self.hars_queue.put({"type": "failure",
+                             "browser": self.id,
+                             "url": url,
+                             "kind": kind,
+                             "error": (str(error) or type(error).__name__).strip(),
+                             "recovery": recovery,
+                             "seconds": time.time()-start_time,
+                             "time": start_time})
+    
+    '''
+    Launch spares in background until there are spares_num of them
+    '''
+    def fill_spares(self):
+        
+        while len(self.spares) < self.spares_num:
+            
+            try:
+                proxy = self.launch_proxy()
+            except Exception as e:
+                # Try again at the next restart
+                print("Browser "+ str(self.id) +": - Unable to create the proxy of a spare browser: ", e)
+                return
+            
+            self.spares.append(WarmSpare(proxy, self.launch_driver, self.close_browser))
+    
     def run(self):
         
+        counter=0
+        
+        shard = None
+        
+        stop_profiler = None
+        
+        # Wall time measured from the start of the process
+        self.timer = PhaseTimer()
+        
         try:
             
             print ("Starting browser: "+ str(self.id))
             
+            shard = HarShardWriter(self.har_shard)
+            
+            self.profiles = ProfilePool(self.profile_template, self.temp_dir)
+            
+            start_time = time.time()
+            
             self.start_browser()
             
-            counter=0
+            # Ready to receive URLs
+            self.hars_queue.put({"type": "ready",
+                                 "browser": self.id,
+                                 "seconds": time.time()-start_time})
+            
+            self.fill_spares()
+            
+            if self.profiler:
+                stop_profiler = start_profiler(self.profiler, os.path.join(os.path.dirname(self.har_shard),
+                                                                           "profile_"+str(self.id)))
+            
+            timer = self.timer
             
-            hars=[]
+            cold_cache = self.profile_template.cache_mode == "cold"
             
-            url = self.urls_queue.get()
+            with timer.phase("queue_get"):
+                item = self.urls_queue.get()
             
-            while url:
+            while item:
+                
+                # URL and time when the scheduler wanted it to be requested
+                url, intended_start = item
                 
                 counter+=1
                 
                 try:
                     
-                    self.proxy.new_har(ref=url, options={"captureHeaders": self.save_headers})
+                    if cold_cache:
+                        with timer.phase("clear_cache"):
+                            self.clear_cache()
+                    
+                    if self.proxy:
+                        with timer.phase("new_har"):
+                            self.proxy.new_har(ref=url, options={"captureHeaders": self.save_headers})
                     
                     print("Browser "+ str(self.id) +": ", url)
                     
+                    with timer.phase("queue_put"):
+                        self.hars_queue.put({"type": "start",
+                                             "browser": self.id,
+                                             "url": url})
+                    
                     start_time = time.time()
                     
-                    self.driver.get(url)
+                    with timer.phase("page_load"):
+                        self.driver.get(url)
                     
-                    total_time = (time.time()-start_time)*1000
+                    end_time = time.time()
                     
-                    current_har = self.proxy.har
-                
-                    current_har["log"]["totalTime"] = total_time
-                
-                    hars.append(current_har)
+                    # Service time, as seen by the browser
+                    total_time = (end_time-start_time)*1000
                     
-                except Exception as e:
+                    # Time spent waiting for a free browser
+                    queue_time = max(0, start_time-intended_start)*1000
                     
-                    if isinstance(e, TimeoutException):
-                        
-                        print ("Browser "+ str(self.id) +": Request timed out")
-                    
-                    elif isinstance(e, socket_error):
-                        if e.errno == errno.ECONNREFUSED:
-                            print ("Browser "+ str(self.id) +": Proxy offline")
-                        else:
-                            print ("Browser "+ str(self.id) +": Proxy error")
-                    else: 
-                        
-                        print("Browser "+ str(self.id) +": Exception: ", e)
+                    # Latency from the intended start, as seen by the user
+                    latency = (end_time-min(start_time, intended_start))*1000
+                    
+                    if self.proxy:
+                        # (the proxy client decodes the JSON of the HAR it fetches)
+                        with timer.phase("har_fetch"):
+                            current_har = self.proxy.har
+                    else:
+                        with timer.phase("har_fetch"):
+                            timing = self.driver.execute_script(RESOURCE_TIMING_SCRIPT)
                         
-                    # Restart browser and proxy
+                        with timer.phase("har_decode"):
+                            current_har = timing_har(url, json.loads(timing))
+                
+                    current_har["log"]["totalTime"] = total_time
+                    current_har["log"]["queueTime"] = queue_time
+                    current_har["log"]["latency"] = latency
+                    current_har["log"]["intendedStart"] = intended_start
                     
-                    try:
-                        self.driver.quit()
-                    except:
-                        print("Browser "+ str(self.id) +": - Unable to close the browser: ", e)
+                    with timer.phase("har_write"):
+                        shard.write(current_har)
                     
-                    try:
-                        self.proxy.close()
-                    except:
-                        print("Browser "+ str(self.id) +": - Unable to close the proxy: ", e)
+                    # Send back a small completion record, the HAR stays on disk
+                    with timer.phase("queue_put"):
+                        self.hars_queue.put({"type": "page",
+                                             "browser": self.id,
+                                             "shard": self.server.index,
+                                             "url": url,
+                                             "totalTime": total_time,
+                                             "queueTime": queue_time,
+                                             "latency": latency,
+                                             "entries": len(current_har["log"]["entries"]),
+                                             "timings": phase_totals(current_har)})
+                    
+                except Exception as e:
                     
-                    self.start_browser()
+                    self.recover(url, e)
                 
-                url = self.urls_queue.get()
+                with timer.phase("queue_get"):
+                    item = self.urls_queue.get()
 
         except KeyboardInterrupt:
             pass
@@ -169,20 +448,59 @@ class Browser(Process):
             traceback.print_exc()
             
         finally:
-            # Send back HARs
-            self.hars_queue.put(hars)
+            if stop_profiler:
+                stop_profiler()
+            
+            if shard:
+                shard.close()
+            
+            # Notify that all the HARs of this browser are in its shard
+            self.hars_queue.put({"type": "done",
+                                 "browser": self.id,
+                                 "pages": counter,
+                                 "shard": self.har_shard,
+                                 "phases": self.timer.report()})
             
             self.urls_queue.close()
             self.hars_queue.close()
             
-            try:
-                self.driver.quit()
-            except AttributeError:
-                pass
+            if getattr(self, "driver", None):
+                self.close_browser(self.proxy, self.driver)
             
-            try:
-                self.proxy.close()
-            except:
-                pass
+            for spare in self.spares:
+                spare.close()
         
         print ("Browser "+ str(self.id) +": processed ", counter, " pages")
+
+'''
+Kind of the failure of a page: timeout (the page did not load in time),
+connection (the proxy or the driver cannot be reached), driver (the
+browser failed) or other
+'''
+def failure_kind(error):
+    
+    if isinstance(error, TimeoutException):
+        return "timeout"
+    
+    if isinstance(error, socket_error):
+        return "connection"
+    
+    if isinstance(error, WebDriverException):
+        return "driver"
+    
+    return "other"
+
+'''
+Sum of each phase over the resources of a HAR, sent with the page records
+for the live metrics
+'''
+def phase_totals(har):
+    
+    totals = dict.fromkeys(TIMINGS, 0.0)
+    
+    for entry in har["log"]["entries"]:
+        for key, value in entry["timings"].items():
+            if key in totals and value and value > 0:
+                totals[key] += value
+    
+    return totals
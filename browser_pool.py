@@ -0,0 +1,232 @@
+import json
+import time
+import queue
+
+from circuit_breaker import CircuitBreakers
+
+'''
+Pool of Browser processes.
+
+All the browsers are launched at once, so they start in parallel, and
+URLs should be dispatched only after wait_ready: a browser is ready when
+its proxy and Firefox are up. The pool consumes the records sent back by
+the browsers and keeps the startup and replacement latencies.
+
+Failures reported by the browsers are appended to failures_path (one JSON
+record per line) and feed per-domain circuit breakers: pages of a domain
+whose breaker is open are not dispatched, and are recorded as skipped.
+'''
+class BrowserPool:
+
+    def __init__(self, browsers, urls_queue, hars_queue, failures_path=None, breakers=None,
+                 metrics=None, checkpoint=None):
+
+        self.browsers = browsers
+        self.urls_queue = urls_queue
+        self.hars_queue = hars_queue
+
+        self.start_time = None
+
+        # Browser id -> seconds from the start of the pool to its readiness
+        self.ready = {}
+
+        # Browser id -> "done" record
+        self.finished = {}
+
+        self.restarts = []
+
+        self.pages = 0
+
+        # Proxy shard -> number of pages
+        self.pages_by_shard = {}
+
+        self.breakers = breakers or CircuitBreakers(threshold=0)
+
+        self.failures_file = open(failures_path, "a") if failures_path else None
+
+        # (kind, recovery) -> number of failures
+        self.failures = {}
+
+        # Live metrics and checkpoint of the progress, fed with every record
+        self.metrics = metrics
+        self.checkpoint = checkpoint
+
+    def start(self):
+
+        self.start_time = time.time()
+
+        for browser in self.browsers:
+            browser.start()
+
+    '''
+    Wait until all the browsers are ready (or have terminated), at most timeout seconds.
+    Returns the number of ready browsers.
+    '''
+    def wait_ready(self, timeout):
+
+        deadline = time.time() + timeout
+
+        while len(self.ready) + len(self.finished) < len(self.browsers):
+
+            remaining = deadline - time.time()
+
+            if remaining <= 0:
+                print("Timed out waiting for the browsers: "+str(len(self.ready))+" ready")
+                break
+
+            self.handle_next(min(remaining, 1))
+
+        return len(self.ready)
+
+    def dispatch(self, url, intended_start):
+
+        # Update the breakers with the records sent so far
+        while self.handle_next(0):
+            pass
+
+        if self.metrics:
+            self.metrics.dispatch(intended_start)
+
+        if not self.breakers.allow(url):
+            self.handle({"type": "failure",
+                         "browser": None,
+                         "url": url,
+                         "kind": "skipped",
+                         "error": "circuit breaker open",
+                         "recovery": None,
+                         "seconds": 0,
+                         "time": time.time()})
+            return
+
+        self.send(url, intended_start)
+
+    def send(self, url, intended_start):
+
+        self.urls_queue.put((url, intended_start))
+
+    '''
+    Process the next record sent by the browsers, if it arrives within timeout seconds.
+    Returns False if there was no record.
+    '''
+    def handle_next(self, timeout):
+
+        try:
+            record = self.hars_queue.get(timeout=timeout)
+        except queue.Empty:
+            return False
+
+        self.handle(record)
+
+        return True
+
+    '''
+    Process the records sent by the browsers for the given seconds:
+    used by the scheduler in place of sleeping between dispatches
+    '''
+    def wait(self, seconds):
+
+        deadline = time.monotonic() + seconds
+
+        while True:
+
+            remaining = deadline - time.monotonic()
+
+            if remaining <= 0:
+                break
+
+            self.handle_next(remaining)
+
+    def handle(self, record):
+
+        if self.metrics:
+            self.metrics.observe(record)
+
+        if self.checkpoint:
+            self.checkpoint.observe(record)
+
+        if record["type"] == "page":
+            self.pages += 1
+            self.pages_by_shard[record["shard"]] = self.pages_by_shard.get(record["shard"], 0) + 1
+            self.breakers.success(record["url"])
+
+        elif record["type"] == "failure":
+            self.record_failure(record)
+
+            if record["kind"] == "timeout":
+                self.breakers.failure(record["url"])
+
+        elif record["type"] == "ready":
+            self.ready[record["browser"]] = time.time() - self.start_time
+
+        elif record["type"] == "restart":
+            self.restarts.append(record)
+
+        elif record["type"] == "done":
+            self.finished[record["browser"]] = record
+
+    def record_failure(self, record):
+
+        key = (record["kind"], record["recovery"])
+        self.failures[key] = self.failures.get(key, 0) + 1
+
+        if self.failures_file:
+            self.failures_file.write(json.dumps(record) + "\n")
+            self.failures_file.flush()
+
+    '''
+    Tell the browsers that there are no more URLs and wait for them to
+    flush their HARs
+    '''
+    def finish(self):
+
+        for browser in self.browsers:
+            self.urls_queue.put(None)
+
+        while len(self.finished) < len(self.browsers):
+
+            if not self.handle_next(1) and not any(b.is_alive() for b in self.browsers):
+                print("Browsers terminated without notifying")
+                break
+
+        if self.failures_file:
+            self.failures_file.close()
+
+    def join(self):
+
+        for browser in self.browsers:
+            browser.join()
+
+    def close(self):
+
+        self.urls_queue.close()
+        self.hars_queue.close()
+
+    '''
+    Paths of the HAR shards written by the browsers
+    '''
+    def har_shards(self):
+
+        return [browser.har_shard for browser in self.browsers]
+
+    def report(self):
+
+        startup = sorted(self.ready.values())
+        replacements = [r["seconds"] for r in self.restarts]
+        from_spare = [r["seconds"] for r in self.restarts if r["spare"]]
+
+        return {
+                "browsers": len(self.browsers),
+                "ready": len(self.ready),
+                "startup_seconds": self.ready,
+                "all_ready_seconds": startup[-1] if startup else None,
+                "pages": self.pages,
+                "restarts": len(self.restarts),
+                "restarts_from_spare": len(from_spare),
+                "mean_replacement_seconds": sum(replacements)/len(replacements) if replacements else None,
+                "mean_spare_replacement_seconds": sum(from_spare)/len(from_spare) if from_spare else None,
+                "replacement_seconds": replacements,
+                "failures": sum(self.failures.values()),
+                "failures_by_kind": {kind + ("/" + recovery if recovery else ""): n
+                                     for (kind, recovery), n in self.failures.items()},
+                "circuit_breakers": self.breakers.report()
+                }
@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import hashlib
+import collections
+import numpy as np
+
+from har_io import iter_hars
+from scheduler import ArrivalScheduler
+
+CHECKPOINT_FORMAT = "checkpoint-2"
+
+'''
+Progress of a run: the state of the generator of the thinking times
+before the schedule was drawn, so a resumed run draws the same schedule,
+and the number of pages dispatched. Pages are identified by their position
+in the list of URLs to request.
+
+Every dispatch is appended at once to a journal (checkpoint.jsonl next to
+checkpoint.json), so a killed run never forgets a page it requested; at
+most every interval seconds the state is saved in checkpoint.json and the
+journal is emptied.
+
+Completions are not kept here: the HARs of the completed pages are in the
+shards of the browsers, written before the pages are reported, and the
+failed pages are in failures.jsonl, so a resumed run counts them there
+(completed_pages) and requests again only the other pages dispatched.
+'''
+class Checkpoint:
+
+    def __init__(self, path, interval=60, rng_state=None):
+
+        self.path = path
+        self.interval = interval
+
+        self.journal_path = os.path.splitext(path)[0] + ".jsonl"
+        self.journal = None
+
+        self.rng_state = rng_state
+
+        self.urls_num = None
+        self.urls_hash = None
+
+        self.dispatched_num = 0
+
+        self.finished = False
+
+        self.last_save = time.monotonic()
+
+    @classmethod
+    def load(cls, path, interval=60):
+
+        with open(path) as f:
+            state = json.load(f)
+
+        if state.get("format") != CHECKPOINT_FORMAT:
+            raise ValueError("Unknown checkpoint format: " + path)
+
+        checkpoint = cls(path, interval, state["rng_state"])
+
+        checkpoint.urls_num = state["urls"]
+        checkpoint.urls_hash = state["urls_hash"]
+        checkpoint.dispatched_num = state["dispatched"]
+        checkpoint.finished = state["finished"]
+
+        # Dispatches after the last save
+        if os.path.isfile(checkpoint.journal_path):
+            with open(checkpoint.journal_path) as f:
+                for line in f:
+                    try:
+                        checkpoint.dispatched_num = max(checkpoint.dispatched_num,
+                                                        json.loads(line)["dispatched"])
+                    except (ValueError, KeyError):
+                        # A line truncated by an interruption
+                        continue
+
+        return checkpoint
+
+    '''
+    Items (position, url) still to request and their scheduler. completed
+    counts the pages of each URL already loaded or failed (completed_pages):
+    the pages dispatched and not completed go first, then the following
+    pages keep their spacing in the schedule.
+    '''
+    def remaining(self, urls, scheduler, completed=None):
+
+        urls_hash = hashlib.sha1("\n".join(urls).encode("utf-8")).hexdigest()
+
+        if self.urls_num is None:
+            self.urls_num = len(urls)
+            self.urls_hash = urls_hash
+
+        elif (self.urls_num, self.urls_hash) != (len(urls), urls_hash):
+            raise ValueError("The URLs to request differ from those of the checkpoint")
+
+        # Pages of each URL dispatched and not completed: pages of the same
+        # URL are interchangeable, so the last ones dispatched are requested again
+        left = collections.Counter(urls[:self.dispatched_num])
+        left.subtract(completed or {})
+
+        pending = []
+
+        for position in range(self.dispatched_num - 1, -1, -1):
+            if left[urls[position]] > 0:
+                left[urls[position]] -= 1
+                pending.append(position)
+
+        pending.reverse()
+
+        items = [(position, urls[position]) for position in pending]
+        items += [(position, urls[position]) for position in range(self.dispatched_num, len(urls))]
+
+        offsets = scheduler.offsets[self.dispatched_num:len(urls)]
+
+        if offsets.size:
+            offsets = offsets - offsets[0]
+
+        return items, ArrivalScheduler(np.concatenate((np.zeros(len(pending)), offsets)))
+
+    '''
+    Called before the page at position is sent to the browsers
+    '''
+    def dispatched(self, position, url):
+
+        if position >= self.dispatched_num:
+
+            self.dispatched_num = position + 1
+
+            if self.journal is None:
+                self.journal = open(self.journal_path, "a")
+
+            self.journal.write(json.dumps({"dispatched": self.dispatched_num}) + "\n")
+            self.journal.flush()
+
+        self.maybe_save()
+
+    '''
+    Called with the records sent by the browsers, which are durable already
+    '''
+    def observe(self, record):
+
+        self.maybe_save()
+
+    def maybe_save(self):
+
+        if time.monotonic() - self.last_save >= self.interval:
+            self.save()
+
+    def save(self):
+
+        state = {
+                 "format": CHECKPOINT_FORMAT,
+                 "time": time.time(),
+                 "urls": self.urls_num,
+                 "urls_hash": self.urls_hash,
+                 "dispatched": self.dispatched_num,
+                 "rng_state": self.rng_state,
+                 "finished": self.finished
+                 }
+
+        # Replace the file at once, so a crash never leaves half a checkpoint
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(self.path + ".tmp", self.path)
+
+        # The journal holds only what the checkpoint does not. Replaying it
+        # over the new checkpoint is harmless, so a crash before it is
+        # emptied loses nothing.
+        if self.journal:
+            self.journal.truncate(0)
+
+        self.last_save = time.monotonic()
+
+    def close(self):
+
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+
+'''
+Pages of each URL completed by the interrupted runs: the pages whose HAR is
+in the shards and the pages recorded in the failures file
+'''
+def completed_pages(shards, failures_path):
+
+    completed = collections.Counter()
+
+    for shard in shards:
+        for har in iter_hars(shard):
+            pages = har["log"].get("pages")
+
+            if pages:
+                completed[pages[0]["id"]] += 1
+
+    if os.path.isfile(failures_path):
+        with open(failures_path) as f:
+            for line in f:
+                try:
+                    completed[json.loads(line)["url"]] += 1
+                except (ValueError, KeyError):
+                    continue
+
+    return completed
@@ -0,0 +1,85 @@
+import time
+
+from urllib.parse import urlsplit
+
+'''
+Per-domain circuit breakers.
+
+A domain whose pages time out threshold times in a row is opened: its
+pages are skipped for cooldown seconds, then one page is let through as
+a probe. A successful page closes the breaker, a new timeout opens it
+again for another cooldown. A threshold of 0 disables the breakers.
+'''
+class CircuitBreakers:
+
+    def __init__(self, threshold=3, cooldown=60):
+
+        self.threshold = threshold
+        self.cooldown = cooldown
+
+        # Domain -> consecutive timeouts
+        self.failures = {}
+
+        # Domain -> time when the breaker was opened (or probed)
+        self.opened = {}
+
+        # Domain -> times the breaker was opened
+        self.trips = {}
+
+        # Domain -> pages skipped
+        self.skipped = {}
+
+    '''
+    True if a page of url can be requested
+    '''
+    def allow(self, url, now=None):
+
+        domain = domain_of(url)
+
+        if domain not in self.opened:
+            return True
+
+        now = now or time.time()
+
+        if now - self.opened[domain] >= self.cooldown:
+            # Half open: let one page through and wait again for the next ones
+            self.opened[domain] = now
+            return True
+
+        self.skipped[domain] = self.skipped.get(domain, 0) + 1
+
+        return False
+
+    def success(self, url):
+
+        domain = domain_of(url)
+
+        self.failures.pop(domain, None)
+        self.opened.pop(domain, None)
+
+    def failure(self, url, now=None):
+
+        if not self.threshold:
+            return
+
+        domain = domain_of(url)
+
+        self.failures[domain] = self.failures.get(domain, 0) + 1
+
+        if self.failures[domain] >= self.threshold:
+            self.opened[domain] = now or time.time()
+            self.trips[domain] = self.trips.get(domain, 0) + 1
+
+    def report(self):
+
+        return {
+                "threshold": self.threshold,
+                "cooldown_seconds": self.cooldown,
+                "open": sorted(self.opened),
+                "trips": self.trips,
+                "skipped": self.skipped
+                }
+
+def domain_of(url):
+
+    return (urlsplit(url).hostname or "").lower()
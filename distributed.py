@@ -0,0 +1,455 @@
+import os
+import json
+import time
+import queue
+import socket
+import asyncio
+import tempfile
+import threading
+
+from multiprocessing import Queue
+
+from http1 import STREAM_LIMIT
+from browser_pool import BrowserPool
+
+'''
+Coordinator and agents of a simulation spread over several hosts.
+
+They talk over TCP with JSON messages, one per line; a HAR is sent as a
+"har" message with its size, followed by its bytes as they are in the
+shard of the browser, so the coordinator writes the same shards of a
+single-node run.
+
+    agent -> coordinator    hello {browsers, node}
+    coordinator -> agent    config {base_id, timeout, headers, capture, proxy, cache_mode}
+    coordinator -> agent    url {url, intended_start}, ..., finish
+    agent -> coordinator    the records of its browsers (ready, page, failure,
+                            restart, done), each page preceded by its HAR,
+                            and at last agent_done {proxy_report}
+'''
+
+# Pages in flight on an agent for each of its browsers: one loading and
+# one waiting, so a browser never waits for the network to get the next page
+PAGES_PER_BROWSER = 2
+
+async def send_message(writer, message, payload=b""):
+
+    writer.write(json.dumps(message).encode("ascii") + b"\n" + payload)
+
+    await writer.drain()
+
+async def read_message(reader):
+
+    line = await reader.readline()
+
+    if not line:
+        return None
+
+    return json.loads(line)
+
+def parse_address(address):
+
+    host, _, port = address.rpartition(":")
+
+    return host or "0.0.0.0", int(port)
+
+'''
+Browser pool whose browsers run on remote agents.
+
+The pool listens for agents_num agents, gives each one a range of browser
+ids and the settings of the run, and sends pages to the agent with the
+most free slots. An agent has PAGES_PER_BROWSER slots for each of its
+browsers and gets a slot back with every page (or failure) it reports:
+when all the slots are taken dispatch waits, as with a full urls queue.
+The records of the agents are handled as those of local browsers and their
+HARs are written in HARs_<browser>.jsonl in out_folder.
+'''
+class RemotePool(BrowserPool):
+
+    def __init__(self, address, agents_num, out_folder, config,
+                 failures_path=None, breakers=None, metrics=None, checkpoint=None):
+
+        super().__init__([], None, queue.Queue(), failures_path, breakers, metrics, checkpoint)
+
+        self.address = address
+        self.agents_num = agents_num
+        self.out_folder = out_folder
+        self.config = config
+
+        self.agents = []
+
+        # Browser id -> agent
+        self.agent_of = {}
+
+        # Browser id -> open shard file
+        self.shard_files = {}
+
+        self.next_id = 0
+
+        self.loop = asyncio.new_event_loop()
+
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def start(self):
+
+        self.start_time = time.time()
+
+        self.run_async(self.listen())
+
+        print("Waiting for "+str(self.agents_num)+" agents on "+self.address)
+
+    def run_async(self, coroutine):
+
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def listen(self):
+
+        self.changed = asyncio.Condition()
+
+        host, port = parse_address(self.address)
+
+        self.server = await asyncio.start_server(self.serve_agent, host, port, limit=STREAM_LIMIT)
+
+    '''
+    Wait for the agents to connect and for their browsers to be ready
+    '''
+    def wait_ready(self, timeout):
+
+        deadline = time.time() + timeout
+
+        while len(self.agents) < self.agents_num:
+
+            if time.time() > deadline:
+                print("Timed out waiting for the agents: "+str(len(self.agents))+" connected")
+                break
+
+            time.sleep(0.1)
+
+        return super().wait_ready(max(0, deadline - time.time()))
+
+    async def serve_agent(self, reader, writer):
+
+        hello = await read_message(reader)
+
+        if not hello or hello["type"] != "hello" or len(self.agents) >= self.agents_num:
+            writer.close()
+            return
+
+        ids = list(range(self.next_id, self.next_id + hello["browsers"]))
+        self.next_id += hello["browsers"]
+
+        agent = {
+                 "node": hello["node"],
+                 "browsers": ids,
+                 "slots": PAGES_PER_BROWSER * len(ids),
+                 "writer": writer,
+                 "done": False,
+                 "proxy_report": []
+                 }
+
+        config = dict(self.config)
+        config.update({"type": "config", "base_id": ids[0] if ids else 0})
+
+        await send_message(writer, config)
+
+        for browser_id in ids:
+            self.agent_of[browser_id] = agent
+            self.shard_files[browser_id] = open(self.shard_path(browser_id), "ab")
+
+        self.browsers.extend(ids)
+        self.agents.append(agent)
+
+        print("Agent "+agent["node"]+" connected with "+str(len(ids))+" browsers")
+
+        try:
+            while True:
+
+                message = await read_message(reader)
+
+                if message is None:
+                    print("Agent "+agent["node"]+" disconnected")
+                    break
+
+                if message["type"] == "har":
+                    self.shard_files[message["browser"]].write(await reader.readexactly(message["size"]))
+                    continue
+
+                if message["type"] == "agent_done":
+                    agent["proxy_report"] = message["proxy_report"]
+                    break
+
+                if message["type"] in ("page", "failure"):
+                    async with self.changed:
+                        agent["slots"] += 1
+                        self.changed.notify_all()
+
+                elif message["type"] == "done":
+                    self.shard_files[message["browser"]].close()
+                    message["shard"] = self.shard_path(message["browser"])
+
+                self.hars_queue.put(message)
+
+        except (ConnectionError, asyncio.IncompleteReadError):
+            print("Agent "+agent["node"]+" disconnected")
+
+        finally:
+            for browser_id in ids:
+                self.shard_files[browser_id].close()
+
+            async with self.changed:
+                agent["done"] = True
+                self.changed.notify_all()
+
+            writer.close()
+
+    def shard_path(self, browser_id):
+
+        return os.path.join(self.out_folder, "HARs_"+str(browser_id)+".jsonl")
+
+    def send(self, url, intended_start):
+
+        self.run_async(self.send_url(url, intended_start))
+
+    async def send_url(self, url, intended_start):
+
+        async with self.changed:
+
+            await self.changed.wait_for(lambda: all(a["done"] for a in self.agents) or
+                                        any(a["slots"] > 0 and not a["done"] for a in self.agents))
+
+            live = [a for a in self.agents if not a["done"]]
+
+            if not live:
+                raise RuntimeError("No agents connected")
+
+            agent = max(live, key=lambda a: a["slots"])
+
+            agent["slots"] -= 1
+
+        await send_message(agent["writer"], {"type": "url", "url": url, "intended_start": intended_start})
+
+    '''
+    Tell the agents that there are no more URLs and wait for them to send
+    back all their records
+    '''
+    def finish(self):
+
+        self.run_async(self.send_finish())
+
+        while not all(agent["done"] for agent in self.agents):
+            self.handle_next(1)
+
+        while self.handle_next(0):
+            pass
+
+        if self.failures_file:
+            self.failures_file.close()
+
+    async def send_finish(self):
+
+        for agent in self.agents:
+            if not agent["done"]:
+                try:
+                    await send_message(agent["writer"], {"type": "finish"})
+                except ConnectionError:
+                    pass
+
+    def join(self):
+        pass
+
+    def close(self):
+
+        async def shutdown():
+
+            if getattr(self, "server", None):
+                self.server.close()
+
+            for agent in self.agents:
+                agent["writer"].close()
+
+        self.run_async(shutdown())
+
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def har_shards(self):
+
+        return [self.shard_path(browser_id) for browser_id in self.browsers]
+
+    '''
+    Reports of the proxy shards of all the agents
+    '''
+    def proxy_report(self):
+
+        return [dict(shard, node=agent["node"]) for agent in self.agents
+                for shard in agent["proxy_report"]]
+
+'''
+Agent running a local pool of browsers for a coordinator.
+
+The settings of the run come from the coordinator, while the browsers,
+the proxies and the profile cache are those of the node. The HARs of the
+browsers are written in shards in a temporary folder and streamed to the
+coordinator as soon as each page is reported.
+'''
+class Agent:
+
+    def __init__(self, address, browsers_num, spare_browsers=0, proxy_shards_num=1,
+                 proxy_port=8080, profile_cache=None, browser_mob_proxy_location=None):
+
+        self.address = address
+        self.browsers_num = browsers_num
+        self.spare_browsers = spare_browsers
+        self.proxy_shards_num = proxy_shards_num
+        self.proxy_port = proxy_port
+        self.profile_cache = profile_cache
+        self.browser_mob_proxy_location = browser_mob_proxy_location
+
+        self.browsers = []
+        self.proxy_shards = None
+
+    def run(self):
+
+        asyncio.run(self.serve())
+
+    async def serve(self):
+
+        host, port = parse_address(self.address)
+
+        reader, writer = await asyncio.open_connection(host, port, limit=STREAM_LIMIT)
+
+        await send_message(writer, {"type": "hello",
+                                    "browsers": self.browsers_num,
+                                    "node": socket.gethostname()})
+
+        config = await read_message(reader)
+
+        if not config or config["type"] != "config":
+            print("Rejected by the coordinator")
+            return
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+        try:
+            await asyncio.to_thread(self.start_browsers, config)
+
+            await asyncio.gather(self.receive_urls(reader), self.forward_records(writer))
+
+            for browser in self.browsers:
+                await asyncio.to_thread(browser.join)
+
+        finally:
+            if self.proxy_shards:
+                self.proxy_shards.stop()
+
+            writer.close()
+
+            self.temp_dir.cleanup()
+
+    def start_browsers(self, config):
+
+        from browser import Browser
+        from har_proxy import HarProxyShards
+        from proxy_shards import ProxyShards
+        from profile_template import ProfileTemplate
+
+        profile_template = ProfileTemplate(config["cache_mode"], self.profile_cache)
+
+        if config["proxy"] == "asyncio" or config["capture"] == "timing":
+            self.proxy_shards = HarProxyShards()
+        else:
+            self.proxy_shards = ProxyShards(self.browser_mob_proxy_location,
+                                            self.proxy_shards_num, self.proxy_port)
+
+        self.proxy_shards.start()
+
+        self.urls_queue = Queue()
+        self.hars_queue = Queue()
+
+        self.browsers = [Browser(config["base_id"]+i, self.proxy_shards.shard_for(i),
+                                 self.urls_queue, self.hars_queue,
+                                 config["timeout"], config["headers"],
+                                 self.temp_dir.name,
+                                 os.path.join(self.temp_dir.name,
+                                              "HARs_"+str(config["base_id"]+i)+".jsonl"),
+                                 profile_template,
+                                 self.spare_browsers, config["capture"])
+                         for i in range(self.browsers_num)]
+
+        self.start_time = time.time()
+
+        for browser in self.browsers:
+            browser.start()
+
+    async def receive_urls(self, reader):
+
+        while True:
+
+            message = await read_message(reader)
+
+            if message is None or message["type"] == "finish":
+                break
+
+            self.urls_queue.put((message["url"], message["intended_start"]))
+
+        for browser in self.browsers:
+            self.urls_queue.put(None)
+
+    async def forward_records(self, writer):
+
+        shards = {browser.id: browser.har_shard for browser in self.browsers}
+
+        # Browser id -> bytes of its shard already sent
+        sent = {browser_id: 0 for browser_id in shards}
+
+        pages_by_shard = {}
+
+        finished = 0
+
+        while finished < len(self.browsers):
+
+            try:
+                record = await asyncio.to_thread(self.hars_queue.get, True, 1)
+            except queue.Empty:
+                if not any(browser.is_alive() for browser in self.browsers):
+                    print("Browsers terminated without notifying")
+                    break
+                continue
+
+            if record["type"] in ("page", "done"):
+                sent[record["browser"]] = await self.send_hars(writer, record["browser"],
+                                                               shards[record["browser"]],
+                                                               sent[record["browser"]])
+
+            if record["type"] == "page":
+                pages_by_shard[record["shard"]] = pages_by_shard.get(record["shard"], 0) + 1
+
+            elif record["type"] == "done":
+                finished += 1
+
+            await send_message(writer, record)
+
+        await send_message(writer, {"type": "agent_done",
+                                    "proxy_report": self.proxy_shards.report(pages_by_shard,
+                                                                             time.time()-self.start_time)})
+
+    '''
+    Send the complete lines of a shard from offset on.
+    Returns the new offset.
+    '''
+    async def send_hars(self, writer, browser_id, shard, offset):
+
+        if not os.path.isfile(shard):
+            return offset
+
+        with open(shard, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+
+        data = data[:data.rfind(b"\n")+1]
+
+        for line in data.splitlines(keepends=True):
+            await send_message(writer, {"type": "har", "browser": browser_id, "size": len(line)}, line)
+
+        return offset + len(data)
@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import hashlib
+
+from timing_store import TimingStore
+
+HAR_CACHE_FORMAT = "har-cache-1"
+
+INDEX_NAME = "index.json"
+
+'''
+Timing stores of the HAR files already parsed, kept in a folder so that
+parsing a growing archive again only parses the files added or changed.
+
+Each file is identified by its real path, its size and its modification
+time; its timing store is saved in <folder>/<hash of the path>.npz with
+the report of its parsing. Stores hold all the entries with their https
+and error flags, and the filters are applied to the merged store, so the
+same cache serves runs with and without --no-https.
+'''
+class HarCache:
+
+    def __init__(self, folder):
+
+        self.folder = folder
+        self.index_path = os.path.join(folder, INDEX_NAME)
+
+        self.files = {}
+
+        if os.path.isfile(self.index_path):
+            try:
+                with open(self.index_path) as f:
+                    index = json.load(f)
+
+                if index.get("format") == HAR_CACHE_FORMAT:
+                    self.files = index["files"]
+                else:
+                    print("Ignoring HAR cache of unknown format "+self.index_path)
+
+            except (OSError, ValueError, KeyError):
+                print("Ignoring invalid HAR cache "+self.index_path)
+
+    '''
+    Return the timing store and the report of the file at path, or None if
+    it is not in the cache or changed since it was parsed
+    '''
+    def get(self, path):
+
+        key = os.path.realpath(path)
+        item = self.files.get(key)
+
+        if item is None or item["signature"] != signature(path):
+            return None
+
+        try:
+            store = TimingStore.load(os.path.join(self.folder, item["store"]))
+        except (OSError, ValueError, KeyError):
+            del self.files[key]
+            return None
+
+        return store, item["report"]
+
+    '''
+    Save the timing store and the report of the file at path, parsed when
+    its signature was file_signature
+    '''
+    def put(self, path, file_signature, store, report):
+
+        key = os.path.realpath(path)
+        name = hashlib.sha1(key.encode()).hexdigest() + ".npz"
+
+        store_path = os.path.join(self.folder, name)
+
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+
+            # Replace the file at once, so a crash never leaves half a store
+            with open(store_path + ".tmp", "wb") as f:
+                store.save(f)
+
+            os.replace(store_path + ".tmp", store_path)
+
+        except OSError as e:
+            print("Cannot save the HAR cache of "+path+": "+str(e))
+            return
+
+        self.files[key] = {"signature": file_signature, "store": name,
+                           "report": report, "time": time.time()}
+
+    '''
+    Write the index, leaving out (and deleting the stores of) the files
+    that do not exist any more
+    '''
+    def save(self):
+
+        for key in [key for key in self.files if not os.path.isfile(key)]:
+
+            try:
+                os.remove(os.path.join(self.folder, self.files[key]["store"]))
+            except OSError:
+                pass
+
+            del self.files[key]
+
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+
+            with open(self.index_path + ".tmp", "w") as f:
+                json.dump({"format": HAR_CACHE_FORMAT, "files": self.files}, f, indent=2)
+
+            os.replace(self.index_path + ".tmp", self.index_path)
+
+        except OSError as e:
+            print("Cannot save the HAR cache index "+self.index_path+": "+str(e))
+
+'''
+Size and modification time (in ns) of the file at path: a file whose
+signature changed is parsed again
+'''
+def signature(path):
+
+    stat = os.stat(path)
+
+    return [stat.st_size, stat.st_mtime_ns]
@@ -0,0 +1,332 @@
+import os
+import numpy as np
+
+from urllib.parse import urlsplit
+
+from timing_store import TimingStore, TIMINGS, PAGE_TIMINGS, BATCH_SIZE
+from utils import encode_strings, decode_strings
+
+COLUMNS_FORMAT = "har-columns-1"
+
+# Backends of the columnar files: Parquet needs pyarrow, npz only numpy
+BACKENDS = ("parquet", "npz")
+
+# Columns of the tables, with their types. Entries refer to their page
+# by its row in the pages table, headers to their entry by its row in
+# the entries table
+ENTRY_COLUMNS = ((("page", "int64"), ("url", "string"), ("host", "string"),
+                  ("method", "string"), ("status", "int32"), ("mime", "string"),
+                  ("request_headers_size", "int64"), ("request_body_size", "int64"),
+                  ("response_headers_size", "int64"), ("response_body_size", "int64"),
+                  ("content_size", "int64"), ("https", "bool"), ("error", "bool"))
+                 + tuple((key, "float64") for key in TIMINGS))
+
+PAGE_COLUMNS = ((("url", "string"), ("entries", "int64"))
+                + tuple((key, "float64") for key in PAGE_TIMINGS))
+
+HEADER_COLUMNS = (("entry", "int64"), ("response", "bool"),
+                  ("name", "string"), ("value", "string"))
+
+TABLES = {"entries": ENTRY_COLUMNS, "pages": PAGE_COLUMNS, "headers": HEADER_COLUMNS}
+
+'''
+Columnar, compressed copy of a set of HARs, with one row per entry.
+
+Besides the entries there is a table of the pages, with their timings,
+and a table of the headers, written only if the HARs have headers.
+With pyarrow each table is a Parquet file compressed with zstd (path.parquet,
+path.pages.parquet and path.headers.parquet), otherwise all of them are in
+a single compressed npz file (path.npz), where the strings are dictionary
+encoded. Either way a reader loads only the columns it needs.
+
+Rows are buffered and converted to columns in batches of BATCH_SIZE rows,
+as in the timing store.
+'''
+class ColumnarWriter:
+
+    def __init__(self, path, backend=None):
+
+        if backend is None:
+            backend = "parquet" if parquet_available() else "npz"
+
+        self.backend = ParquetTables(path) if backend == "parquet" else NpzTables(path)
+
+        self.path = self.backend.path
+
+        self.pages_num = 0
+        self.entries_num = 0
+
+        self.rows = {table: [] for table in TABLES}
+
+    def add_har(self, har):
+
+        log = har["log"]
+
+        pages = log.get("pages")
+
+        self.rows["pages"].append((pages[0].get("id", "") if pages else "", len(log["entries"]))
+                                  + tuple(log.get(key, -1) for key in PAGE_TIMINGS))
+
+        for entry in log["entries"]:
+
+            request = entry["request"]
+            response = entry.get("response", {})
+            timings = entry["timings"]
+
+            url = request["url"]
+
+            self.rows["entries"].append((self.pages_num, url, urlsplit(url).hostname or "",
+                                         request.get("method", ""), response.get("status", -1),
+                                         response.get("content", {}).get("mimeType", ""),
+                                         request.get("headersSize", -1), request.get("bodySize", -1),
+                                         response.get("headersSize", -1), response.get("bodySize", -1),
+                                         response.get("content", {}).get("size", -1),
+                                         url.lower().startswith("https://"),
+                                         "response" not in entry or "_error" in response)
+                                        + tuple(timings.get(key, -1) for key in TIMINGS))
+
+            for side, message in ((False, request), (True, response)):
+                for header in message.get("headers", ()):
+                    self.rows["headers"].append((self.entries_num, side, header["name"], header["value"]))
+
+            self.entries_num += 1
+
+        self.pages_num += 1
+
+        if max(len(rows) for rows in self.rows.values()) >= BATCH_SIZE:
+            self._flush()
+
+    def add_hars(self, hars):
+
+        for har in hars:
+            self.add_har(har)
+
+        return self
+
+    def _flush(self):
+
+        for table, rows in self.rows.items():
+
+            if rows:
+                self.backend.append(table, [list(column) for column in zip(*rows)])
+                self.rows[table] = []
+
+    '''
+    Write the tables and return the path of the file of the entries
+    '''
+    def close(self):
+
+        self._flush()
+
+        self.backend.close()
+
+        return self.path
+
+class ParquetTables:
+
+    def __init__(self, path):
+
+        import pyarrow
+
+        self.pa = pyarrow
+        self.path = path + ".parquet"
+        self.writers = {}
+
+    def append(self, table, columns):
+
+        import pyarrow.parquet as pq
+
+        pa = self.pa
+
+        types = {"int64": pa.int64(), "int32": pa.int32(), "bool": pa.bool_(),
+                 "float64": pa.float64(), "string": pa.string()}
+
+        if table not in self.writers:
+
+            schema = pa.schema([(name, types[kind]) for name, kind in TABLES[table]],
+                               metadata={"wtg_format": COLUMNS_FORMAT, "wtg_table": table})
+
+            self.writers[table] = pq.ParquetWriter(table_path(self.path, table), schema,
+                                                   compression="zstd")
+
+        writer = self.writers[table]
+
+        writer.write_table(pa.Table.from_arrays([pa.array(values, type=types[kind])
+                                                 for values, (name, kind) in zip(columns, TABLES[table])],
+                                                schema=writer.schema))
+
+    def close(self):
+
+        for writer in self.writers.values():
+            writer.close()
+
+class NpzTables:
+
+    def __init__(self, path):
+
+        self.path = path + ".npz"
+
+        # Table -> column -> chunks
+        self.chunks = {table: {name: [] for name, kind in columns} for table, columns in TABLES.items()}
+
+        # Column of strings -> {string: code}
+        self.dictionaries = {}
+
+    def append(self, table, columns):
+
+        for values, (name, kind) in zip(columns, TABLES[table]):
+
+            if kind == "string":
+                codes = self.dictionaries.setdefault(table + "." + name, {})
+                values = [codes.setdefault(value, len(codes)) for value in values]
+                kind = "int32"
+
+            self.chunks[table][name].append(np.array(values, dtype=kind))
+
+    def close(self):
+
+        arrays = {"format": COLUMNS_FORMAT}
+
+        for table, columns in TABLES.items():
+
+            # The headers are saved only if there are some
+            if table == "headers" and not self.chunks[table]["entry"]:
+                continue
+
+            for name, kind in columns:
+
+                key = table + "." + name
+                chunks = self.chunks[table][name]
+
+                arrays[key] = np.concatenate(chunks) if chunks else np.empty(0, dtype="int32" if kind == "string" else kind)
+
+                if kind == "string":
+                    arrays[key + ".data"], arrays[key + ".offsets"] = encode_strings(self.dictionaries.get(key, {}))
+
+        np.savez_compressed(self.path, **arrays)
+
+def parquet_available():
+
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        return False
+
+    return True
+
+'''
+Path of the Parquet file of a table, next to the one of the entries
+'''
+def table_path(path, table):
+
+    if table == "entries":
+        return path
+
+    return path[:-len(".parquet")] + "." + table + ".parquet"
+
+'''
+Paths where the columnar copy of a HAR file (e.g., HARs.json) would be
+'''
+def columnar_copies(path):
+
+    base = os.path.splitext(path)[0]
+
+    return [base + ".parquet", base + ".npz"]
+
+'''
+True if path is the file of the entries of a columnar copy of HARs
+'''
+def is_columnar(path):
+
+    with open(path, "rb") as f:
+        magic = f.read(4)
+
+    if magic == b"PAR1":
+
+        if not parquet_available():
+            return False
+
+        import pyarrow.parquet as pq
+
+        metadata = pq.read_schema(path).metadata or {}
+
+        return (metadata.get(b"wtg_format") == COLUMNS_FORMAT.encode()
+                and metadata.get(b"wtg_table") == b"entries")
+
+    if magic == b"PK\x03\x04":
+
+        try:
+            with np.load(path) as data:
+                return "format" in data and str(data["format"]) == COLUMNS_FORMAT
+        except ValueError:
+            return False
+
+    return False
+
+'''
+Read some columns (all of them if columns is None) of a table of a
+columnar copy of HARs. Returns a dictionary of arrays, with strings in
+arrays of objects. Missing tables (headers of HARs without them) are empty.
+'''
+def read_columns(path, columns=None, table="entries"):
+
+    kinds = dict(TABLES[table])
+
+    if columns is None:
+        columns = [name for name, kind in TABLES[table]]
+
+    if path.endswith(".parquet"):
+
+        import pyarrow.parquet as pq
+
+        if not os.path.isfile(table_path(path, table)):
+            return {name: np.empty(0, dtype=object if kinds[name] == "string" else kinds[name])
+                    for name in columns}
+
+        data = pq.read_table(table_path(path, table), columns=list(columns))
+
+        return {name: data.column(name).to_numpy() for name in columns}
+
+    result = {}
+
+    with np.load(path) as data:
+
+        for name in columns:
+
+            key = table + "." + name
+
+            if key not in data:
+                result[name] = np.empty(0, dtype=object if kinds[name] == "string" else kinds[name])
+
+            elif kinds[name] == "string":
+                dictionary = np.empty(len(data[key + ".offsets"]) - 1, dtype=object)
+                dictionary[:] = decode_strings(data[key + ".data"], data[key + ".offsets"])
+
+                result[name] = dictionary[data[key]]
+
+            else:
+                result[name] = data[key]
+
+    return result
+
+'''
+Timing store of a columnar copy of HARs, reading only the columns of the
+timings and of the flags of the entries
+'''
+def load_timing_store(path):
+
+    entries = read_columns(path, ("page", "https", "error") + TIMINGS)
+    pages = read_columns(path, PAGE_TIMINGS, "pages")
+
+    return TimingStore.from_columns(pages, entries)
+
+'''
+Total size of the files of a columnar copy of HARs
+'''
+def columnar_size(path):
+
+    if not path.endswith(".parquet"):
+        return os.path.getsize(path)
+
+    return sum(os.path.getsize(table_path(path, table)) for table in TABLES
+               if os.path.isfile(table_path(path, table)))
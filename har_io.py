@@ -0,0 +1,218 @@
+import os
+import re
+import json
+
+# Size of the chunks read when streaming a HAR file
+CHUNK_SIZE = 1 << 20
+
+'''
+Append-only writer of HARs in JSON-lines format (one HAR per line).
+Every line is flushed as soon as it is written, so a crash loses at most
+the HAR that was being written.
+'''
+class HarShardWriter:
+
+    def __init__(self, path):
+
+        self.path = path
+        self.file = open(path, "ab")
+
+    '''
+    Write a HAR and return the byte offset of its line in the shard
+    '''
+    def write(self, har):
+
+        offset = self.file.tell()
+
+        self.file.write(json.dumps(har).encode("ascii") + b"\n")
+        self.file.flush()
+
+        return offset
+
+    def close(self):
+
+        self.file.close()
+
+'''
+Guess the format of a HAR file looking at its first bytes.
+Returns "array" for a JSON array of HARs (empty or starting with a HAR),
+"lines" for JSON-lines, "sketches" for a file of timing sketches,
+"columnar" for a columnar copy of HARs, "store" for a saved timing store
+and None if the file does not look like a HAR file.
+'''
+def sniff_format(path):
+
+    with open(path, "rb") as f:
+        magic = f.read(4)
+
+    # Parquet or zip (npz) file
+    if magic in (b"PAR1", b"PK\x03\x04"):
+
+        from har_columns import is_columnar
+        from timing_store import is_timing_store
+
+        if is_columnar(path):
+            return "columnar"
+
+        return "store" if is_timing_store(path) else None
+
+    with open(path, "r", errors="replace") as f:
+        head = f.read(4096).lstrip()
+
+    if re.match(r'\[\s*(\]|\{\s*"log")', head):
+        return "array"
+
+    if re.match(r'\{\s*"log"', head):
+        return "lines"
+
+    if re.match(r'\{\s*"sketches"', head):
+        return "sketches"
+
+    return None
+
+'''
+Iterate over the HARs stored in a file, one at a time, without loading
+the whole document in memory. Both JSON arrays and JSON-lines are accepted.
+'''
+def iter_hars(path):
+
+    if os.path.getsize(path) == 0:
+        return
+
+    file_format = sniff_format(path)
+
+    with open(path, "r") as f:
+
+        if file_format == "array":
+            yield from _iter_json_array(f)
+        elif file_format == "lines":
+            yield from _iter_json_lines(f)
+        else:
+            raise ValueError("Not a HAR file: " + path)
+
+def _iter_json_lines(f):
+
+    for line in f:
+
+        if not line.strip():
+            continue
+
+        # A line without the trailing newline has been truncated by a crash
+        if not line.endswith("\n"):
+            try:
+                yield json.loads(line)
+            except ValueError:
+                print("Skipping truncated HAR at the end of " + f.name)
+            return
+
+        yield json.loads(line)
+
+def _iter_json_array(f):
+
+    decoder = json.JSONDecoder()
+
+    buf = f.read(CHUNK_SIZE).lstrip()
+
+    if not buf.startswith("["):
+        raise ValueError("Not a JSON array: " + f.name)
+
+    pos = 1
+    eof = False
+
+    while True:
+
+        # Skip separators between the elements
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+
+        if pos < len(buf) and buf[pos] == "]":
+            return
+
+        try:
+            if pos == len(buf):
+                raise ValueError
+
+            obj, pos = decoder.raw_decode(buf, pos)
+
+        except ValueError:
+
+            if eof:
+                raise ValueError("Unterminated JSON array: " + f.name)
+
+            # Drop what has been consumed and read more data. The read size grows
+            # with the buffer, so decoding a large element stays linear.
+            chunk = f.read(max(CHUNK_SIZE, len(buf) - pos))
+
+            buf = buf[pos:] + chunk
+            pos = 0
+            eof = not chunk
+
+            continue
+
+        yield obj
+
+'''
+Merge JSON-lines shards into a single JSON array of HARs.
+Lines are copied without decoding them, so memory usage does not depend
+on the size of the shards.
+'''
+def merge_shards(shard_paths, out_path):
+
+    hars_num = 0
+
+    with open(out_path, "wb") as out:
+
+        out.write(b"[")
+
+        for shard_path in shard_paths:
+
+            if not os.path.isfile(shard_path):
+                continue
+
+            with open(shard_path, "rb") as f:
+
+                for line in f:
+
+                    # Skip empty lines and a line truncated by a crash
+                    if not line.endswith(b"\n") or not line.strip():
+                        continue
+
+                    if hars_num:
+                        out.write(b", ")
+
+                    out.write(line.rstrip(b"\n"))
+                    hars_num += 1
+
+        out.write(b"]")
+
+    return hars_num
+
+'''
+Cut the line truncated by a crash at the end of a shard, so that new HARs
+can be appended to it. Returns the number of bytes removed.
+'''
+def repair_shard(path):
+
+    size = os.path.getsize(path)
+
+    with open(path, "rb+") as f:
+
+        # Look for the last newline going back one chunk at a time
+        end = size
+
+        while end > 0:
+
+            start = max(0, end - CHUNK_SIZE)
+
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+
+            if newline >= 0:
+                end = start + newline + 1
+                break
+
+            end = start
+
+        f.truncate(end)
+
+    return size - end
@@ -0,0 +1,495 @@
+import time
+import socket
+import asyncio
+import threading
+
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+from http1 import (STREAM_LIMIT, HOP_BY_HOP, read_head, get_header, wants_close,
+                   format_head, relay_body)
+
+'''
+In-process HTTP forward proxy recording HARs.
+
+The proxy runs an asyncio event loop in a background thread of the browser
+process and offers the subset of the BrowserMob Proxy client used by the
+browsers (new_har, har, timeouts, proxy, close), with no JVM and no REST
+calls. Each request records the HAR timings: dns, connect, send, wait and
+receive are measured on the connection to the server; connections to the
+servers are kept alive and reused, in which case dns and connect are -1.
+
+HTTPS goes through CONNECT tunnels, which are not decrypted: a tunnel is
+recorded as a single entry with its dns and connect timings, and -1 for
+the timings the proxy cannot see.
+'''
+class HarProxy:
+
+    def __init__(self, host="127.0.0.1", port=0):
+
+        # Timeouts in seconds, as the BrowserMob Proxy client
+        self.timeouts = {'request': 30, 'read': 30, 'connection': 30, 'dns': 30}
+
+        self.lock = threading.Lock()
+
+        self._har = None
+        self.capture_headers = False
+
+        # (host, port) -> idle connections to the server
+        self.idle_connections = {}
+
+        # Writers of the connected clients
+        self.clients = set()
+
+        self.loop = asyncio.new_event_loop()
+
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+        self.server = asyncio.run_coroutine_threadsafe(
+                          asyncio.start_server(self.handle_client, host, port, limit=STREAM_LIMIT),
+                          self.loop).result()
+
+        self.host = host
+        self.port = self.server.sockets[0].getsockname()[1]
+
+        # Address of the proxy, to configure the browser
+        self.proxy = host + ":" + str(self.port)
+
+    def new_har(self, ref=None, options=None):
+
+        options = options or {}
+
+        with self.lock:
+
+            self.capture_headers = options.get("captureHeaders", False)
+
+            self._har = {"log": {
+                                 "version": "1.2",
+                                 "creator": {"name": "WebTrafficGenerator", "version": "0.1"},
+                                 "pages": [{
+                                            "id": ref,
+                                            "title": ref,
+                                            "startedDateTime": _now(),
+                                            "pageTimings": {}
+                                            }],
+                                 "entries": []
+                                 }}
+
+    @property
+    def har(self):
+
+        with self.lock:
+
+            if self._har is None:
+                return None
+
+            log = dict(self._har["log"])
+            log["entries"] = list(log["entries"])
+
+            return {"log": log}
+
+    def selenium_proxy(self):
+
+        from selenium.webdriver.common.proxy import Proxy, ProxyType
+
+        return Proxy({"proxyType": ProxyType.MANUAL, "httpProxy": self.proxy, "sslProxy": self.proxy})
+
+    def close(self):
+
+        async def shutdown():
+
+            self.server.close()
+
+            for connections in self.idle_connections.values():
+                for reader, writer in connections:
+                    writer.close()
+
+            self.idle_connections.clear()
+
+            # Disconnect the clients still connected, as open tunnels, and let
+            # their handlers end before the loop stops
+            for writer in list(self.clients):
+                writer.close()
+
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+            if tasks:
+                await asyncio.wait(tasks, timeout=5)
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result()
+
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def add_entry(self, entry):
+
+        with self.lock:
+
+            if self._har is None:
+                return
+
+            entry["pageref"] = self._har["log"]["pages"][0]["id"]
+
+            self._har["log"]["entries"].append(entry)
+
+    def headers(self, headers):
+
+        if not self.capture_headers:
+            return []
+
+        return [{"name": name, "value": value} for name, value in headers]
+
+    async def handle_client(self, reader, writer):
+
+        self.clients.add(writer)
+
+        try:
+            while True:
+
+                head = await read_head(reader)
+
+                if head is None:
+                    break
+
+                request_line, headers, raw = head
+
+                method, target, version = request_line.split(" ", 2)
+
+                if method == "CONNECT":
+                    await self.tunnel(target, version, reader, writer)
+                    break
+
+                if not await self.forward(method, target, version, headers, reader, writer):
+                    break
+
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+    '''
+    Open a connection to the server, or reuse an idle one if reuse is True.
+    Returns the connection, its address and the dns and connect timings.
+    '''
+    async def connect(self, host, port, reuse=True):
+
+        idle = self.idle_connections.get((host, port)) if reuse else None
+
+        while idle:
+
+            reader, writer = idle.pop()
+
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer, writer.get_extra_info("peername")[0], -1, -1, True
+
+            writer.close()
+
+        start_time = time.time()
+
+        addresses = await asyncio.wait_for(
+                        self.loop.getaddrinfo(host, port, type=socket.SOCK_STREAM),
+                        self.timeouts["dns"])
+
+        ip = addresses[0][4][0]
+
+        dns_time = time.time()
+
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port, limit=STREAM_LIMIT),
+                                                self.timeouts["connection"])
+
+        connect_time = time.time()
+
+        return (reader, writer, ip, (dns_time-start_time)*1000,
+                (connect_time-dns_time)*1000, False)
+
+    '''
+    Forward a request to the server and its response to the client.
+    Returns True if the client connection can be reused.
+    '''
+    async def forward(self, method, target, version, headers, client_reader, client_writer):
+
+        start_time = time.time()
+        started = _now()
+
+        url = urlsplit(target)
+
+        entry = {
+                 "startedDateTime": started,
+                 "request": {
+                             "method": method,
+                             "url": target,
+                             "httpVersion": version,
+                             "cookies": [],
+                             "headers": self.headers(headers),
+                             "queryString": [],
+                             "headersSize": -1,
+                             "bodySize": 0
+                             },
+                 "cache": {},
+                 # Phases not reached by a failed request stay -1
+                 "timings": {"blocked": -1, "dns": -1, "connect": -1, "ssl": -1,
+                             "send": -1, "wait": -1, "receive": -1}
+                 }
+
+        response_started = False
+
+        # Connection to the server, closed at the end unless it is kept idle
+        writer = None
+        pooled = False
+
+        try:
+
+            if url.scheme != "http" or not url.hostname:
+                raise ValueError("Unsupported URL: " + target)
+
+            host, port = url.hostname, url.port or 80
+
+            path = url.path or "/"
+
+            if url.query:
+                path += "?" + url.query
+
+            request_headers = [(name, value) for name, value in headers
+                               if name.lower() not in HOP_BY_HOP]
+            request_headers.append(("Connection", "keep-alive"))
+
+            request_head = format_head(" ".join((method, path, "HTTP/1.1")), request_headers)
+
+            # A reused connection may have been closed by the server: retry once
+            # on a new one, when the request has no body to send again
+            for attempt in range(2):
+
+                (reader, writer, ip, dns,
+                 connect, reused) = await self.connect(host, port)
+
+                entry["timings"]["dns"] = dns
+                entry["timings"]["connect"] = connect
+                entry["serverIPAddress"] = ip
+
+                try:
+                    send_start = time.time()
+
+                    writer.write(request_head)
+
+                    entry["request"]["bodySize"], _ = await relay_body(client_reader, writer, headers)
+
+                    await writer.drain()
+
+                    wait_start = time.time()
+
+                    head = await asyncio.wait_for(read_head(reader), self.timeouts["read"])
+
+                    if head is None:
+                        raise ConnectionResetError("Connection closed by the server")
+
+                    break
+
+                except (ConnectionError, asyncio.IncompleteReadError):
+
+                    writer.close()
+
+                    if not reused or attempt or entry["request"]["bodySize"]:
+                        raise
+
+            status_line, response_headers, raw_head = head
+
+            response_start = time.time()
+
+            response_version, status, reason = (status_line.split(" ", 2) + [""])[:3]
+            status = int(status)
+
+            client_writer.write(raw_head)
+            response_started = True
+
+            body_size, closed = await relay_body(reader, client_writer, response_headers,
+                                                 True, method, status)
+
+            end_time = time.time()
+
+            if not closed and not wants_close(response_version, response_headers):
+                self.idle_connections.setdefault((host, port), []).append((reader, writer))
+                pooled = True
+
+            entry["timings"]["blocked"] = (send_start-start_time)*1000 - max(dns, 0) - max(connect, 0)
+            entry["timings"]["send"] = (wait_start-send_start)*1000
+            entry["timings"]["wait"] = (response_start-wait_start)*1000
+            entry["timings"]["receive"] = (end_time-response_start)*1000
+
+            entry["time"] = (end_time-start_time)*1000
+
+            entry["response"] = {
+                                 "status": status,
+                                 "statusText": reason,
+                                 "httpVersion": response_version,
+                                 "cookies": [],
+                                 "headers": self.headers(response_headers),
+                                 "content": {
+                                             "size": body_size,
+                                             "mimeType": get_header(response_headers, "content-type") or ""
+                                             },
+                                 "redirectURL": get_header(response_headers, "location") or "",
+                                 "headersSize": len(raw_head),
+                                 "bodySize": body_size
+                                 }
+
+            self.add_entry(entry)
+
+            return not closed and not wants_close(version, headers)
+
+        except Exception as e:
+
+            entry["time"] = (time.time()-start_time)*1000
+            entry["timings"]["blocked"] = max(0, entry["time"] - max(entry["timings"]["dns"], 0)
+                                              - max(entry["timings"]["connect"], 0))
+            entry["response"] = {"status": 0, "_error": str(e) or type(e).__name__}
+
+            self.add_entry(entry)
+
+            if not response_started:
+                client_writer.write(format_head("HTTP/1.1 502 Bad Gateway",
+                                                [("Content-Length", "0"), ("Connection", "close")]))
+                await client_writer.drain()
+
+            return False
+
+        finally:
+
+            if writer is not None and not pooled:
+                writer.close()
+
+    '''
+    Open a tunnel to target (host:port) and pipe the data in both directions
+    '''
+    async def tunnel(self, target, version, client_reader, client_writer):
+
+        start_time = time.time()
+
+        host, _, port = target.rpartition(":")
+
+        entry = {
+                 "startedDateTime": _now(),
+                 "request": {
+                             "method": "CONNECT",
+                             "url": "https://" + (host if port == "443" else target) + "/",
+                             "httpVersion": version,
+                             "cookies": [],
+                             "headers": [],
+                             "queryString": [],
+                             "headersSize": -1,
+                             "bodySize": 0
+                             },
+                 "cache": {},
+                 # Only dns and connect are measured on a tunnel
+                 "timings": {"blocked": -1, "dns": -1, "connect": -1, "ssl": -1,
+                             "send": -1, "wait": -1, "receive": -1},
+                 "_tunnel": True
+                 }
+
+        try:
+            # A tunnel never takes an idle connection, which belongs to HTTP requests
+            reader, writer, ip, dns, connect, reused = await self.connect(host.strip("[]"), int(port),
+                                                                          reuse=False)
+
+        except Exception as e:
+
+            entry["time"] = (time.time()-start_time)*1000
+            entry["response"] = {"status": 0, "_error": str(e) or type(e).__name__}
+
+            self.add_entry(entry)
+
+            client_writer.write(format_head("HTTP/1.1 502 Bad Gateway", [("Content-Length", "0")]))
+            await client_writer.drain()
+
+            return
+
+        entry["timings"]["dns"] = dns
+        entry["timings"]["connect"] = connect
+        entry["serverIPAddress"] = ip
+        entry["time"] = (time.time()-start_time)*1000
+        entry["response"] = {
+                             "status": 200,
+                             "statusText": "Connection Established",
+                             "httpVersion": version,
+                             "cookies": [],
+                             "headers": [],
+                             "content": {"size": 0, "mimeType": ""},
+                             "redirectURL": "",
+                             "headersSize": -1,
+                             "bodySize": 0
+                             }
+
+        self.add_entry(entry)
+
+        client_writer.write(b"HTTP/1.1 200 Connection Established\r\n\r\n")
+        await client_writer.drain()
+
+        await asyncio.gather(_pipe(client_reader, writer), _pipe(reader, client_writer))
+
+async def _pipe(reader, writer):
+
+    try:
+        while True:
+
+            data = await reader.read(65536)
+
+            if not data:
+                break
+
+            writer.write(data)
+            await writer.drain()
+
+    except ConnectionError:
+        pass
+
+    finally:
+        writer.close()
+
+def _now():
+
+    return datetime.now(timezone.utc).isoformat()
+
+'''
+Drop-in replacement of a proxy shard, creating in-process proxies
+'''
+class HarProxyFactory:
+
+    def __init__(self, index=0):
+
+        self.index = index
+
+    def create_proxy(self):
+
+        return HarProxy()
+
+    def wait_restart(self, timeout):
+
+        return True
+
+'''
+Drop-in replacement of ProxyShards: every browser gets its own in-process
+proxies, so there are no servers to start, monitor or restart
+'''
+class HarProxyShards:
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def shard_for(self, browser_id):
+
+        return HarProxyFactory(browser_id)
+
+    def report(self, pages_by_shard, elapsed):
+
+        return [{
+                 "shard": index,
+                 "pages": pages,
+                 "pages_per_second": pages / elapsed if elapsed else None,
+                 "restarts": 0
+                 } for index, pages in sorted(pages_by_shard.items())]
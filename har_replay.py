@@ -0,0 +1,516 @@
+#!/usr/bin/python3
+
+import json
+import argparse
+import os
+import ssl
+import time
+import socket
+import asyncio
+import resource
+
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+from http1 import (STREAM_LIMIT, HOP_BY_HOP, read_head, get_header, wants_close,
+                   format_head, relay_body)
+from har_io import iter_hars, merge_shards, HarShardWriter
+
+# Concurrent connections of a user to the same origin, as in Firefox
+MAX_CONNECTIONS_PER_ORIGIN = 6
+
+# Request headers set by the replay, never copied from the HARs
+REPLAY_HEADERS = HOP_BY_HOP + ("host", "content-length", "transfer-encoding")
+
+DEFAULT_HEADERS = [("User-Agent", "WebTrafficGenerator"), ("Accept", "*/*")]
+
+'''
+Read the pages to replay from a HAR file.
+Every page is its URL and the list of its requests, sorted by start time:
+each request is (offset in seconds from the start of the page, method,
+URL, headers, body). CONNECT tunnels recorded by the asyncio proxy carry no
+request to replay and are left out.
+'''
+def load_pages(path, no_https=False, limit=None):
+
+    pages = []
+
+    for har in iter_hars(path):
+
+        if limit and len(pages) >= limit:
+            break
+
+        log = har["log"]
+
+        requests = []
+
+        for entry in log["entries"]:
+
+            request = entry["request"]
+
+            if entry.get("_tunnel") or request["method"] == "CONNECT":
+                continue
+
+            if no_https and request["url"].lower().startswith("https://"):
+                continue
+
+            headers = [(h["name"], h["value"]) for h in request.get("headers", [])
+                       if not h["name"].startswith(":") and h["name"].lower() not in REPLAY_HEADERS]
+
+            body = request.get("postData", {}).get("text", "").encode("utf-8")
+
+            requests.append((_timestamp(entry["startedDateTime"]), request["method"],
+                             request["url"], headers or DEFAULT_HEADERS, body))
+
+        if not requests:
+            continue
+
+        requests.sort(key=lambda r: r[0])
+
+        page_start = requests[0][0]
+
+        pages.append({
+                      "url": log["pages"][0]["id"] if log.get("pages") else requests[0][2],
+                      "requests": [(start-page_start,) + tuple(r) for start, *r in requests]
+                      })
+
+    return pages
+
+def _timestamp(started):
+
+    try:
+        return datetime.fromisoformat(started.replace("Z", "+00:00")).timestamp()
+    except (ValueError, AttributeError):
+        return 0
+
+def _now():
+
+    return datetime.now(timezone.utc).isoformat()
+
+'''
+Connections of a simulated user, kept alive and reused per origin.
+At most MAX_CONNECTIONS_PER_ORIGIN requests to the same origin are in
+flight at once; the time spent waiting for a connection is blocked time.
+'''
+class ConnectionPool:
+
+    def __init__(self, ssl_context):
+
+        self.ssl_context = ssl_context
+
+        # (scheme, host, port) -> idle connections
+        self.idle = {}
+
+        # (scheme, host, port) -> semaphore of the connections
+        self.slots = {}
+
+    def close(self):
+
+        for connections in self.idle.values():
+            for reader, writer in connections:
+                writer.close()
+
+        self.idle.clear()
+
+    async def connect(self, origin):
+
+        idle = self.idle.get(origin)
+
+        while idle:
+
+            reader, writer = idle.pop()
+
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer, writer.get_extra_info("peername")[0], -1, -1, -1, True
+
+            writer.close()
+
+        scheme, host, port = origin
+
+        start_time = time.time()
+
+        addresses = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+
+        ip = addresses[0][4][0]
+
+        dns_time = time.time()
+
+        reader, writer = await asyncio.open_connection(ip, port, limit=STREAM_LIMIT)
+
+        connect_time = time.time()
+
+        ssl_time = -1
+
+        if scheme == "https":
+
+            try:
+                await writer.start_tls(self.ssl_context, server_hostname=host)
+            except:
+                writer.close()
+                raise
+
+            ssl_time = (time.time()-connect_time)*1000
+
+        # As in HARs, connect includes the ssl handshake
+        return (reader, writer, ip, (dns_time-start_time)*1000,
+                (time.time()-dns_time)*1000, ssl_time, False)
+
+    '''
+    Send a request and read its response.
+    Returns the HAR entry of the request; failed requests have status 0
+    and the error in the response.
+    '''
+    async def fetch(self, method, url, headers, body):
+
+        start_time = time.time()
+
+        parts = urlsplit(url)
+
+        entry = {
+                 "startedDateTime": _now(),
+                 "request": {
+                             "method": method,
+                             "url": url,
+                             "httpVersion": "HTTP/1.1",
+                             "cookies": [],
+                             "headers": [],
+                             "queryString": [],
+                             "headersSize": -1,
+                             "bodySize": len(body)
+                             },
+                 "cache": {},
+                 "timings": {"blocked": 0, "dns": -1, "connect": -1, "ssl": -1,
+                             "send": 0, "wait": 0, "receive": 0}
+                 }
+
+        writer = None
+        keep_alive = False
+
+        try:
+
+            if parts.scheme not in ("http", "https") or not parts.hostname:
+                raise ValueError("Unsupported URL: " + url)
+
+            origin = (parts.scheme, parts.hostname,
+                      parts.port or (443 if parts.scheme == "https" else 80))
+
+            path = parts.path or "/"
+
+            if parts.query:
+                path += "?" + parts.query
+
+            host = parts.netloc.rpartition("@")[2]
+
+            request_headers = [("Host", host)] + list(headers) + [("Connection", "keep-alive")]
+
+            if body or method in ("POST", "PUT", "PATCH"):
+                request_headers.append(("Content-Length", str(len(body))))
+
+            request_head = format_head(" ".join((method, path, "HTTP/1.1")), request_headers)
+
+            slot = self.slots.setdefault(origin, asyncio.Semaphore(MAX_CONNECTIONS_PER_ORIGIN))
+
+            async with slot:
+
+                # A reused connection may have been closed by the server: retry once on a new one
+                for attempt in range(2):
+
+                    (reader, writer, ip, dns,
+                     connect, ssl_time, reused) = await self.connect(origin)
+
+                    entry["timings"]["dns"] = dns
+                    entry["timings"]["connect"] = connect
+                    entry["timings"]["ssl"] = ssl_time
+                    entry["serverIPAddress"] = ip
+
+                    try:
+                        send_start = time.time()
+
+                        writer.write(request_head + body)
+                        await writer.drain()
+
+                        wait_start = time.time()
+
+                        head = await read_head(reader)
+
+                        if head is None:
+                            raise ConnectionResetError("Connection closed by the server")
+
+                        break
+
+                    except (ConnectionError, asyncio.IncompleteReadError):
+
+                        writer.close()
+                        writer = None
+
+                        if not reused or attempt:
+                            raise
+
+                status_line, response_headers, raw_head = head
+
+                response_start = time.time()
+
+                version, status, reason = (status_line.split(" ", 2) + [""])[:3]
+                status = int(status)
+
+                body_size, closed = await relay_body(reader, None, response_headers,
+                                                     True, method, status)
+
+                end_time = time.time()
+
+                keep_alive = not closed and not wants_close(version, response_headers)
+
+                if keep_alive:
+                    self.idle.setdefault(origin, []).append((reader, writer))
+
+            entry["timings"]["blocked"] = (send_start-start_time)*1000 - max(dns, 0) - max(connect, 0)
+            entry["timings"]["send"] = (wait_start-send_start)*1000
+            entry["timings"]["wait"] = (response_start-wait_start)*1000
+            entry["timings"]["receive"] = (end_time-response_start)*1000
+
+            entry["time"] = (end_time-start_time)*1000
+
+            entry["response"] = {
+                                 "status": status,
+                                 "statusText": reason,
+                                 "httpVersion": version,
+                                 "cookies": [],
+                                 "headers": [],
+                                 "content": {
+                                             "size": body_size,
+                                             "mimeType": get_header(response_headers, "content-type") or ""
+                                             },
+                                 "redirectURL": get_header(response_headers, "location") or "",
+                                 "headersSize": len(raw_head),
+                                 "bodySize": body_size
+                                 }
+
+        except Exception as e:
+
+            entry["time"] = (time.time()-start_time)*1000
+            entry["response"] = {"status": 0, "_error": str(e) or type(e).__name__}
+
+        finally:
+            # Connections of failed or cancelled requests cannot be reused
+            if writer and not keep_alive:
+                writer.close()
+
+        return entry
+
+'''
+Replay engine.
+
+Each simulated user is a coroutine with its own connection pool, that
+takes the next page from a shared queue and replays its requests at the
+same offsets from the start of the page as in the recording, so the
+order and the concurrency of the requests of a page are preserved. The
+HARs of the replayed pages are written as they complete in har_file, a
+JSON-lines shard like those of the browsers.
+'''
+class HarReplay:
+
+    def __init__(self, pages, users, timeout, har_file, repeat=1, ssl_context=None):
+
+        self.pages = pages
+        self.users = users
+        self.timeout = timeout
+        self.repeat = repeat
+
+        self.ssl_context = ssl_context or ssl.create_default_context()
+
+        self.har_file = har_file
+
+        self.pages_done = 0
+        self.timeouts = 0
+        self.entries = 0
+        self.errors = 0
+
+        self.elapsed = None
+
+    def run(self):
+
+        return asyncio.run(self.replay())
+
+    async def replay(self):
+
+        start_time = time.time()
+
+        self.queue = asyncio.Queue()
+
+        for i in range(self.repeat):
+            for page in self.pages:
+                self.queue.put_nowait(page)
+
+        self.writer = HarShardWriter(self.har_file)
+
+        try:
+            await asyncio.gather(*[self.user(i) for i in range(min(self.users, self.queue.qsize()))])
+        finally:
+            self.writer.close()
+
+        self.elapsed = time.time() - start_time
+
+    async def user(self, user_id):
+
+        pool = ConnectionPool(self.ssl_context)
+
+        try:
+            while not self.queue.empty():
+
+                page = self.queue.get_nowait()
+
+                try:
+                    har = await asyncio.wait_for(self.replay_page(pool, page), self.timeout)
+                except asyncio.TimeoutError:
+                    # As with the browsers, a page that times out has no HAR
+                    self.timeouts += 1
+                    continue
+
+                self.writer.write(har)
+
+                self.pages_done += 1
+                self.entries += len(har["log"]["entries"])
+                self.errors += sum(1 for e in har["log"]["entries"] if "_error" in e["response"])
+        finally:
+            pool.close()
+
+    async def replay_page(self, pool, page):
+
+        started = _now()
+        start_time = time.time()
+
+        async def replay_request(offset, method, url, headers, body):
+
+            delay = start_time + offset - time.time()
+
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            return await pool.fetch(method, url, headers, body)
+
+        entries = await asyncio.gather(*[replay_request(*request) for request in page["requests"]])
+
+        total_time = (time.time()-start_time)*1000
+
+        for entry in entries:
+            entry["pageref"] = page["url"]
+
+        return {"log": {
+                        "version": "1.2",
+                        "creator": {"name": "WebTrafficGenerator", "version": "0.1"},
+                        "pages": [{
+                                   "id": page["url"],
+                                   "title": page["url"],
+                                   "startedDateTime": started,
+                                   "pageTimings": {}
+                                   }],
+                        "entries": list(entries),
+                        "totalTime": total_time,
+                        "queueTime": 0,
+                        "latency": total_time,
+                        "intendedStart": start_time
+                        }}
+
+    def report(self):
+
+        return {
+                "users": self.users,
+                "pages": self.pages_done,
+                "timeouts": self.timeouts,
+                "entries": self.entries,
+                "errors": self.errors,
+                "seconds": self.elapsed,
+                "pages_per_second": self.pages_done / self.elapsed if self.elapsed else None,
+                "requests_per_second": self.entries / self.elapsed if self.elapsed else None
+                }
+
+'''
+Every user keeps its own connections open: raise the limit of open files
+to the maximum allowed
+'''
+def raise_open_files_limit():
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+if __name__=="__main__":
+
+    version="0.1"
+
+    parser = argparse.ArgumentParser(description='HTTP Archive replay')
+
+    parser.add_argument('--version',action='version',version='%(prog)s '+ version)
+
+    parser.add_argument('input', metavar='input', type=str,
+                       help='HAR file recorded by the Web Traffic Generator (e.g., HARs.json).')
+    parser.add_argument('out_folder', metavar='output_folder', type=str,
+                       help='output folder name.')
+    parser.add_argument('--users', metavar='<number>', type=int, default = 100,
+                       help='number of simulated users replaying pages at the same time. Default is 100')
+    parser.add_argument('--repeat', metavar='<number>', type=int, default = 1,
+                       help='replay the pages of the input <number> times. Default is 1')
+    parser.add_argument('--limit-pages', metavar='<number>', type=int,
+                       help='replay only the first <number> pages of the input.')
+    parser.add_argument('--timeout', metavar='<timeout>', type=int, default = 30,
+                       help='timeout in seconds after declaring failed a page. Default is 30 sec.')
+    parser.add_argument('--no-https', action='store_const', const=True, default=False,
+                       help='do not replay requests on https.')
+    parser.add_argument('--insecure', action='store_const', const=True, default=False,
+                       help='do not verify the certificates of the servers.')
+
+    args = vars(parser.parse_args())
+
+    if not os.path.isfile(args['input']):
+        print ("Invalid input: " + args['input'])
+        exit()
+
+    out_folder = args['out_folder']
+
+    if not os.path.exists(out_folder):
+        os.makedirs(out_folder)
+
+    har_file = os.path.join(out_folder,"HARs.json")
+
+    # The HARs are written in a shard as they complete, then merged in HARs.json
+    shard_file = os.path.join(out_folder,"HARs_replay.jsonl")
+
+    for path in (har_file, shard_file):
+        if os.path.exists(path):
+            os.remove(path)
+
+    pages = load_pages(args['input'], args['no_https'], args['limit_pages'])
+
+    print("Pages to replay: ", len(pages)*args['repeat'])
+
+    ssl_context = ssl.create_default_context()
+
+    if args['insecure']:
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+
+    raise_open_files_limit()
+
+    replay = HarReplay(pages, args['users'], args['timeout'], shard_file,
+                       args['repeat'], ssl_context)
+
+    replay.run()
+
+    # A JSON array of HARs, as the HARs.json of the Web Traffic Generator
+    merge_shards([shard_file], har_file)
+
+    os.remove(shard_file)
+
+    report = replay.report()
+
+    with open(os.path.join(out_folder,"replay_report.json"),"w") as f:
+        json.dump(report,f,indent=2)
+
+    print("Pages replayed: ", report["pages"])
+    print("Replay: {:.1f} pages/s, {:.1f} requests/s, {} timeouts, {} failed requests".format(
+          report["pages_per_second"] or 0, report["requests_per_second"] or 0,
+          report["timeouts"], report["errors"]))
@@ -0,0 +1,237 @@
+import io
+import os
+import gzip
+import hashlib
+import itertools
+import numpy as np
+
+from utils import ECDF, encode_strings, decode_strings
+
+HISTORY_CACHE_FORMAT = "history-cache-1"
+
+# Characters of the history read and filtered at once
+CHUNK_SIZE = 1 << 24
+
+# Size of the blocks read when hashing the history file
+HASH_BLOCK_SIZE = 1 << 20
+
+# Characters of the URLs that the filters look at: "https://192.168."
+PREFIX_LENGTH = 16
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+'''
+Visits of a browser history, one per line as "<timestamp in us> <url>".
+
+Local files and pages on private addresses (10.* and 192.168.*) are
+left out; the URLs to request also leave out pages on https if no_https
+is set, while the thinking times are the intervals up to max_interval
+seconds between all the visits.
+'''
+class History:
+
+    def __init__(self, urls, url_timestamps, thinking_times, ecdf):
+
+        self.urls = urls
+        self.url_timestamps = url_timestamps
+
+        # Sorted thinking times and their ECDF
+        self.thinking_times = thinking_times
+        self.ecdf = ecdf
+
+'''
+Load a history file, plain or compressed with gzip or zstd.
+
+The file is streamed in chunks of about CHUNK_SIZE characters, each one
+split in a single call and filtered with array operations. The result is
+cached in a sidecar file (<path>.cache.npz) keyed by the hash of the
+history and by the options that change it, so the following runs on the
+same history only hash the file and read the cache.
+'''
+def load_history(path, max_interval, no_https=False, cache=True):
+
+    cache_path = path + ".cache.npz"
+    key = None
+
+    if cache:
+
+        key = "{}:{}:{}".format(file_hash(path), max_interval, no_https)
+
+        history = _load_cache(cache_path, key)
+
+        if history:
+            print("History read from "+cache_path)
+            return history
+
+    urls = []
+    url_timestamps = []
+    visit_timestamps = []
+
+    with open_history(path) as f:
+
+        while True:
+
+            # Read up to the end of a line
+            chunk = f.read(CHUNK_SIZE)
+            chunk += f.readline()
+
+            if not chunk:
+                break
+
+            chunk_urls, timestamps = _split_visits(chunk)
+
+            if not chunk_urls:
+                continue
+
+            # convert timestamps in seconds
+            timestamps /= 1000000
+
+            prefixes = _lower_prefixes(chunk_urls)
+
+            excluded = (_starts_with(prefixes, "file://") |
+                        _starts_with(prefixes, "http://10.") |
+                        _starts_with(prefixes, "http://192.168.") |
+                        _starts_with(prefixes, "https://10.") |
+                        _starts_with(prefixes, "https://192.168."))
+
+            visit_timestamps.append(timestamps[~excluded])
+
+            selected = ~excluded & ~_starts_with(prefixes, "https://") if no_https else ~excluded
+
+            urls.extend(itertools.compress(chunk_urls, selected.tolist()))
+            url_timestamps.append(timestamps[selected])
+
+    visit_timestamps = np.sort(np.concatenate(visit_timestamps) if visit_timestamps else np.empty(0))
+
+    thinking_times = np.diff(visit_timestamps)
+    thinking_times = np.sort(thinking_times[thinking_times <= max_interval])
+
+    if thinking_times.size == 0:
+        raise ValueError("No thinking times up to "+str(max_interval)+" sec in "+path)
+
+    history = History(urls,
+                      np.concatenate(url_timestamps) if url_timestamps else np.empty(0),
+                      thinking_times,
+                      ECDF(thinking_times, assume_sorted=True))
+
+    if cache:
+        _save_cache(cache_path, key, history)
+
+    return history
+
+'''
+Open a history file for reading text, decompressing it if it starts
+with the magic number of gzip or zstd
+'''
+def open_history(path):
+
+    with open(path, "rb") as f:
+        magic = f.read(4)
+
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+
+    if magic == ZSTD_MAGIC:
+
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("The zstandard package is needed to read "+path)
+
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+
+        return io.TextIOWrapper(reader, encoding="utf-8", errors="replace")
+
+    return open(path, "r", encoding="utf-8", errors="replace")
+
+'''
+Split the lines of a chunk of history in URLs and timestamps (in us).
+Lines are "<timestamp> <url>", so the words of the chunk alternate between
+the two: if a line breaks the pattern (a blank line is fine), the chunk is
+split again line by line, skipping the lines without two fields.
+'''
+def _split_visits(chunk):
+
+    words = chunk.split()
+
+    try:
+        if len(words) % 2 == 0:
+            return words[1::2], np.array(words[0::2], dtype=np.float64)
+    except ValueError:
+        pass
+
+    fields = [line.split(None, 2) for line in chunk.splitlines()]
+    fields = [entry for entry in fields if len(entry) >= 2]
+
+    return ([entry[1] for entry in fields],
+            np.array([entry[0] for entry in fields], dtype=np.float64).reshape(-1))
+
+'''
+Mask of the URLs starting with prefix (in lower case), given the
+prefixes of the URLs returned by _lower_prefixes
+'''
+def _starts_with(prefixes, prefix):
+
+    return (prefixes[:, :len(prefix)] == np.array([ord(c) for c in prefix], dtype=np.uint32)).all(axis=1)
+
+'''
+Code points of the first PREFIX_LENGTH characters of each URL, in
+lower case (only ASCII letters matter to the filters)
+'''
+def _lower_prefixes(urls):
+
+    codes = np.array(urls, dtype="U"+str(PREFIX_LENGTH)).view(np.uint32).reshape(len(urls), -1)
+
+    # Shorter prefixes are padded with zeros
+    codes = np.pad(codes, ((0, 0), (0, PREFIX_LENGTH - codes.shape[1])))
+
+    return np.where((codes >= ord("A")) & (codes <= ord("Z")), codes + 32, codes)
+
+def file_hash(path):
+
+    digest = hashlib.sha1()
+
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+def _load_cache(path, key):
+
+    if not os.path.isfile(path):
+        return None
+
+    try:
+        with np.load(path) as data:
+
+            if str(data["format"]) != HISTORY_CACHE_FORMAT or str(data["key"]) != key:
+                return None
+
+            return History(decode_strings(data["urls_data"], data["urls_offsets"]),
+                           data["url_timestamps"],
+                           data["thinking_times"],
+                           ECDF.from_table(data["ecdf_x"], data["ecdf_p"]))
+
+    except (OSError, ValueError, KeyError):
+        print("Ignoring invalid history cache "+path)
+        return None
+
+def _save_cache(path, key, history):
+
+    urls_data, urls_offsets = encode_strings(history.urls)
+
+    try:
+        # Replace the file at once, so a crash never leaves half a cache
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, format=HISTORY_CACHE_FORMAT, key=key,
+                     urls_data=urls_data, urls_offsets=urls_offsets,
+                     url_timestamps=history.url_timestamps,
+                     thinking_times=history.thinking_times,
+                     ecdf_x=history.ecdf.x, ecdf_p=history.ecdf.p)
+
+        os.replace(path + ".tmp", path)
+
+    except OSError as e:
+        print("Cannot save the history cache "+path+": "+str(e))
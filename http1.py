@@ -0,0 +1,153 @@
+import asyncio
+
+# Maximum size of a message head, and of the buffers of the streams
+STREAM_LIMIT = 1 << 20
+
+# Headers that apply to a single connection and are not forwarded
+HOP_BY_HOP = ("connection", "keep-alive", "proxy-connection", "proxy-authenticate",
+              "proxy-authorization", "te", "trailer", "upgrade")
+
+'''
+Read the head of an HTTP/1.x message from an asyncio stream.
+Returns the start line, the list of (name, value) headers and the raw bytes
+of the head, or None if the stream ends before a new message.
+'''
+async def read_head(reader):
+
+    try:
+        raw = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if not e.partial.strip():
+            return None
+        raise
+
+    lines = raw[:-4].decode("latin-1").split("\r\n")
+
+    headers = []
+
+    for line in lines[1:]:
+
+        name, _, value = line.partition(":")
+        headers.append((name.strip(), value.strip()))
+
+    return lines[0], headers, raw
+
+'''
+Value of the first header called name (case insensitive), or None
+'''
+def get_header(headers, name):
+
+    name = name.lower()
+
+    for header_name, value in headers:
+        if header_name.lower() == name:
+            return value
+
+    return None
+
+'''
+True if a message with these headers asks to close the connection after it
+'''
+def wants_close(version, headers):
+
+    connection = (get_header(headers, "connection") or
+                  get_header(headers, "proxy-connection") or "").lower()
+
+    if version == "HTTP/1.0":
+        return "keep-alive" not in connection
+
+    return "close" in connection
+
+def format_head(start_line, headers):
+
+    return (start_line + "\r\n" +
+            "".join(name + ": " + value + "\r\n" for name, value in headers) +
+            "\r\n").encode("latin-1")
+
+'''
+Copy the body of a message from reader to writer (or discard it if writer
+is None), following its framing. Returns the size of the body and True if
+the body ends with the connection, which cannot be reused.
+'''
+async def relay_body(reader, writer, headers, response=False, method="GET", status=200):
+
+    if response and (method == "HEAD" or 100 <= status < 200 or status in (204, 304)):
+        return 0, False
+
+    transfer_encoding = get_header(headers, "transfer-encoding")
+
+    if transfer_encoding and "chunked" in transfer_encoding.lower():
+        return await _relay_chunked(reader, writer), False
+
+    content_length = get_header(headers, "content-length")
+
+    if content_length is not None:
+
+        size = int(content_length)
+
+        await _relay_exact(reader, writer, size)
+
+        return size, False
+
+    # A request without framing has no body
+    if not response:
+        return 0, False
+
+    # The response body ends when the server closes the connection
+    size = 0
+
+    while True:
+
+        data = await reader.read(65536)
+
+        if not data:
+            return size, True
+
+        size += len(data)
+
+        await _write(writer, data)
+
+async def _relay_exact(reader, writer, size):
+
+    while size > 0:
+
+        data = await reader.read(min(65536, size))
+
+        if not data:
+            raise asyncio.IncompleteReadError(b"", size)
+
+        size -= len(data)
+
+        await _write(writer, data)
+
+async def _relay_chunked(reader, writer):
+
+    size = 0
+
+    while True:
+
+        line = await reader.readuntil(b"\r\n")
+
+        await _write(writer, line)
+
+        chunk_size = int(line.split(b";")[0].strip(), 16)
+
+        if chunk_size == 0:
+
+            # Trailers, up to an empty line
+            while line != b"\r\n":
+                line = await reader.readuntil(b"\r\n")
+                await _write(writer, line)
+
+            return size
+
+        size += chunk_size
+
+        # Chunk data and its CRLF
+        await _relay_exact(reader, writer, chunk_size + 2)
+
+async def _write(writer, data):
+
+    if writer:
+        writer.write(data)
+        await writer.drain()
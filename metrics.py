@@ -0,0 +1,306 @@
+import os
+import json
+import time
+import bisect
+import threading
+import collections
+import numpy as np
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from timing_store import TIMINGS, PAGE_TIMINGS
+
+# Upper bounds (ms) of the buckets of the latency histograms
+BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+'''
+Live metrics of a run, fed with the records that the browsers send to
+the pool and with the dispatches of the scheduler.
+
+Counters cover the whole run, rates only the last window seconds. The
+latency histograms are kept both over the whole run (cumulative, as
+Prometheus histograms must be) and over the last window. They have one
+series for each page timing (totalTime, queueTime, latency) and for each
+phase of the resources (blocked, dns, ...), where the value of a page is
+the sum of the phase over its resources.
+'''
+class Metrics:
+
+    def __init__(self, window=60):
+
+        self.window = window
+
+        self.lock = threading.Lock()
+
+        self.start_time = time.time()
+
+        self.dispatched = 0
+        self.started = 0
+        self.pages = 0
+        self.restarts = 0
+
+        # Kind of failure -> count
+        self.failures = {}
+
+        # Browser id -> pages loading
+        self.in_flight = {}
+
+        self.lag = 0.0
+        self.max_lag = 0.0
+
+        # (time, {timing: value}) of the pages of the last window
+        self.recent = collections.deque()
+
+        # Timing -> pages in each bucket (the last one above all the bounds),
+        # count and sum of the values, over the whole run
+        self.totals = {key: {"buckets": [0] * (len(BUCKETS) + 1), "count": 0, "sum": 0.0}
+                       for key in PAGE_TIMINGS + TIMINGS}
+
+    '''
+    Called when a page is dispatched, with its intended start time
+    '''
+    def dispatch(self, intended_start):
+
+        with self.lock:
+            self.dispatched += 1
+            self.lag = max(0.0, time.time() - intended_start)
+            self.max_lag = max(self.max_lag, self.lag)
+
+    def observe(self, record):
+
+        now = time.time()
+
+        with self.lock:
+
+            if record["type"] == "start":
+                self.started += 1
+                self.in_flight[record["browser"]] = self.in_flight.get(record["browser"], 0) + 1
+
+            elif record["type"] == "page":
+                self.pages += 1
+                self._page_done(record["browser"])
+
+                values = {key: record[key] for key in PAGE_TIMINGS if key in record}
+                values.update(record.get("timings", {}))
+
+                self.recent.append((now, values))
+
+                for key, value in values.items():
+                    if key in self.totals and value is not None and value >= 0:
+                        total = self.totals[key]
+                        total["buckets"][bisect.bisect_left(BUCKETS, value)] += 1
+                        total["count"] += 1
+                        total["sum"] += value
+
+            elif record["type"] == "failure":
+                self.failures[record["kind"]] = self.failures.get(record["kind"], 0) + 1
+
+                if record["browser"] is not None:
+                    self._page_done(record["browser"])
+
+            elif record["type"] == "restart":
+                self.restarts += 1
+
+            elif record["type"] == "done":
+                self.in_flight.pop(record["browser"], None)
+
+            self._expire(now)
+
+    def _page_done(self, browser):
+
+        if self.in_flight.get(browser):
+            self.in_flight[browser] -= 1
+
+    def _expire(self, now):
+
+        while self.recent and self.recent[0][0] < now - self.window:
+            self.recent.popleft()
+
+    '''
+    Cumulative counts of the histogram of each timing over the last window
+    '''
+    def histograms(self):
+
+        histograms = {}
+
+        for key in PAGE_TIMINGS + TIMINGS:
+
+            values = np.array([v[key] for t, v in self.recent if v.get(key, -1) >= 0])
+
+            histograms[key] = {
+                               "buckets": np.searchsorted(np.sort(values), BUCKETS, side="right").tolist(),
+                               "count": len(values),
+                               "sum": float(values.sum())
+                               }
+
+        return histograms
+
+    '''
+    Cumulative counts of the histogram of each timing over the whole run
+    '''
+    def total_histograms(self):
+
+        return {key: {
+                      "buckets": np.cumsum(total["buckets"][:-1]).tolist(),
+                      "count": total["count"],
+                      "sum": total["sum"]
+                      } for key, total in self.totals.items()}
+
+    def snapshot(self):
+
+        now = time.time()
+
+        with self.lock:
+
+            self._expire(now)
+
+            elapsed = min(self.window, now - self.start_time)
+
+            return {
+                    "time": now,
+                    "elapsed_seconds": now - self.start_time,
+                    "pages": self.pages,
+                    "pages_per_second": len(self.recent) / elapsed if elapsed > 0 else 0.0,
+                    "dispatched": self.dispatched,
+                    "queue_depth": max(0, self.dispatched - self.started - self.failures.get("skipped", 0)),
+                    "in_flight": dict(self.in_flight),
+                    "schedule_lag_seconds": self.lag,
+                    "max_schedule_lag_seconds": self.max_lag,
+                    "timeouts": self.failures.get("timeout", 0),
+                    "failures": dict(self.failures),
+                    "restarts": self.restarts,
+                    "window_seconds": self.window,
+                    "bucket_bounds_ms": list(BUCKETS),
+                    "histograms": self.histograms(),
+                    "total_histograms": self.total_histograms()
+                    }
+
+    '''
+    Snapshot in the Prometheus text exposition format
+    '''
+    def prometheus(self):
+
+        s = self.snapshot()
+
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+
+            lines.append("# HELP wtg_" + name + " " + help_text)
+            lines.append("# TYPE wtg_" + name + " " + kind)
+
+            for labels, value in samples:
+                lines.append("wtg_" + name + labels + " " + repr(float(value)))
+
+        metric("pages_total", "counter", "Pages loaded.", [("", s["pages"])])
+        metric("pages_per_second", "gauge", "Pages loaded per second in the last window.",
+               [("", s["pages_per_second"])])
+        metric("dispatched_total", "counter", "Pages dispatched by the scheduler.", [("", s["dispatched"])])
+        metric("queue_depth", "gauge", "Pages waiting for a free browser.", [("", s["queue_depth"])])
+        metric("in_flight", "gauge", "Pages loading in each browser.",
+               [('{browser="' + str(b) + '"}', n) for b, n in sorted(s["in_flight"].items())])
+        metric("schedule_lag_seconds", "gauge", "Lateness of the last dispatch.",
+               [("", s["schedule_lag_seconds"])])
+        metric("failures_total", "counter", "Failed or skipped pages by kind.",
+               [('{kind="' + kind + '"}', n) for kind, n in sorted(s["failures"].items())])
+        metric("timeouts_total", "counter", "Pages that timed out.", [("", s["timeouts"])])
+        metric("restarts_total", "counter", "Browser restarts.", [("", s["restarts"])])
+
+        # Monotonic over the run, for rate() and histogram_quantile()
+        lines.append("# HELP wtg_timing_ms Timings of the pages, in ms.")
+        lines.append("# TYPE wtg_timing_ms histogram")
+
+        for key, histogram in s["total_histograms"].items():
+
+            for bound, count in zip(BUCKETS, histogram["buckets"]):
+                lines.append('wtg_timing_ms_bucket{timing="' + key + '",le="' + str(bound) + '"} ' + str(count))
+
+            lines.append('wtg_timing_ms_bucket{timing="' + key + '",le="+Inf"} ' + str(histogram["count"]))
+            lines.append('wtg_timing_ms_sum{timing="' + key + '"} ' + repr(histogram["sum"]))
+            lines.append('wtg_timing_ms_count{timing="' + key + '"} ' + str(histogram["count"]))
+
+        # The window shrinks as pages expire, so it is published as gauges
+        metric("timing_window_pages", "gauge",
+               "Pages of the last window with a timing up to le ms.",
+               [('{timing="' + key + '",le="' + bound + '"}', count)
+                for key, histogram in s["histograms"].items()
+                for bound, count in zip([str(b) for b in BUCKETS] + ["+Inf"],
+                                        histogram["buckets"] + [histogram["count"]])])
+        metric("timing_window_sum_ms", "gauge", "Sum of the timings of the pages of the last window, in ms.",
+               [('{timing="' + key + '"}', histogram["sum"]) for key, histogram in s["histograms"].items()])
+
+        return "\n".join(lines) + "\n"
+
+'''
+Expose the metrics over HTTP (at /metrics, in Prometheus text format) and
+write a JSON snapshot in path every interval seconds, from background threads
+'''
+class MetricsReporter:
+
+    def __init__(self, metrics, path, interval=10, port=None):
+
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.port = port
+
+        self.stopped = threading.Event()
+        self.server = None
+
+    def start(self):
+
+        if self.port is not None:
+
+            metrics = self.metrics
+
+            class Handler(BaseHTTPRequestHandler):
+
+                def do_GET(self):
+
+                    if self.path.split("?")[0] not in ("/", "/metrics"):
+                        self.send_error(404)
+                        return
+
+                    body = metrics.prometheus().encode()
+
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass
+
+            # Only local clients, as the run may expose the visited URLs
+            self.server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+            self.server.daemon_threads = True
+
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        if self.interval:
+            threading.Thread(target=self.write_snapshots, daemon=True).start()
+
+    def write_snapshots(self):
+
+        while not self.stopped.wait(self.interval):
+            self.write_snapshot()
+
+    def write_snapshot(self):
+
+        # Replace the file at once, so readers never see half a snapshot
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self.metrics.snapshot(), f, indent=2)
+
+        os.replace(self.path + ".tmp", self.path)
+
+    def stop(self):
+
+        self.stopped.set()
+
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+        if self.interval:
+            self.write_snapshot()
@@ -0,0 +1,133 @@
+import time
+
+from contextlib import contextmanager
+
+# Profilers that can wrap the loop of the browsers
+PROFILERS = ("cprofile", "pyinstrument")
+
+# Phase of the page cycle that produces traffic, and phase where a browser
+# waits for work: all the others are overhead of the harness
+TRAFFIC_PHASE = "page_load"
+IDLE_PHASE = "queue_get"
+
+'''
+Wall time spent in each phase of a loop, as count, total and maximum
+'''
+class PhaseTimer:
+
+    def __init__(self):
+
+        self.start_time = time.perf_counter()
+
+        # Phase -> [count, total seconds, max seconds]
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+
+        phase = self.phases.setdefault(name, [0, 0.0, 0.0])
+
+        phase[0] += 1
+        phase[1] += seconds
+        phase[2] = max(phase[2], seconds)
+
+    def report(self):
+
+        return {
+                "wall_seconds": time.perf_counter() - self.start_time,
+                "phases": {name: {"count": count, "seconds": total, "max_seconds": longest}
+                           for name, (count, total, longest) in self.phases.items()}
+                }
+
+'''
+Combine the reports of the timers of the browsers in an overhead report:
+the phases of each browser and of all of them, with the fraction of the
+wall time spent in each phase, loading pages, waiting for pages and in
+the harness
+'''
+def overhead_report(reports):
+
+    total = {"wall_seconds": 0.0, "phases": {}}
+
+    for report in reports.values():
+
+        total["wall_seconds"] += report["wall_seconds"]
+
+        for name, phase in report["phases"].items():
+
+            merged = total["phases"].setdefault(name, {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+
+            merged["count"] += phase["count"]
+            merged["seconds"] += phase["seconds"]
+            merged["max_seconds"] = max(merged["max_seconds"], phase["max_seconds"])
+
+    wall = total["wall_seconds"]
+
+    for phase in total["phases"].values():
+        phase["mean_ms"] = phase["seconds"] / phase["count"] * 1000 if phase["count"] else 0.0
+        phase["fraction"] = phase["seconds"] / wall if wall else 0.0
+
+    traffic = total["phases"].get(TRAFFIC_PHASE, {}).get("seconds", 0.0)
+    idle = total["phases"].get(IDLE_PHASE, {}).get("seconds", 0.0)
+    overhead = sum(phase["seconds"] for name, phase in total["phases"].items()
+                   if name not in (TRAFFIC_PHASE, IDLE_PHASE))
+
+    total.update({
+                  "traffic_fraction": traffic / wall if wall else 0.0,
+                  "idle_fraction": idle / wall if wall else 0.0,
+                  "overhead_fraction": overhead / wall if wall else 0.0,
+                  # Overhead over the time spent on pages (idle time excluded)
+                  "overhead_per_page_fraction": overhead / (overhead + traffic) if overhead + traffic else 0.0
+                  })
+
+    return {"total": total, "browsers": reports}
+
+'''
+Start a profiler: cprofile or pyinstrument. Returns a function that stops
+it and saves its results in path (with the extension of its format), or
+None if the profiler is not available.
+'''
+def start_profiler(profiler, path):
+
+    if profiler == "cprofile":
+
+        import cProfile
+
+        profile = cProfile.Profile()
+        profile.enable()
+
+        def stop():
+            profile.disable()
+            profile.dump_stats(path + ".prof")
+
+        return stop
+
+    if profiler == "pyinstrument":
+
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("pyinstrument is not installed: no profile")
+            return None
+
+        profile = Profiler()
+        profile.start()
+
+        def stop():
+            profile.stop()
+
+            with open(path + ".html", "w") as f:
+                f.write(profile.output_html())
+
+        return stop
+
+    return None
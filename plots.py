@@ -0,0 +1,254 @@
+import os
+import json
+import numpy as np
+
+from timing_store import TimingStore, PAGE_TIMINGS
+
+# Colors of the resource timings, as in the browser developer tools
+TIMING_COLORS = {"dns": "#6b6b6b", "connect": "#ff1494", "send": "#66cc00",
+                 "wait": "#ff8c00", "receive": "#1f8fff"}
+
+# Percentiles always among the plotted points, and saved with them
+ANCHORS = (50, 90, 99, 99.9, 99.99)
+
+# Points of the body of a CDF, and of each decade of its tails
+BODY_POINTS = 1000
+TAIL_POINTS_PER_DECADE = 50
+
+'''
+Plots of the thinking times and of the timings of a run.
+
+matplotlib is imported only when the first plot is drawn, with the
+headless Agg backend unless MPLBACKEND selects another one, so programs
+that do not plot, or plot in another process, do not pay for it.
+'''
+def pyplot():
+
+    import matplotlib
+
+    if "MPLBACKEND" not in os.environ:
+        matplotlib.use("Agg")
+
+    import matplotlib.pyplot as plt
+
+    return plt
+
+'''
+Points of the ECDF of a sorted array of values, to plot it as a step
+function: F is exact at every point, so only the steps between two points
+are lost. There are at most a few thousand points whatever the size of
+the array: the quantiles of a grid of probabilities that is linear in the
+body and logarithmic towards both tails (down to one sample), the
+quantiles in ANCHORS, and values spaced evenly on linear and log axes.
+Returns the arrays of the values and of their cumulative probabilities.
+'''
+def cdf_points(values):
+
+    n = values.size
+
+    # Probabilities 10^-1, 10^-2, ... down to 1/n, at each tail
+    decades = max(1.0, np.log10(n))
+    tail = np.logspace(-1, -decades, num=int(np.ceil(TAIL_POINTS_PER_DECADE * decades)))
+
+    probabilities = np.concatenate((np.linspace(0, 1, BODY_POINTS), tail, 1 - tail,
+                                    np.array(ANCHORS) / 100))
+
+    x = [quantiles(values, probabilities),
+         np.linspace(values[0], values[-1], BODY_POINTS)]
+
+    # The smallest value that a log axis can show
+    positive = np.searchsorted(values, 0, side="right")
+
+    if positive < n:
+        x.append(np.geomspace(values[positive], values[-1], BODY_POINTS))
+
+    x = np.unique(np.concatenate(x))
+
+    return x, np.searchsorted(values, x, side="right") / n
+
+'''
+Quantiles of a sorted array of values: the smallest values v such that
+F(v) >= p, as the inverse of the ECDF
+'''
+def quantiles(values, probabilities):
+
+    indexes = np.ceil(np.asarray(probabilities) * values.size).astype(np.int64) - 1
+
+    return values[np.clip(indexes, 0, values.size - 1)]
+
+'''
+Summary of the plotted ECDF of a sorted array: size, extremes, the
+quantiles in ANCHORS and the points of the plot
+'''
+def cdf_summary(values, x, p):
+
+    summary = {"count": int(values.size), "min": float(values[0]), "max": float(values[-1])}
+
+    summary.update({"p" + str(anchor): float(v)
+                    for anchor, v in zip(ANCHORS, quantiles(values, np.array(ANCHORS) / 100))})
+
+    summary.update({"x": x.tolist(), "p": p.tolist()})
+
+    return summary
+
+def save_cdf_summaries(summaries, path):
+
+    with open(path, "w") as f:
+        json.dump(summaries, f)
+
+'''
+Plot the CDF of the thinking times (a sorted array) in thinking_time_cdf.png,
+saving its points in thinking_time_cdf.json
+'''
+def plot_thinking_time_cdf(thinking_times, out_folder):
+
+    plt = pyplot()
+
+    x, p = cdf_points(thinking_times)
+
+    # Plot the cdf
+    fig = plt.figure()
+    axes = fig.add_subplot(111)
+    axes.plot(x, p, drawstyle="steps-post")
+    axes.set_ylim((0,1))
+    axes.set_xlabel("Seconds")
+    axes.set_ylabel("CDF")
+    axes.set_title("Thinking time")
+    axes.grid(True)
+
+    fig.savefig(os.path.join(out_folder,"thinking_time_cdf.png"))
+
+    plt.close(fig)
+
+    save_cdf_summaries({"thinking_time": cdf_summary(thinking_times, x, p)},
+                       os.path.join(out_folder,"thinking_time_cdf.json"))
+
+def plot_thinking_time_inverse_cdf(thinking_times, out_folder):
+
+    plt = pyplot()
+
+    x, p = cdf_points(thinking_times)
+
+    # Plot the cdf
+    fig = plt.figure()
+    axes = fig.add_subplot(111)
+    axes.plot(p, x, drawstyle="steps-pre")
+    axes.set_xlim((0,1))
+    axes.set_ylabel("Seconds")
+    axes.set_xlabel("CDF")
+    axes.set_title("Thinking time")
+    axes.grid(True)
+
+    fig.savefig(os.path.join(out_folder,"thinking_time_inverse_cdf.png"))
+
+    plt.close(fig)
+
+'''
+Plot the CDFs of the page timings (page_load_cdf.png) and of the resource
+timings (timings_cdf.png and timings_cdf_log.png) in stats, saving their
+points and quantiles in timings_cdf.json.
+The arrays of stats are sorted in place, so no copy of them is made.
+'''
+def plot_stats(stats, out_folder):
+
+    plt = pyplot()
+
+    fig_total = plt.figure()
+    axes_total = fig_total.add_subplot(111)
+
+    fig_timings = plt.figure()
+    axes_timings = fig_timings.add_subplot(1,1,1)
+
+    fig_timings_log = plt.figure()
+    axes_timings_log = fig_timings_log.add_subplot(1,1,1)
+
+    summaries = {}
+
+    for key in stats:
+
+        values = stats[key]
+
+        if values.size == 0:
+            continue
+
+        values.sort()
+
+        x, p = cdf_points(values)
+
+        summaries[key] = cdf_summary(values, x, p)
+
+        if values[0] == values[-1]:
+            continue
+
+        # Plot the cdf
+        # zero is not valid with log axes
+        positive = x > 0
+
+        if key in PAGE_TIMINGS:
+            axes_total.plot(x[positive]/1000, p[positive], label=key, drawstyle="steps-post")
+        else:
+
+            color = TIMING_COLORS.get(key)
+
+            axes_timings.plot(x, p, label=key, color=color, drawstyle="steps-post")
+
+            if positive.any():
+                axes_timings_log.plot(x[positive], p[positive], label=key, color=color, drawstyle="steps-post")
+
+    save_cdf_summaries(summaries, os.path.join(out_folder,"timings_cdf.json"))
+
+    axes_total.set_ylim((0,1))
+    axes_total.set_xlabel("Seconds")
+    axes_total.set_ylabel("CDF")
+    axes_total.set_xscale("log")
+    axes_total.set_title("Page load time")
+    axes_total.grid(True, which="both", axis="x")
+    axes_total.grid(True, which="major", axis="y")
+    axes_total.legend(loc='best')
+
+    fig_total.savefig(os.path.join(out_folder,"page_load_cdf.png"))
+
+    axes_timings.set_ylim((0,1))
+    axes_timings.set_xlabel("Milliseconds")
+    axes_timings.set_ylabel("CDF")
+    axes_timings.set_title("Single resource timings")
+    axes_timings.grid(True)
+    axes_timings.legend(loc='best')
+
+    axes_timings_log.set_ylim((0,1))
+    axes_timings_log.set_xlabel("Milliseconds")
+    axes_timings_log.set_ylabel("CDF")
+    axes_timings_log.set_xscale("log")
+    axes_timings_log.set_title("Single resource timings")
+    axes_timings_log.grid(True, which="both", axis="x")
+    axes_timings_log.grid(True, which="major", axis="y")
+
+    axes_timings_log.legend(loc='best')
+
+    fig_timings.savefig(os.path.join(out_folder,"timings_cdf.png"))
+    fig_timings_log.savefig(os.path.join(out_folder,"timings_cdf_log.png"))
+
+    for fig in (fig_total, fig_timings, fig_timings_log):
+        plt.close(fig)
+
+'''
+Plot the timings of a timing store saved in store_path, selected as in
+TimingStore.stats
+'''
+def plot_store(store_path, out_folder, **selection):
+
+    plot_stats(TimingStore.load(store_path).stats(**selection), out_folder)
+
+'''
+Run a plotting function in a new process, so the caller does not wait for
+matplotlib. The process is spawned, not forked, so it does not inherit the
+threads and the memory of the caller. Returns the started process.
+'''
+def plot_in_background(function, *args, **kwargs):
+
+    import multiprocessing
+
+    process = multiprocessing.get_context("spawn").Process(target=function, args=args, kwargs=kwargs)
+    process.start()
+
+    return process
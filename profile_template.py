@@ -0,0 +1,189 @@
+import os
+import json
+import shutil
+import socket
+import hashlib
+import tempfile
+import threading
+import subprocess
+
+# Cache modes of the browsers
+CACHE_MODES = ("warm", "cold")
+
+# Preferences of every profile
+PREFERENCES = {
+               # Download files
+               "browser.download.folderList": 2,
+
+               # A comma-separated list of MIME types to save to disk without asking
+               # what to use to open the file
+               "browser.helperApps.neverAsk.saveToDisk": "application/x-msexcel,"+
+                                                          "application/excel,"+
+                                                          "application/x-excel,"+
+                                                          "application/vnd.ms-excel,"+
+                                                          "application/pdf,"+
+                                                          "application/msword,"+
+                                                          "application/xml,"+
+                                                          "application/octet-stream,"+
+                                                          "image/png,"+
+                                                          "image/jpeg,"+
+                                                          "text/html,"+
+                                                          "text/plain,"+
+                                                          "text/csv",
+
+               # Do not show the Download Manager
+               "browser.download.manager.showWhenStarting": False,
+               "browser.download.manager.focusWhenStarting": False,
+               "browser.download.manager.useWindow": False,
+               "browser.download.manager.showAlertOnComplete": False,
+               "browser.download.manager.closeWhenDone": False,
+
+               # Do not ask what to do with an unknown MIME type
+               "browser.helperApps.alwaysAsk.force": False
+               }
+
+# Run in the chrome context of Firefox before each page in cold cache mode:
+# empty the HTTP cache (on disk and in memory) and the image cache, so every
+# page starts from an empty cache while the resources it loads more than
+# once are still cached as in a normal browser
+CLEAR_CACHE_SCRIPT = """
+Services.cache2.clear();
+try {
+    Cc["@mozilla.org/image/tools;1"].getService(Ci.imgITools)
+        .getImgCacheForDocument(null).clearCache(false);
+} catch (e) {}
+"""
+
+DEFAULT_CACHE_FOLDER = os.path.join(os.path.expanduser("~"), ".cache",
+                                    "web_traffic_generator", "profiles")
+
+'''
+Firefox profile template.
+
+The template is a profile folder with the preferences in its user.js,
+stored in cache_folder under a name derived from the preferences, so it
+is built once and reused by the following runs. Browsers clone it
+(with a copy-on-write copy where the file system supports it) and patch
+only the preferences of each launch, as the proxy and the download folder.
+'''
+class ProfileTemplate:
+
+    def __init__(self, cache_mode="warm", cache_folder=DEFAULT_CACHE_FOLDER):
+
+        self.cache_mode = cache_mode
+
+        # The cache mode changes how profiles are used, not their preferences
+        self.preferences = dict(PREFERENCES)
+
+        key = hashlib.sha1(json.dumps(self.preferences, sort_keys=True).encode()).hexdigest()[:16]
+
+        self.path = os.path.join(cache_folder, key)
+
+        if not os.path.isdir(self.path):
+            self.build(cache_folder)
+
+    def build(self, cache_folder):
+
+        os.makedirs(cache_folder, exist_ok=True)
+
+        # Build in a temporary folder and rename it, so concurrent runs never see half a template
+        build_path = tempfile.mkdtemp(dir=cache_folder)
+
+        write_user_js(build_path, self.preferences)
+
+        try:
+            os.rename(build_path, self.path)
+        except OSError:
+            # Another run built the same template
+            shutil.rmtree(build_path, ignore_errors=True)
+
+    '''
+    Copy the template in a new folder inside parent_folder and return its path
+    '''
+    def clone(self, parent_folder):
+
+        clone_path = tempfile.mkdtemp(prefix="profile_", dir=parent_folder)
+
+        try:
+            subprocess.check_call(["cp", "-a", "--reflink=auto", self.path + "/.", clone_path],
+                                  stderr=subprocess.DEVNULL)
+        except (OSError, subprocess.CalledProcessError):
+            shutil.copytree(self.path, clone_path, dirs_exist_ok=True)
+
+        return clone_path
+
+    '''
+    Rewrite the user.js of a clone with the template preferences and extra ones
+    '''
+    def patch(self, profile_path, preferences):
+
+        all_preferences = dict(self.preferences)
+        all_preferences.update(preferences)
+
+        write_user_js(profile_path, all_preferences)
+
+'''
+Profiles cloned from a template by a browser.
+
+In warm cache mode the profile of a closed Firefox is given to the next
+launch, so its cache survives restarts; in cold cache mode it is deleted
+and every launch gets a fresh clone (and the browser empties its cache
+before each page with CLEAR_CACHE_SCRIPT).
+'''
+class ProfilePool:
+
+    def __init__(self, template, parent_folder):
+
+        self.template = template
+        self.parent_folder = parent_folder
+
+        self.free = []
+        self.lock = threading.Lock()
+
+    def acquire(self, preferences):
+
+        with self.lock:
+            profile_path = self.free.pop() if self.free else None
+
+        if not profile_path:
+            profile_path = self.template.clone(self.parent_folder)
+
+        self.template.patch(profile_path, preferences)
+
+        return profile_path
+
+    def release(self, profile_path):
+
+        if self.template.cache_mode == "warm":
+            with self.lock:
+                self.free.append(profile_path)
+        else:
+            shutil.rmtree(profile_path, ignore_errors=True)
+
+def write_user_js(profile_path, preferences):
+
+    with open(os.path.join(profile_path, "user.js"), "w") as f:
+        for name in sorted(preferences):
+            f.write("user_pref(" + json.dumps(name) + ", " + json.dumps(preferences[name]) + ");\n")
+
+'''
+Preferences to use an HTTP proxy at address (host:port) for http and https
+'''
+def proxy_preferences(address):
+
+    host, port = address.rsplit(":", 1)
+
+    return {
+            "network.proxy.type": 1,
+            "network.proxy.http": host,
+            "network.proxy.http_port": int(port),
+            "network.proxy.ssl": host,
+            "network.proxy.ssl_port": int(port),
+            "network.proxy.no_proxies_on": ""
+            }
+
+def free_port():
+
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
@@ -0,0 +1,210 @@
+import time
+import threading
+import urllib.request
+
+from multiprocessing import Event, Value
+
+# Ports reserved to each shard: the server port and the ports of its proxies
+PORTS_PER_SHARD = 1000
+
+'''
+A BrowserMob Proxy server shared by a subset of the browsers.
+
+The shard is created in the main process and handed to the browsers,
+that create their proxies on it. Only the main process starts and restarts
+the server: a browser that finds it offline reports the failure and waits
+for the restart counter of the shard to change, so a failure stalls only
+the browsers of that shard.
+'''
+class ProxyShard:
+
+    def __init__(self, index, path, port):
+
+        self.index = index
+        self.path = path
+        self.port = port
+
+        self.server = None
+
+        # Restarts of the server, shared with the browsers
+        self.restarts = Value('i', 0)
+
+        # Set by a browser that cannot reach the server
+        self.failure = Event()
+
+        self.health_failures = 0
+
+    def start(self):
+
+        from browsermobproxy import Server
+
+        self.server = Server(self.path, options={'port': self.port})
+
+        # Keep the proxies of different shards on different ports
+        self.server.command.append("--proxyPortRange=%d-%d" % (self.port+1, self.port+PORTS_PER_SHARD-1))
+
+        self.server.start()
+
+    def stop(self):
+
+        try:
+            self.server.stop()
+        except Exception as e:
+            print("Failed to stop proxy server "+str(self.index)+". Exception: " + str(e))
+
+    def restart(self):
+
+        self.stop()
+        self.start()
+
+        with self.restarts.get_lock():
+            self.restarts.value += 1
+
+        self.failure.clear()
+
+        print("Proxy server "+str(self.index)+" restarted")
+
+    def create_proxy(self):
+
+        return self.server.create_proxy()
+
+    '''
+    True if the REST API of the server answers
+    '''
+    def healthy(self, timeout=5):
+
+        try:
+            with urllib.request.urlopen("http://localhost:%d/proxy" % self.port, timeout=timeout):
+                return True
+        except Exception:
+            return False
+
+    '''
+    Called by a browser: report that the server is offline and wait until
+    it is restarted, at most timeout seconds. Returns False on timeout.
+    '''
+    def wait_restart(self, timeout):
+
+        restarts = self.restarts.value
+
+        self.failure.set()
+
+        deadline = time.time() + timeout
+
+        while self.restarts.value == restarts:
+
+            if time.time() > deadline:
+                return False
+
+            time.sleep(0.5)
+
+        return True
+
+'''
+Proxy server shards, with a thread in the main process that checks their
+health and restarts the failed ones, each in its own thread
+'''
+class ProxyShards:
+
+    def __init__(self, path, shards_num, base_port, health_interval=10):
+
+        self.shards = [ProxyShard(i, path, base_port + i*PORTS_PER_SHARD)
+                       for i in range(shards_num)]
+
+        self.health_interval = health_interval
+
+        self.stopped = threading.Event()
+        self.restarting = set()
+
+        self.monitor = None
+
+        # Threads restarting a shard
+        self.restart_threads = []
+
+    def start(self):
+
+        for shard in self.shards:
+            shard.start()
+
+        self.monitor = threading.Thread(target=self.monitor_shards, daemon=True)
+        self.monitor.start()
+
+    def stop(self):
+
+        self.stopped.set()
+
+        # Wait for the monitor and the restarts in progress, so no server is
+        # started after the servers are stopped
+        if self.monitor:
+            self.monitor.join()
+
+        for thread in self.restart_threads:
+            thread.join()
+
+        for shard in self.shards:
+            shard.stop()
+
+    '''
+    Shard used by the browser with the given id
+    '''
+    def shard_for(self, browser_id):
+
+        return self.shards[browser_id % len(self.shards)]
+
+    def monitor_shards(self):
+
+        last_check = time.time()
+
+        while not self.stopped.is_set():
+
+            check_health = time.time() - last_check >= self.health_interval
+
+            if check_health:
+                last_check = time.time()
+
+            for shard in self.shards:
+
+                if shard.index in self.restarting:
+                    continue
+
+                failed = shard.failure.is_set()
+
+                if not failed and check_health and not shard.healthy():
+                    shard.health_failures += 1
+                    failed = True
+
+                if failed:
+                    self.restarting.add(shard.index)
+
+                    thread = threading.Thread(target=self.restart_shard, args=(shard,), daemon=True)
+                    thread.start()
+
+                    self.restart_threads = [t for t in self.restart_threads if t.is_alive()] + [thread]
+
+            self.stopped.wait(0.5)
+
+    def restart_shard(self, shard):
+
+        try:
+            # After stop, the servers are not started again
+            if not self.stopped.is_set():
+                shard.restart()
+        except Exception as e:
+            print("Failed to restart proxy server "+str(shard.index)+". Exception: " + str(e))
+        finally:
+            self.restarting.discard(shard.index)
+
+    '''
+    Pages, restarts and failed health checks of each shard.
+    pages_by_shard maps shard index -> number of pages loaded through it.
+    '''
+    def report(self, pages_by_shard, elapsed):
+
+        return [{
+                 "shard": shard.index,
+                 "port": shard.port,
+                 "pages": pages_by_shard.get(shard.index, 0),
+                 "pages_per_second": pages_by_shard.get(shard.index, 0) / elapsed if elapsed else None,
+                 "restarts": shard.restarts.value,
+                 "failed_health_checks": shard.health_failures
+                 } for shard in self.shards]
@@ -0,0 +1,103 @@
+from datetime import datetime, timezone
+
+# How the browsers capture the timings of the pages:
+# proxy records HARs with a proxy, timing reads them from the browser
+CAPTURE_MODES = ("proxy", "timing")
+
+# Navigation and Resource Timing entries of the current page, in one call
+RESOURCE_TIMING_SCRIPT = """
+return JSON.stringify({
+    timeOrigin: performance.timeOrigin,
+    entries: performance.getEntriesByType('navigation')
+                        .concat(performance.getEntriesByType('resource'))
+});
+"""
+
+'''
+Build a HAR from the Navigation and Resource Timing entries of a page
+(the JSON returned by RESOURCE_TIMING_SCRIPT), with the timings of each
+entry converted to the HAR timings.
+'''
+def timing_har(url, timing):
+
+    time_origin = timing["timeOrigin"]
+
+    entries = [timing_entry(url, e, time_origin) for e in timing["entries"]]
+
+    return {"log": {
+                    "version": "1.2",
+                    "creator": {"name": "WebTrafficGenerator", "version": "0.1"},
+                    "pages": [{
+                               "id": url,
+                               "title": url,
+                               "startedDateTime": _date(time_origin),
+                               "pageTimings": {}
+                               }],
+                    "entries": entries
+                    }}
+
+'''
+Convert a PerformanceResourceTiming to a HAR entry.
+
+Phases that the browser does not expose are -1: cross-origin resources
+without Timing-Allow-Origin only have their duration, and requests on
+a reused connection have no dns and connect. Resource Timing has no end
+of the request, so send is always -1 and wait starts at requestStart.
+'''
+def timing_entry(pageref, e, time_origin):
+
+    timings = {"blocked": -1, "dns": -1, "connect": -1, "ssl": -1,
+               "send": -1, "wait": -1, "receive": -1}
+
+    if e["requestStart"] > 0:
+
+        if e["connectEnd"] > e["connectStart"]:
+
+            timings["dns"] = e["domainLookupEnd"] - e["domainLookupStart"]
+            timings["connect"] = e["connectEnd"] - e["connectStart"]
+
+            if e.get("secureConnectionStart", 0) > 0:
+                timings["ssl"] = e["connectEnd"] - e["secureConnectionStart"]
+
+        timings["blocked"] = max(0, e["requestStart"] - e["fetchStart"] -
+                                 max(timings["dns"], 0) - max(timings["connect"], 0))
+        timings["wait"] = e["responseStart"] - e["requestStart"]
+        timings["receive"] = e["responseEnd"] - e["responseStart"]
+
+    return {
+            "pageref": pageref,
+            "startedDateTime": _date(time_origin + e["startTime"]),
+            "time": e["duration"],
+            "request": {
+                        "method": "GET",
+                        "url": e["name"],
+                        "httpVersion": e.get("nextHopProtocol", ""),
+                        "cookies": [],
+                        "headers": [],
+                        "queryString": [],
+                        "headersSize": -1,
+                        "bodySize": -1
+                        },
+            "response": {
+                         "status": e.get("responseStatus", 0),
+                         "statusText": "",
+                         "httpVersion": e.get("nextHopProtocol", ""),
+                         "cookies": [],
+                         "headers": [],
+                         "content": {
+                                     "size": e.get("decodedBodySize", -1),
+                                     "mimeType": ""
+                                     },
+                         "redirectURL": "",
+                         "headersSize": -1,
+                         "bodySize": e.get("encodedBodySize", -1),
+                         "_transferSize": e.get("transferSize", -1)
+                         },
+            "cache": {},
+            "timings": timings,
+            "_initiatorType": e.get("initiatorType", "")
+            }
+
+def _date(milliseconds):
+
+    return datetime.fromtimestamp(milliseconds/1000, timezone.utc).isoformat()
@@ -0,0 +1,114 @@
+import time
+import numpy as np
+
+# Scheduling modes
+MODES = ("model", "replay")
+
+'''
+Open-loop scheduler of the page requests.
+
+Arrival times are computed in advance as offsets from the start of the
+schedule and every item is dispatched at its absolute deadline on the
+monotonic clock. A late dispatch (because of sleep jitter or of a slow
+dispatch function) does not delay the following ones, that catch up with
+the schedule instead of accumulating the lateness.
+'''
+class ArrivalScheduler:
+
+    def __init__(self, offsets):
+
+        self.offsets = np.asarray(offsets, dtype=np.float64)
+
+        # Lateness of the last dispatch, in seconds
+        self.lag = 0.0
+
+        self.dispatched = 0
+
+        self.start_time = None
+        self.end_time = None
+
+        self._lateness = np.zeros(len(self.offsets))
+
+    '''
+    Arrivals separated by thinking times drawn from sampler
+    '''
+    @classmethod
+    def from_sampler(cls, sampler, size, speedup=1):
+
+        if size == 0:
+            return cls([])
+
+        return cls(np.concatenate(([0], np.cumsum(sampler.sample(size - 1)))) / speedup)
+
+    '''
+    Arrivals at the same relative times of timestamps (in seconds)
+    '''
+    @classmethod
+    def from_timestamps(cls, timestamps, speedup=1):
+
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+
+        if timestamps.size == 0:
+            return cls([])
+
+        return cls((timestamps - timestamps[0]) / speedup)
+
+    '''
+    All the arrivals at once
+    '''
+    @classmethod
+    def immediate(cls, size):
+
+        return cls(np.zeros(size))
+
+    '''
+    Call dispatch on each item at its arrival time. Dispatch receives the
+    item and its intended start time, as a wall clock timestamp. Between
+    dispatches the scheduler calls wait with the seconds to the next one.
+    '''
+    def run(self, items, dispatch, wait=time.sleep):
+
+        self.start_time = time.monotonic()
+        start_wall_time = time.time()
+
+        for i, item in enumerate(items):
+
+            if i == len(self.offsets):
+                break
+
+            delay = self.start_time + self.offsets[i] - time.monotonic()
+
+            if delay > 0:
+                wait(delay)
+
+            self.lag = max(0.0, time.monotonic() - self.start_time - self.offsets[i])
+            self._lateness[i] = self.lag
+
+            dispatch(item, start_wall_time + self.offsets[i])
+
+            self.dispatched = i + 1
+
+        self.end_time = time.monotonic()
+
+    '''
+    Target and achieved request rates and statistics of the lateness
+    '''
+    def report(self):
+
+        n = self.dispatched
+
+        duration = self.offsets[n - 1] if n else 0.0
+        elapsed = (self.end_time - self.start_time) if self.end_time else 0.0
+
+        lateness = self._lateness[:n]
+
+        return {
+                "dispatched": n,
+                "target_duration": float(duration),
+                "achieved_duration": elapsed,
+                "target_rate": float((n - 1) / duration) if n > 1 and duration > 0 else None,
+                "achieved_rate": (n - 1) / elapsed if n > 1 and elapsed > 0 else None,
+                "mean_lateness": float(lateness.mean()) if n else 0.0,
+                "p99_lateness": float(np.percentile(lateness, 99)) if n else 0.0,
+                "max_lateness": float(lateness.max()) if n else 0.0
+                }
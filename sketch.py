@@ -0,0 +1,234 @@
+import json
+import math
+import numpy as np
+
+# Percentiles reported for each timing
+PERCENTILES = (50, 90, 99, 99.9)
+
+SKETCH_FORMAT = "ddsketch-1"
+
+'''
+Quantile sketch with relative accuracy guarantees (DDSketch).
+
+Values are counted in logarithmic buckets: the bucket of a value x is
+ceil(log(x) / log(gamma)), with gamma = (1 + accuracy) / (1 - accuracy),
+so every quantile is returned with a relative error of at most accuracy.
+Values smaller than min_value (zeros included) have a dedicated counter.
+Memory is bounded by max_bins: when it is exceeded the lowest buckets are
+collapsed, so only the accuracy of the lowest quantiles degrades.
+Sketches with the same accuracy are merged exactly by adding their buckets.
+'''
+class DDSketch:
+
+    def __init__(self, relative_accuracy=0.01, max_bins=2048, min_value=1e-3):
+
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.min_value = min_value
+
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+
+        self.bins = {}
+        self.zero_count = 0
+
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    '''
+    Add an array of values. Negative values are not valid timings and are ignored.
+    '''
+    def add(self, values):
+
+        values = np.asarray(values, dtype=np.float64)
+        values = values[values >= 0]
+
+        if values.size == 0:
+            return self
+
+        self.count += int(values.size)
+        self.sum += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+        large = values[values >= self.min_value]
+
+        self.zero_count += int(values.size - large.size)
+
+        indexes, counts = np.unique(np.ceil(np.log(large) / self.log_gamma).astype(np.int64),
+                                    return_counts=True)
+
+        for index, count in zip(indexes.tolist(), counts.tolist()):
+            self.bins[index] = self.bins.get(index, 0) + count
+
+        self._collapse()
+
+        return self
+
+    def merge(self, other):
+
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different accuracy")
+
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+        self._collapse()
+
+        return self
+
+    def _collapse(self):
+
+        if len(self.bins) <= self.max_bins:
+            return
+
+        indexes = sorted(self.bins)
+
+        # Move the counts of the lowest buckets in the lowest kept bucket
+        lowest = indexes[len(indexes) - self.max_bins]
+
+        for index in indexes[:len(indexes) - self.max_bins]:
+            self.bins[lowest] += self.bins.pop(index)
+
+    '''
+    Return the values at the quantiles q (in [0, 1])
+    '''
+    def quantiles(self, q):
+
+        q = np.asarray(q, dtype=np.float64)
+
+        if self.count == 0:
+            return np.full(q.shape, np.nan)
+
+        indexes = np.array(sorted(self.bins), dtype=np.int64)
+        counts = np.array([self.bins[i] for i in indexes.tolist()], dtype=np.int64)
+
+        # Representative value of each bucket, zero for the zero counter
+        values = np.concatenate(([0.0], 2 * self.gamma ** indexes / (self.gamma + 1)))
+        cumulative = np.cumsum(np.concatenate(([self.zero_count], counts)))
+
+        ranks = q * (self.count - 1)
+
+        result = values[np.minimum(np.searchsorted(cumulative, ranks, side="right"),
+                                   len(values) - 1)]
+
+        # The extremes are known exactly
+        return np.clip(result, self.min, self.max)
+
+    def quantile(self, q):
+
+        return float(self.quantiles([q])[0])
+
+    def to_dict(self):
+
+        return {
+                "format": SKETCH_FORMAT,
+                "relative_accuracy": self.relative_accuracy,
+                "max_bins": self.max_bins,
+                "min_value": self.min_value,
+                "count": self.count,
+                "sum": self.sum,
+                "min": self.min if self.count else None,
+                "max": self.max if self.count else None,
+                "zero_count": self.zero_count,
+                "bins": {str(index): count for index, count in self.bins.items()}
+                }
+
+    @classmethod
+    def from_dict(cls, data):
+
+        if data.get("format") != SKETCH_FORMAT:
+            raise ValueError("Unknown sketch format: " + str(data.get("format")))
+
+        sketch = cls(data["relative_accuracy"], data["max_bins"], data["min_value"])
+
+        sketch.count = data["count"]
+        sketch.sum = data["sum"]
+        sketch.min = data["min"] if data["count"] else math.inf
+        sketch.max = data["max"] if data["count"] else -math.inf
+        sketch.zero_count = data["zero_count"]
+        sketch.bins = {int(index): count for index, count in data["bins"].items()}
+
+        return sketch
+
+'''
+A sketch for each timing, saved in a single JSON file together with
+the percentiles it summarizes.
+'''
+class SketchSet:
+
+    def __init__(self, relative_accuracy=0.01):
+
+        self.relative_accuracy = relative_accuracy
+        self.sketches = {}
+
+    def sketch(self, key):
+
+        if key not in self.sketches:
+            self.sketches[key] = DDSketch(self.relative_accuracy)
+
+        return self.sketches[key]
+
+    '''
+    Add the values of a statistics dictionary (timing -> values)
+    '''
+    def add_stats(self, stats):
+
+        for key in stats:
+            self.sketch(key).add(stats[key])
+
+        return self
+
+    def merge(self, other):
+
+        for key, sketch in other.sketches.items():
+            self.sketch(key).merge(sketch)
+
+        return self
+
+    '''
+    Return a dictionary timing -> {percentile: value}
+    '''
+    def percentiles(self, percentiles=PERCENTILES):
+
+        result = {}
+
+        for key, sketch in self.sketches.items():
+
+            values = sketch.quantiles([p / 100 for p in percentiles])
+
+            result[key] = {"count": sketch.count}
+            result[key].update({"p" + str(p): float(v) for p, v in zip(percentiles, values)})
+
+        return result
+
+    def save(self, path):
+
+        # "sketches" must be the first key, it is used to recognize the file
+        with open(path, "w") as f:
+            json.dump({"sketches": {key: sketch.to_dict() for key, sketch in self.sketches.items()},
+                       "percentiles": self.percentiles()}, f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+
+        with open(path, "r") as f:
+            data = json.load(f)
+
+        sketch_set = cls()
+
+        for key, sketch in data["sketches"].items():
+            sketch_set.sketches[key] = DDSketch.from_dict(sketch)
+
+        if sketch_set.sketches:
+            sketch_set.relative_accuracy = next(iter(sketch_set.sketches.values())).relative_accuracy
+
+        return sketch_set
@@ -0,0 +1,171 @@
+import numpy as np
+
+from utils import ECDF
+
+# Models of the thinking time
+MODELS = ("empirical", "lognormal", "pareto", "mixture")
+
+'''
+Sampler of thinking times.
+
+The model is built once from the thinking times of the history: the
+empirical model draws from the inverse of their CDF, the parametric ones
+(log-normal, Pareto, mixture of two log-normals) are fitted to the non-zero
+thinking times by maximum likelihood, while zeros keep their observed
+frequency. Parametric draws larger than the largest observed thinking time
+are drawn again, as the history only contains intervals up to max interval.
+
+Thinking times are drawn in batches from a seeded NumPy generator, so
+schedules are reproducible and drawing a single value costs almost nothing.
+'''
+class ThinkingTimeSampler:
+
+    def __init__(self, thinking_times, model="empirical", seed=None, batch_size=1024, ecdf=None):
+
+        if model not in MODELS:
+            raise ValueError("Unknown thinking time model: " + model)
+
+        self.model = model
+        self.seed = seed
+        self.batch_size = batch_size
+
+        self.rng = np.random.default_rng(seed)
+
+        data = np.asarray(thinking_times, dtype=np.float64)
+
+        # Inverse CDF table, unless it is already built
+        self.ecdf = ecdf if ecdf is not None else ECDF(data)
+
+        positive = data[data > 0]
+
+        self.max_value = float(data.max())
+        self.zero_probability = 1 - positive.size / data.size
+
+        self.params = {}
+
+        if model != "empirical":
+
+            if positive.size < 2:
+                raise ValueError("Not enough thinking times to fit a " + model + " model")
+
+            if model == "lognormal":
+                self.params = _fit_lognormal(positive)
+            elif model == "pareto":
+                self.params = _fit_pareto(positive)
+            else:
+                self.params = _fit_lognormal_mixture(positive)
+
+        self._batch = np.empty(0)
+        self._position = 0
+
+    '''
+    Draw size thinking times
+    '''
+    def sample(self, size):
+
+        if self.model == "empirical":
+            return self.ecdf.inverse(self.rng.random(size))
+
+        values = self._sample_model(size)
+
+        # Draw again values beyond the observed range
+        too_large = values > self.max_value
+
+        while too_large.any():
+            values[too_large] = self._sample_model(int(too_large.sum()))
+            too_large = values > self.max_value
+
+        values[self.rng.random(size) < self.zero_probability] = 0
+
+        return values
+
+    def _sample_model(self, size):
+
+        if self.model == "lognormal":
+            return self.rng.lognormal(self.params["mu"], self.params["sigma"], size)
+
+        if self.model == "pareto":
+            return self.params["xm"] * (1 + self.rng.pareto(self.params["alpha"], size))
+
+        components = self.rng.choice(len(self.params["weights"]), size=size, p=self.params["weights"])
+
+        return np.exp(self.rng.normal(np.asarray(self.params["mu"])[components],
+                                      np.asarray(self.params["sigma"])[components]))
+
+    '''
+    Return the next thinking time, drawing a new batch when needed
+    '''
+    def next(self):
+
+        if self._position == len(self._batch):
+            self._batch = self.sample(self.batch_size)
+            self._position = 0
+
+        value = self._batch[self._position]
+        self._position += 1
+
+        return float(value)
+
+    def describe(self):
+
+        return {
+                "model": self.model,
+                "seed": self.seed,
+                "zero_probability": self.zero_probability,
+                "max_value": self.max_value,
+                "params": self.params
+                }
+
+def _fit_lognormal(data):
+
+    logs = np.log(data)
+
+    return {"mu": float(logs.mean()), "sigma": float(logs.std())}
+
+def _fit_pareto(data):
+
+    xm = data.min()
+
+    return {"xm": float(xm), "alpha": float(data.size / np.log(data / xm).sum())}
+
+'''
+Fit a mixture of two log-normals with expectation-maximization
+on the logarithms of the data
+'''
+def _fit_lognormal_mixture(data, components=2, iterations=200, tolerance=1e-8):
+
+    logs = np.log(data)
+
+    # Start from components centered on the quantiles of the data
+    mu = np.quantile(logs, (np.arange(components) + 0.5) / components)
+    sigma = np.full(components, logs.std() / components + 1e-6)
+    weights = np.full(components, 1 / components)
+
+    likelihood = -np.inf
+
+    for _ in range(iterations):
+
+        # Expectation: responsibility of each component for each value
+        densities = (weights / (sigma * np.sqrt(2 * np.pi)) *
+                     np.exp(-0.5 * ((logs[:, None] - mu) / sigma) ** 2))
+
+        total = densities.sum(axis=1, keepdims=True) + 1e-300
+
+        responsibilities = densities / total
+
+        # Maximization
+        weights = responsibilities.mean(axis=0)
+        mu = (responsibilities * logs[:, None]).sum(axis=0) / (responsibilities.sum(axis=0) + 1e-300)
+        sigma = np.sqrt((responsibilities * (logs[:, None] - mu) ** 2).sum(axis=0) /
+                        (responsibilities.sum(axis=0) + 1e-300)) + 1e-6
+
+        new_likelihood = np.log(total).sum()
+
+        if new_likelihood - likelihood < tolerance:
+            break
+
+        likelihood = new_likelihood
+
+    weights = weights / weights.sum()
+
+    return {"weights": weights.tolist(), "mu": mu.tolist(), "sigma": sigma.tolist()}
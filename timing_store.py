@@ -0,0 +1,249 @@
+import numpy as np
+
+# Timings of the single resources, as named in the HAR entries
+TIMINGS = ("blocked", "dns", "connect", "send", "wait", "receive", "ssl")
+
+# Timings of the whole page, as named in the HAR log: service time,
+# time waiting for a free browser and latency from the intended start
+PAGE_TIMINGS = ("totalTime", "queueTime", "latency")
+
+# Number of rows converted to arrays at once
+BATCH_SIZE = 1 << 16
+
+STORE_FORMAT = "timing-store-1"
+
+'''
+Columnar store of the timings found in a set of HARs.
+
+There is one float64 column for each timing, a column with the index of
+the page of each entry and two boolean columns flagging entries on https
+and entries whose response has an error. The -1 values that HARs use for
+missing timings are kept out of the statistics with a validity mask for
+each column.
+
+HARs are buffered as tuples and converted to arrays in batches of
+BATCH_SIZE rows, so filling the store does not keep boxed floats around.
+'''
+class TimingStore:
+
+    def __init__(self):
+
+        self.pages_num = 0
+
+        self._page_rows = []
+        self._entry_rows = []
+
+        self._page_chunks = []
+        self._entry_chunks = []
+
+        self._columns = None
+
+    def add_har(self, har):
+
+        page = self.pages_num
+        self.pages_num += 1
+
+        self._page_rows.append(tuple(har["log"].get(key, -1) for key in PAGE_TIMINGS))
+
+        for entry in har["log"]["entries"]:
+
+            timings = entry["timings"]
+
+            self._entry_rows.append((page,
+                                     entry["request"]["url"].lower().startswith("https://"),
+                                     "response" not in entry or "_error" in entry["response"])
+                                    + tuple(timings.get(key, -1) for key in TIMINGS))
+
+            if len(self._entry_rows) >= BATCH_SIZE:
+                self._flush()
+
+        if len(self._page_rows) >= BATCH_SIZE:
+            self._flush()
+
+    def add_hars(self, hars):
+
+        for har in hars:
+            self.add_har(har)
+
+        return self
+
+    def _flush(self):
+
+        if self._page_rows:
+            self._page_chunks.append(np.array(self._page_rows, dtype=np.float64)
+                                     .reshape(-1, len(PAGE_TIMINGS)))
+            self._page_rows = []
+            self._columns = None
+
+        if self._entry_rows:
+            self._entry_chunks.append(np.array(self._entry_rows, dtype=np.float64)
+                                      .reshape(-1, 3 + len(TIMINGS)))
+            self._entry_rows = []
+            self._columns = None
+
+    '''
+    Dictionary of the columns of the store
+    '''
+    @property
+    def columns(self):
+
+        self._flush()
+
+        if self._columns is not None:
+            return self._columns
+
+        pages = _concatenate(self._page_chunks, len(PAGE_TIMINGS))
+        entries = _concatenate(self._entry_chunks, 3 + len(TIMINGS))
+
+        # Keep a single chunk, so the conversion is done only once
+        self._page_chunks = [pages]
+        self._entry_chunks = [entries]
+
+        columns = {
+                   "page": entries[:, 0].astype(np.int64),
+                   "https": entries[:, 1].astype(bool),
+                   "error": entries[:, 2].astype(bool)
+                   }
+
+        for i, key in enumerate(PAGE_TIMINGS):
+            columns[key] = pages[:, i]
+            columns[key + "_valid"] = pages[:, i] != -1
+
+        for i, key in enumerate(TIMINGS):
+            columns[key] = entries[:, 3 + i]
+            columns[key + "_valid"] = entries[:, 3 + i] != -1
+
+        self._columns = columns
+
+        return columns
+
+    '''
+    Return a dictionary with an array of the valid values of each timing.
+    Entries on https are left out if no_https is set, entries with an error
+    if skip_errors is set and entries of pages without a valid total time
+    if valid_pages_only is set.
+    '''
+    def stats(self, keys=PAGE_TIMINGS + TIMINGS, no_https=False,
+              skip_errors=False, valid_pages_only=False):
+
+        columns = self.columns
+
+        selected = np.ones(len(columns["page"]), dtype=bool)
+
+        if no_https:
+            selected &= ~columns["https"]
+
+        if skip_errors:
+            selected &= ~columns["error"]
+
+        if valid_pages_only:
+            selected &= columns["totalTime_valid"][columns["page"]]
+
+        stats = {}
+
+        for key in keys:
+            if key in PAGE_TIMINGS:
+                stats[key] = columns[key][columns[key + "_valid"]]
+            else:
+                stats[key] = columns[key][selected & columns[key + "_valid"]]
+
+        return stats
+
+    def __getstate__(self):
+
+        self._flush()
+
+        # Do not pickle the column views, they are rebuilt on demand
+        state = self.__dict__.copy()
+        state["_columns"] = None
+
+        return state
+
+    def save(self, path):
+
+        np.savez_compressed(path, format=STORE_FORMAT, **self.columns)
+
+    @classmethod
+    def load(cls, path):
+
+        with np.load(path) as data:
+
+            if str(data["format"]) != STORE_FORMAT:
+                raise ValueError("Not a timing store: " + path)
+
+            # Stores saved before a page timing was introduced lack its column
+            pages = np.column_stack([data[key] if key in data else np.full(len(data["totalTime"]), -1.0)
+                                     for key in PAGE_TIMINGS])
+
+            entries = np.column_stack([data["page"], data["https"], data["error"]] +
+                                      [data[key] for key in TIMINGS])
+
+        return cls._from_arrays(pages.astype(np.float64), entries.astype(np.float64))
+
+    '''
+    Store of the columns of the pages (one for each page timing) and of the
+    entries (page, https, error and one for each timing)
+    '''
+    @classmethod
+    def from_columns(cls, pages, entries):
+
+        return cls._from_arrays(np.column_stack([pages[key] for key in PAGE_TIMINGS]).astype(np.float64)
+                                .reshape(-1, len(PAGE_TIMINGS)),
+                                np.column_stack([entries["page"], entries["https"], entries["error"]] +
+                                                [entries[key] for key in TIMINGS]).astype(np.float64)
+                                .reshape(-1, 3 + len(TIMINGS)))
+
+    '''
+    Concatenate several stores, renumbering their pages
+    '''
+    @classmethod
+    def concatenate(cls, stores):
+
+        page_chunks = []
+        entry_chunks = []
+
+        offset = 0
+
+        for store in stores:
+
+            store.columns
+
+            entries = store._entry_chunks[0].copy()
+            entries[:, 0] += offset
+
+            page_chunks.append(store._page_chunks[0])
+            entry_chunks.append(entries)
+
+            offset += store.pages_num
+
+        return cls._from_arrays(_concatenate(page_chunks, len(PAGE_TIMINGS)),
+                                _concatenate(entry_chunks, 3 + len(TIMINGS)))
+
+    @classmethod
+    def _from_arrays(cls, pages, entries):
+
+        store = cls()
+
+        store.pages_num = len(pages)
+        store._page_chunks = [pages]
+        store._entry_chunks = [entries]
+
+        return store
+
+'''
+True if path is a timing store saved by TimingStore.save
+'''
+def is_timing_store(path):
+
+    try:
+        with np.load(path) as data:
+            return "format" in data and str(data["format"]) == STORE_FORMAT
+    except (OSError, ValueError):
+        return False
+
+def _concatenate(chunks, width):
+
+    if not chunks:
+        return np.empty((0, width), dtype=np.float64)
+
+    return np.concatenate(chunks)
@@ -1,27 +1,90 @@
 import numpy as np
-from scipy.interpolate import interp1d
 
-def compute_cdf(data):
-
-    data_size=len(data)
-
-    # Set bins edges
-    data_set=sorted(set(data))
-    bins=np.append(data_set, data_set[-1]+1)
-
-    # Use the histogram function to bin the data
-    counts, bin_edges = np.histogram(data, bins=bins, density=False)
-
-    counts=counts.astype(float)/data_size
-
-    # Find the cdf
-    cdf_samples = np.cumsum(counts)
+'''
+Empirical cumulative distribution function of a sample.
 
-    cdf = interp1d(bin_edges[0:-1], cdf_samples)
+The distinct values of the sample and their cumulative probabilities are
+computed once; evaluating the ECDF or its inverse is a binary search,
+with the exact step-function semantics: F(x) is the fraction of the sample
+(or of its weight) that is <= x, and inverse(p) is the smallest value v
+such that F(v) >= p.
+'''
+class ECDF:
+    
+    def __init__(self, data, weights=None, assume_sorted=False):
+        
+        data = np.asarray(data, dtype=np.float64).ravel()
+        
+        if data.size == 0:
+            raise ValueError("Empty sample")
+        
+        if weights is None and not assume_sorted:
+            
+            self.x, counts = np.unique(data, return_counts=True)
+        
+        else:
+            
+            if weights is None:
+                weights = np.ones(data.size)
+            else:
+                weights = np.asarray(weights, dtype=np.float64).ravel()
+            
+            if not assume_sorted:
+                order = np.argsort(data, kind="stable")
+                data = data[order]
+                weights = weights[order]
+            
+            # Sum the weights of equal values
+            starts = np.flatnonzero(np.concatenate(([True], data[1:] != data[:-1])))
+            
+            self.x = data[starts]
+            counts = np.add.reduceat(weights, starts)
+        
+        cumulative = np.cumsum(counts, dtype=np.float64)
+        
+        # Cumulative probabilities of the distinct values
+        self.p = cumulative / cumulative[-1]
+        
+        self._p0 = np.concatenate(([0.0], self.p))
+    
+    def __call__(self, x):
+        
+        return self._p0[np.searchsorted(self.x, x, side="right")]
     
-    inverse_cdf = interp1d(cdf_samples,bin_edges[0:-1])
+    def inverse(self, p):
+        
+        return self.x[np.minimum(np.searchsorted(self.p, p, side="left"), self.x.size - 1)]
+    
+    def __len__(self):
+        
+        return self.x.size
+    
+    '''
+    ECDF with the given distinct values and cumulative probabilities
+    (e.g., the x and p of an ECDF saved before)
+    '''
+    @classmethod
+    def from_table(cls, x, p):
+        
+        ecdf = cls.__new__(cls)
+        
+        ecdf.x = np.asarray(x, dtype=np.float64)
+        ecdf.p = np.asarray(p, dtype=np.float64)
+        
+        ecdf._p0 = np.concatenate(([0.0], ecdf.p))
+        
+        return ecdf
 
-    return cdf, inverse_cdf, cdf_samples
+'''
+Compute the CDF of data.
+Returns the CDF, the inverse CDF and the cumulative probabilities
+of the distinct values of data.
+'''
+def compute_cdf(data, weights=None, assume_sorted=False):
+    
+    ecdf = ECDF(data, weights, assume_sorted)
+    
+    return ecdf, ecdf.inverse, ecdf.p
 
 '''
 Find the minimum values that is not zero.
@@ -29,11 +92,33 @@ Returns 0 if values are all zero
 '''
 def find_non_zero_min(values):
     
-    min = values[0]
+    values = np.asarray(values)
     
-    for x in values[1:]:
-        
-        if (x!=0 and (min==0 or x < min)):
-            min = x
-        
-    return min
+    non_zero = values[values != 0]
+    
+    if non_zero.size == 0:
+        return 0
+    
+    return non_zero.min()
+
+'''
+Encode a list of strings in two arrays that NumPy can save without pickling:
+their UTF-8 bytes and the offsets where each string starts (and the last ends)
+'''
+def encode_strings(values):
+    
+    encoded = [value.encode("utf-8") for value in values]
+    
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    offsets = np.cumsum([0] + [len(value) for value in encoded], dtype=np.int64)
+    
+    return data, offsets
+
+'''
+Decode the list of strings encoded by encode_strings
+'''
+def decode_strings(data, offsets):
+    
+    raw = np.asarray(data, dtype=np.uint8).tobytes()
+    
+    return [raw[start:end].decode("utf-8") for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
@@ -1,21 +1,31 @@
 #!/usr/bin/python3
 
 import json
+import glob
 import argparse
 import os
-import numpy as np
-import random
 import time
 import tempfile
-import matplotlib.pyplot as plt
-from multiprocessing import Queue, cpu_count, Barrier
+from multiprocessing import Queue
 
-from browsermobproxy import Server
-from selenium import webdriver
-from selenium.common.exceptions import TimeoutException
-
-from browser import Browser
-from utils import *
+from browser_pool import BrowserPool
+from distributed import RemotePool
+from circuit_breaker import CircuitBreakers
+from metrics import Metrics, MetricsReporter
+from phase_timer import overhead_report, PROFILERS
+from proxy_shards import ProxyShards
+from har_proxy import HarProxyShards
+from resource_timing import CAPTURE_MODES
+from profile_template import ProfileTemplate, CACHE_MODES, DEFAULT_CACHE_FOLDER
+from har_io import iter_hars, merge_shards, repair_shard
+from checkpoint import Checkpoint, completed_pages
+from har_columns import ColumnarWriter
+from timing_store import TimingStore
+from sketch import SketchSet
+from thinking_time import ThinkingTimeSampler, MODELS
+from history import load_history
+from scheduler import ArrivalScheduler, MODES
+from plots import plot_thinking_time_cdf, plot_store, plot_in_background
 
 class WebTrafficGenerator:
     
@@ -45,8 +55,95 @@ class WebTrafficGenerator:
         
         self.no_https = args['no_https']
         
+        self.sketches = args['sketches']
+        
+        self.thinking_model = args['thinking_model']
+        
+        self.seed = args['seed']
+        
+        self.schedule = args['schedule']
+        
+        self.speedup = args['speedup']
+        
+        self.queue_size = args['queue_size']
+        
+        self.spare_browsers = args['spare_browsers']
+        
+        self.startup_timeout = args['startup_timeout']
+        
+        self.cache_mode = args['cache_mode']
+        
+        self.profile_cache = args['profile_cache']
+        
+        self.proxy_shards_num = args['proxy_shards']
+        
+        self.proxy_port = args['proxy_port']
+        
+        self.proxy = args['proxy']
+        
+        self.capture = args['capture']
+        
+        self.breaker_threshold = args['breaker_threshold']
+        
+        self.breaker_cooldown = args['breaker_cooldown']
+        
+        self.agents = args['agents']
+        
+        self.listen = args['listen']
+        
+        self.metrics_port = args['metrics_port']
+        
+        self.metrics_interval = args['metrics_interval']
+        
+        self.profiler = args['profile']
+        
+        self.resume = args['resume']
+        
+        self.columnar = args['columnar']
+        
+        self.checkpoint_interval = args['checkpoint_interval']
+        
+        if args['no_plots']:
+            self.plots = "none"
+        elif args['plots_later']:
+            self.plots = "later"
+        else:
+            self.plots = "background"
+        
     def run(self):
         
+        self.start_time = time.time()
+        
+        # Set when the first page is dispatched and when the last one is completed
+        self.first_dispatch_time = None
+        self.finish_time = None
+        
+        # Processes rendering the plots
+        self.plot_processes = []
+        
+        checkpoint_path = os.path.join(self.out_stats_folder,"checkpoint.json")
+        
+        failures_path = os.path.join(self.out_stats_folder,"failures.jsonl")
+        
+        # Check the checkpoint before anything is written in the folder, so a
+        # run that cannot be resumed is left as it is
+        if self.resume:
+            
+            # Without a checkpoint, the browsers would append to the shards of another run
+            if not os.path.isfile(checkpoint_path):
+                print("No checkpoint to resume in "+self.out_stats_folder)
+                return
+            
+            try:
+                self.checkpoint = Checkpoint.load(checkpoint_path, self.checkpoint_interval)
+            except (OSError, ValueError, KeyError) as e:
+                print("Cannot resume the run in "+self.out_stats_folder+": "+str(e))
+                return
+            
+            if self.checkpoint.finished:
+                print("The run in "+self.out_stats_folder+" is already finished")
+                return
+        
         # create temporary directory for downloads
         self.temp_dir = tempfile.TemporaryDirectory()
         
@@ -54,47 +151,18 @@ class WebTrafficGenerator:
             
             # Read URLs and time
             
-            self.urls=[]
-            self.thinking_times=[]
+            history = load_history(self.urls_file, self.max_interval, self.no_https)
             
-            visit_timestamps=[]
-            
-            with open(self.urls_file ,"r") as f:
-                
-                history = f.read().splitlines()
-    
-            for line in history:
-                
-                entry = line.split()
-                
-                if not (entry[1].lower().startswith("file://") or
-                    (entry[1].lower().startswith("http://") and 
-                     (entry[1].lower().startswith("10.",7) or 
-                      entry[1].lower().startswith("192.168.",7))) or 
-                    (entry[1].lower().startswith("https://") and 
-                     (entry[1].lower().startswith("10.",8) or 
-                      entry[1].lower().startswith("192.168.",8)))):
-                    
-                    # convert timestamp in seconds
-                    visit_timestamps.append(float(entry[0])/1000000)
-                    
-                    if (not self.no_https or not entry[1].lower().startswith("https://")):
-                        self.urls.append(entry[1])
+            self.urls = history.urls
+            self.url_timestamps = history.url_timestamps
+            self.thinking_times = history.thinking_times
             
             if not self.max_requests:
                 self.max_requests = len(self.urls)
-    
-            visit_timestamps.sort()
             
-            for i in range(1, len(visit_timestamps)):
-                
-                think_time=(visit_timestamps[i]-visit_timestamps[i-1])
-                
-                if think_time<=self.max_interval:
-                    
-                    self.thinking_times.append(think_time)
-            
-            self.cdf, self.inverse_cdf, self.cdf_samples = compute_cdf(self.thinking_times)
+            self.thinking_time_sampler = ThinkingTimeSampler(self.thinking_times,
+                                                             self.thinking_model,
+                                                             self.seed, ecdf=history.ecdf)
             
             print ("Number of URLs: "+str(len(self.urls)))
             
@@ -102,7 +170,7 @@ class WebTrafficGenerator:
             
             if not os.path.exists(self.out_stats_folder):
                 os.makedirs(self.out_stats_folder)
-            else:
+            elif not self.resume:
                 for file in os.listdir(self.out_stats_folder):
                     
                     file_path = os.path.join(self.out_stats_folder, file)
@@ -110,121 +178,189 @@ class WebTrafficGenerator:
                     if os.path.isfile(file_path):
                         os.remove(file_path)
     
-            # Plot history statistics
-            self.plot_thinking_time_cdf()
-            #self.plot_thinking_time_inverse_cdf()
+            with open(os.path.join(self.out_stats_folder,"thinking_time_model.json"),"w") as f:
+                json.dump(self.thinking_time_sampler.describe(),f,indent=2)
+            
+            # Plot history statistics, while the browsers start
+            if self.plots == "background":
+                self.plot_processes.append(plot_in_background(plot_thinking_time_cdf, history.thinking_times,
+                                                              self.out_stats_folder))
+            
+            # Shards of the interrupted run, and pages it completed
+            self.previous_shards = []
+            completed = None
+            
+            if self.resume:
+                
+                # Draw the same schedule of the interrupted run
+                self.thinking_time_sampler.rng.bit_generator.state = self.checkpoint.rng_state
+                
+                self.previous_shards = sorted(glob.glob(os.path.join(self.out_stats_folder,"HARs_*.jsonl")))
+                
+                # Cut the HARs truncated by the interruption: the browsers append to the shards
+                for shard in self.previous_shards:
+                    repair_shard(shard)
+                
+                if os.path.isfile(failures_path):
+                    repair_shard(failures_path)
+                
+                completed = completed_pages(self.previous_shards, failures_path)
+            else:
+                self.checkpoint = Checkpoint(checkpoint_path, self.checkpoint_interval,
+                                             self.thinking_time_sampler.rng.bit_generator.state)
+            
+            self.proxy_shards = None
             
-            # Start Proxy
-            self.server = Server(self.browser_mob_proxy_location)
+            breakers = CircuitBreakers(self.breaker_threshold, self.breaker_cooldown)
             
-            self.server.start()
+            # Live metrics, on HTTP and in periodic snapshots
+            self.metrics = Metrics()
             
-            # start queues
-            self.urls_queue = Queue()
-            self.hars_queue = Queue()
+            self.metrics_reporter = MetricsReporter(self.metrics,
+                                                    os.path.join(self.out_stats_folder,"metrics.json"),
+                                                    self.metrics_interval, self.metrics_port)
             
-            # start Barrier (for coordinating proxy server restart) 
-            self.barrier = Barrier(self.browsers_num, action = self.restart_proxy_server)
+            if self.agents:
+                
+                # The browsers run on the agents, with the settings of this run
+                self.pool = RemotePool(self.listen, self.agents, self.out_stats_folder,
+                                       {
+                                        "timeout": self.timeout,
+                                        "headers": self.save_headers,
+                                        "capture": self.capture,
+                                        "proxy": self.proxy,
+                                        "cache_mode": self.cache_mode
+                                        },
+                                       failures_path, breakers, self.metrics, self.checkpoint)
+            else:
+                self.pool = self.make_local_pool(breakers)
             
             try:
                 
-                self.workers = [Browser(i, self.server,
-                                        self.urls_queue, self.hars_queue,
-                                        self.barrier,
-                                        self.timeout, self.save_headers,
-                                        self.temp_dir.name)
-                                for i in range(self.browsers_num)]
+                self.metrics_reporter.start()
                 
-                for w in self.workers:
-                    w.start()
+                # Launch the browsers in parallel, and wait for them before requesting pages
+                self.pool.start()
+                
+                ready = self.pool.wait_ready(self.startup_timeout)
+                
+                print("Browsers ready: "+str(ready)+" in {:.1f} s".format(
+                      max(self.pool.ready.values(), default=0)))
                 
-                number_of_requests = 0
                 # Start requesting pages
-                for url in self.urls:
-    
-                    if number_of_requests==self.max_requests:
-                        break
-    
-                    self.urls_queue.put(url)
-                    number_of_requests += 1
-                    
-                    if not self.no_sleep:
-                        time.sleep(self.get_thinking_time())
-                
-                for w in self.workers:
-                    self.urls_queue.put(None)
-                
-                self.hars = []
-                
-                for w in self.workers:
-                    browser_hars = self.hars_queue.get()
-                    self.hars.extend(browser_hars)
-                
-                # write HAR file
-                with open(os.path.join(self.out_stats_folder,"HARs.json"),"w") as f:
-                    json.dump(self.hars,f)
-                
-                # Gather statistics
-                self.stats = {
-                              "totalTime":[],
-                              "blocked":[],
-                              "dns":[],
-                              "connect":[],
-                              "send":[],
-                              "wait":[],
-                              "receive":[],
-                              "ssl":[]
-                              }
-                
-                for har in self.hars:
-                    
-                    if har["log"]["totalTime"]!=-1:
-                        self.stats["totalTime"].append(har["log"]["totalTime"])
-                    
-                    for entry in har["log"]["entries"]:
-                        
-                        if (not self.no_https or not entry["request"]["url"].lower().startswith("https://")):
-                        
-                            # Queuing
-                            if entry["timings"]["blocked"]!=-1:
-                                self.stats["blocked"].append(entry["timings"]["blocked"])
-                                
-                            # DNS resolution
-                            if entry["timings"]["dns"]!=-1:
-                                self.stats["dns"].append(entry["timings"]["dns"])
-                                
-                            # TCP Connection
-                            if entry["timings"]["connect"]!=-1:
-                                self.stats["connect"].append(entry["timings"]["connect"])
-                                
-                            # HTTP Request send
-                            if entry["timings"]["send"]!=-1:
-                                self.stats["send"].append(entry["timings"]["send"])
-                                
-                            # Wait the server
-                            if entry["timings"]["wait"]!=-1:
-                                self.stats["wait"].append(entry["timings"]["wait"])
-                                
-                            # HTTP Response receive
-                            if entry["timings"]["receive"]!=-1:
-                                self.stats["receive"].append(entry["timings"]["receive"])
-                                
-                            if entry["timings"]["ssl"]!=-1:
-                                self.stats["ssl"].append(entry["timings"]["ssl"])
+                urls, scheduler = self.make_schedule()
+                
+                # Only the pages that the interrupted run did not complete
+                items, scheduler = self.checkpoint.remaining(urls, scheduler, completed)
+                
+                if self.resume:
+                    print("Pages to request: "+str(len(items))+" of "+str(len(urls)))
+                
+                scheduler.run(items, self.dispatch, self.pool.wait)
+                
+                schedule_report = scheduler.report()
+                schedule_report.update({"mode": self.schedule, "speedup": self.speedup})
+                
+                with open(os.path.join(self.out_stats_folder,"schedule_report.json"),"w") as f:
+                    json.dump(schedule_report,f,indent=2)
+                
+                if schedule_report["target_rate"]:
+                    print("Request rate: target {:.3f}/s, achieved {:.3f}/s, max lateness {:.3f} s".format(
+                          schedule_report["target_rate"], schedule_report["achieved_rate"],
+                          schedule_report["max_lateness"]))
+                
+                # Wait for all the browsers to flush their shards
+                self.pool.finish()
+                
+                self.finish_time = time.time()
+                
+                with open(os.path.join(self.out_stats_folder,"pool_report.json"),"w") as f:
+                    json.dump(self.pool.report(),f,indent=2)
+                
+                # Time spent by the browsers in each step of the page cycle
+                overhead = overhead_report({browser: record["phases"]
+                                            for browser, record in self.pool.finished.items()
+                                            if "phases" in record})
+                
+                with open(os.path.join(self.out_stats_folder,"overhead_report.json"),"w") as f:
+                    json.dump(overhead,f,indent=2)
+                
+                print("Browser time loading pages: {:.1%}, waiting for pages: {:.1%}, in the harness: {:.1%}".format(
+                      overhead["total"]["traffic_fraction"], overhead["total"]["idle_fraction"],
+                      overhead["total"]["overhead_fraction"]))
+                
+                if self.proxy_shards:
+                    proxy_report = self.proxy_shards.report(self.pool.pages_by_shard,
+                                                            time.time()-self.pool.start_time)
+                else:
+                    proxy_report = self.pool.proxy_report()
+                
+                with open(os.path.join(self.out_stats_folder,"proxy_report.json"),"w") as f:
+                    json.dump({"shards": proxy_report},f,indent=2)
+                
+                print("Pages loaded: "+str(self.pool.pages))
+                print("Failed pages: "+str(sum(self.pool.failures.values())))
+                
+                shards = self.pool.har_shards()
+                shards += [shard for shard in self.previous_shards if shard not in shards]
+                
+                shards = [shard for shard in shards if os.path.isfile(shard)]
+                
+                # Merge the shards in the HAR file
+                merge_shards(shards, os.path.join(self.out_stats_folder,"HARs.json"))
+                
+                # Gather statistics, streaming the HARs from the shards
+                store = TimingStore()
+                
+                columnar = ColumnarWriter(os.path.join(self.out_stats_folder,"HARs")) if self.columnar else None
+                
+                for shard in shards:
+                    for har in iter_hars(shard):
+                        store.add_har(har)
                         
+                        if columnar:
+                            columnar.add_har(har)
+                
+                stats_path = os.path.join(self.out_stats_folder,"stats.npz")
+                
+                store.save(stats_path)
+                
+                if columnar:
+                    print("Columnar HARs saved in "+columnar.close())
+                
+                self.stats = store.stats(no_https=self.no_https)
+                
+                if self.sketches:
+                    SketchSet().add_stats(self.stats).save(
+                        os.path.join(self.out_stats_folder,"sketches.json"))
+                
+                self.checkpoint.finished = True
+                self.checkpoint.save()
+                
+                for shard in shards:
+                    os.remove(shard)
+                
                 # Save statistics
-                self.plot_stats()
+                if self.plots == "background":
+                    self.plot_processes.append(plot_in_background(plot_store, stats_path,
+                                                                  self.out_stats_folder,
+                                                                  no_https=self.no_https))
+                elif self.plots == "later":
+                    print("Plot the statistics with: HARparser.py "+stats_path+" "+self.out_stats_folder)
                 
-                for w in self.workers:
-                    w.join()
+                self.pool.join()
                     
             except KeyboardInterrupt:
                 pass
             
             finally:
-                self.urls_queue.close()
-                self.hars_queue.close()
-                self.server.stop()
+                self.checkpoint.save()
+                self.checkpoint.close()
+                self.metrics_reporter.stop()
+                self.pool.close()
+                
+                if self.proxy_shards:
+                    self.proxy_shards.stop()
                 
         except Exception as e:
            print("Exception: " + str(e))
@@ -235,120 +371,122 @@ class WebTrafficGenerator:
         finally:
             
             self.temp_dir.cleanup()
-
-    def restart_proxy_server(self):
-        
-        try:
-            self.server.stop()
-        except Exception as e:
-            print("Failed to stop proxy server. Exception: " + str(e))
             
-        # Start Proxy
-        self.server = Server(self.browser_mob_proxy_location)
+            self.write_run_report()
+    
+    '''
+    Report the time from the start to the first page dispatched and the
+    time from the last page completed to the end of the run, without the
+    plots, that are rendered in other processes
+    '''
+    def write_run_report(self):
         
-        self.server.start() 
+        end_time = time.time()
         
-        print("Proxy server restarted")    
-    
-    def plot_thinking_time_cdf(self):
+        plot_start = time.time()
         
-        x = np.linspace(min(self.thinking_times), max(self.thinking_times), num=10000, endpoint=True)
-    
-        # Plot the cdf
-        fig = plt.figure()
-        axes = fig.add_subplot(111)
-        axes.plot(x, self.cdf(x))
-        axes.set_ylim((0,1))
-        axes.set_xlabel("Seconds")
-        axes.set_ylabel("CDF")
-        axes.set_title("Thinking time")
-        axes.grid(True)
-    
-        fig.savefig(os.path.join(self.out_stats_folder,"thinking_time_cdf.png"))
+        for process in self.plot_processes:
+            process.join()
+        
+        report = {
+                  "time_to_first_dispatch_seconds": self.first_dispatch_time - self.start_time
+                                                    if self.first_dispatch_time else None,
+                  "teardown_seconds": end_time - self.finish_time if self.finish_time else None,
+                  "plots_wait_seconds": time.time() - plot_start,
+                  "plots": self.plots
+                  }
+        
+        if report["teardown_seconds"] is not None:
+            print("Time to first dispatch: {:.2f} s, teardown: {:.2f} s".format(
+                  report["time_to_first_dispatch_seconds"], report["teardown_seconds"]))
+        
+        if os.path.isdir(self.out_stats_folder):
+            with open(os.path.join(self.out_stats_folder,"run_report.json"),"w") as f:
+                json.dump(report,f,indent=2)
 
-    def plot_thinking_time_inverse_cdf(self):
-        
-        x = np.linspace(min(self.cdf_samples), max(self.cdf_samples), num=10000, endpoint=True)
-        
-        # Plot the cdf
-        fig = plt.figure()
-        axes = fig.add_subplot(111)
-        axes.plot(x, self.inverse_cdf(x))
-        axes.set_xlim((0,1))
-        axes.set_ylabel("Seconds")
-        axes.set_xlabel("CDF")
-        axes.set_title("Thinking time")
-        axes.grid(True)
-    
-        fig.savefig(os.path.join(self.out_stats_folder,"thinking_time_inverse_cdf.png"))
-   
-    def get_thinking_time(self):
+    '''
+    Start the proxy servers and create the pool of local browsers
+    '''
+    def make_local_pool(self, breakers):
+        
+        # Selenium is imported only when local browsers are needed
+        from browser import Browser
+        
+        # Build (or reuse) the template of the Firefox profiles
+        self.profile_template = ProfileTemplate(self.cache_mode, self.profile_cache)
+        
+        # Start Proxy servers
+        # (no proxy servers when the timings are captured by the browsers)
+        if self.proxy == "asyncio" or self.capture == "timing":
+            self.proxy_shards = HarProxyShards()
+        else:
+            self.proxy_shards = ProxyShards(self.browser_mob_proxy_location,
+                                            self.proxy_shards_num, self.proxy_port)
+        
+        self.proxy_shards.start()
+        
+        # start queues
+        self.urls_queue = Queue(self.queue_size)
+        self.hars_queue = Queue()
+        
+        self.workers = [Browser(i, self.proxy_shards.shard_for(i),
+                                self.urls_queue, self.hars_queue,
+                                self.timeout, self.save_headers,
+                                self.temp_dir.name,
+                                os.path.join(self.out_stats_folder,
+                                             "HARs_"+str(i)+".jsonl"),
+                                self.profile_template,
+                                self.spare_browsers, self.capture, self.profiler)
+                        for i in range(self.browsers_num)]
         
-        rand=random.uniform(min(self.cdf_samples),max(self.cdf_samples))
-        time = float(self.inverse_cdf(rand))
-        return time
+        return BrowserPool(self.workers, self.urls_queue, self.hars_queue,
+                           os.path.join(self.out_stats_folder,"failures.jsonl"),
+                           breakers, self.metrics, self.checkpoint)
     
-    def plot_stats(self):
+    '''
+    Dispatch the page at position in the list of URLs
+    '''
+    def dispatch(self, item, intended_start):
         
-        fig_total = plt.figure()
-        axes_total = fig_total.add_subplot(111)
+        position, url = item
         
-        fig_timings = plt.figure()
-        axes_timings = fig_timings.add_subplot(1,1,1)
+        if self.first_dispatch_time is None:
+            self.first_dispatch_time = time.time()
         
-        fig_timings_log = plt.figure()
-        axes_timings_log = fig_timings_log.add_subplot(1,1,1)
+        self.checkpoint.dispatched(position, url)
         
-        for key in self.stats:
-            if len(set(self.stats[key]))>1:
-                cdf = compute_cdf(self.stats[key])
-                
-                x = np.linspace(min(self.stats[key]), max(self.stats[key]), num=10000, endpoint=True)
+        self.pool.dispatch(url, intended_start)
+    
+    '''
+    Return the URLs to request and the scheduler of their arrivals
+    '''
+    def make_schedule(self):
+        
+        if self.schedule == "replay":
             
-                # Plot the cdf
-                if key=="totalTime":
-                    axes_total.plot(x/1000, cdf[0](x), label=key)
-                else:
-                    axes_timings.plot(x, cdf[0](x), label=key)
-                    
-                    # zero is not valid with log axes
-                    if min(self.stats[key])==0:
-                        non_zero_min = find_non_zero_min(self.stats[key])
-                        
-                        if non_zero_min == 0:
-                            continue
-                        
-                        x = np.linspace(non_zero_min, max(self.stats[key]), num=10000, endpoint=True)
-                        
-                    axes_timings_log.plot(x, cdf[0](x), label=key)
-                
-        axes_total.set_ylim((0,1))
-        axes_total.set_xlabel("Seconds")
-        axes_total.set_ylabel("CDF")
-        axes_total.set_title("Page load time")
-        axes_total.grid(True)
-        
-        fig_total.savefig(os.path.join(self.out_stats_folder,"page_load_cdf.png"))
-        
-        axes_timings.set_ylim((0,1))
-        axes_timings.set_xlabel("Milliseconds")
-        axes_timings.set_ylabel("CDF")
-        axes_timings.set_title("Single resource timings")
-        axes_timings.grid(True)
-        axes_timings.legend(loc='best')
-        
-        axes_timings_log.set_ylim((0,1))
-        axes_timings_log.set_xlabel("Milliseconds")
-        axes_timings_log.set_ylabel("CDF")
-        axes_timings_log.set_xscale("log")
-        axes_timings_log.set_title("Single resource timings")
-        axes_timings_log.grid(True, which="both", axis="x")
-        axes_timings_log.grid(True, which="major", axis="y")
-        
-        axes_timings_log.legend(loc='best')
+            # Replay the pages in the order and at the times of the history
+            visits = sorted(zip(self.url_timestamps, self.urls), key=lambda visit: visit[0])
+            visits = visits[:self.max_requests]
+            
+            urls = [url for timestamp, url in visits]
+            
+            if self.no_sleep:
+                return urls, ArrivalScheduler.immediate(len(urls))
+            
+            return urls, ArrivalScheduler.from_timestamps([timestamp for timestamp, url in visits],
+                                                          self.speedup)
+        
+        urls = self.urls[:self.max_requests]
+        
+        if self.no_sleep:
+            return urls, ArrivalScheduler.immediate(len(urls))
+        
+        return urls, ArrivalScheduler.from_sampler(self.thinking_time_sampler, len(urls),
+                                                   self.speedup)
     
-        fig_timings.savefig(os.path.join(self.out_stats_folder,"timings_cdf.png"))
-        fig_timings_log.savefig(os.path.join(self.out_stats_folder,"timings_cdf_log.png"))
+    def get_thinking_time(self):
+        
+        return self.thinking_time_sampler.next()
         
 if __name__=="__main__":
     
@@ -359,7 +497,7 @@ if __name__=="__main__":
     parser.add_argument('--version',action='version',version='%(prog)s '+ version)
     
     parser.add_argument('in_file', metavar='input_file', type=str,
-                       help='history file.')
+                       help='history file, plain or compressed with gzip or zstd.')
     parser.add_argument('out_folder', metavar='output_folder', type=str,
                        help='output folder name.')
     parser.add_argument('--max-interval', metavar='<max_interval>', type=int, default = 30,
@@ -376,8 +514,71 @@ if __name__=="__main__":
                        help='limit requests to <number> urls')
     parser.add_argument('--no-https', action='store_const', const=True, default=False,
                        help='do not replay pages on https.')
+    parser.add_argument('--sketches', action='store_const', const=True, default=False,
+                       help='save mergeable quantile sketches of the timings in sketches.json.')
+    parser.add_argument('--thinking-model', metavar='<model>', choices=MODELS, default = 'empirical',
+                       help='model of the thinking time: '+', '.join(MODELS)+'. Default is empirical')
+    parser.add_argument('--seed', metavar='<seed>', type=int,
+                       help='seed of the thinking time generator, to reproduce a schedule.')
+    parser.add_argument('--schedule', metavar='<mode>', choices=MODES, default = 'model',
+                       help='model: request pages after thinking times drawn from the model, '+
+                            'replay: request pages at the times of the history. Default is model')
+    parser.add_argument('--speedup', metavar='<factor>', type=float, default = 1,
+                       help='compress the schedule by <factor> (e.g., 10 requests pages 10 times faster). Default is 1')
+    parser.add_argument('--queue-size', metavar='<number>', type=int, default = 0,
+                       help='maximum number of pages waiting for a free browser. Default is unlimited')
+    parser.add_argument('--spare-browsers', metavar='<number>', type=int, default = 0,
+                       help='number of pre-warmed browsers kept by each browser to replace it after a failure. Default is 0')
+    parser.add_argument('--startup-timeout', metavar='<timeout>', type=int, default = 120,
+                       help='maximum time in seconds to wait for the browsers to start. Default is 120 sec.')
+    parser.add_argument('--cache-mode', metavar='<mode>', choices=CACHE_MODES, default = 'warm',
+                       help='warm: the browser cache survives browser restarts, cold: the browser cache is emptied before each page. Default is warm')
+    parser.add_argument('--profile-cache', metavar='<folder>', type=str, default = DEFAULT_CACHE_FOLDER,
+                       help='folder where Firefox profile templates are kept across runs. Default is '+DEFAULT_CACHE_FOLDER)
+    parser.add_argument('--proxy-shards', metavar='<number>', type=int, default = 1,
+                       help='number of proxy servers, browsers are assigned to them in turn. Default is 1')
+    parser.add_argument('--proxy-port', metavar='<port>', type=int, default = 8080,
+                       help='port of the first proxy server, the following ones use the next thousands. Default is 8080')
+    parser.add_argument('--proxy', metavar='<proxy>', choices=('browsermob', 'asyncio'), default = 'browsermob',
+                       help='browsermob: record HARs with BrowserMob Proxy servers, '+
+                            'asyncio: record HARs with a proxy inside each browser process (no Java). Default is browsermob')
+    parser.add_argument('--capture', metavar='<mode>', choices=CAPTURE_MODES, default = 'proxy',
+                       help='proxy: record HARs with the proxy, timing: build them from the Navigation and '+
+                            'Resource Timing of the browser, without proxy. Default is proxy')
+    parser.add_argument('--breaker-threshold', metavar='<number>', type=int, default = 3,
+                       help='skip the pages of a domain after <number> consecutive timeouts (0 never skips). Default is 3')
+    parser.add_argument('--breaker-cooldown', metavar='<seconds>', type=float, default = 60,
+                       help='seconds before requesting again a page of a skipped domain. Default is 60 sec.')
+    parser.add_argument('--agents', metavar='<number>', type=int, default = 0,
+                       help='run the browsers on <number> agents (see agent.py) instead of this host.')
+    parser.add_argument('--listen', metavar='<address>', type=str, default = '0.0.0.0:9090',
+                       help='address where the agents connect, as host:port. Default is 0.0.0.0:9090')
+    parser.add_argument('--metrics-port', metavar='<port>', type=int,
+                       help='serve live metrics in Prometheus text format at http://localhost:<port>/metrics (127.0.0.1 only).')
+    parser.add_argument('--metrics-interval', metavar='<seconds>', type=float, default = 10,
+                       help='write a snapshot of the live metrics in metrics.json every <seconds> (0 never). Default is 10 sec.')
+    parser.add_argument('--profile', metavar='<profiler>', choices=PROFILERS,
+                       help='profile the loop of each browser with '+' or '.join(PROFILERS)+
+                            ', saving profile_<browser> in the output folder.')
+    parser.add_argument('--columnar', action='store_const', const=True, default=False,
+                       help='save also a columnar compressed copy of the HARs, with one row per entry: '+
+                            'HARs.parquet if pyarrow is installed, otherwise HARs.npz.')
+    parser.add_argument('--no-plots', action='store_const', const=True, default=False,
+                       help='do not plot the statistics.')
+    parser.add_argument('--plots-later', action='store_const', const=True, default=False,
+                       help='do not plot the statistics at the end of the run: they can be plotted '+
+                            'afterwards by the HAR parser from stats.npz.')
+    parser.add_argument('--resume', action='store_const', const=True, default=False,
+                       help='continue the interrupted run in the output folder from its last checkpoint.')
+    parser.add_argument('--checkpoint-interval', metavar='<seconds>', type=float, default = 60,
+                       help='save the progress of the run in checkpoint.json every <seconds> '+
+                            '(each request is journaled at once in checkpoint.jsonl). Default is 60 sec.')
     
     args = vars(parser.parse_args())
     
+    # The schedule divides the intervals by the speedup
+    if not args['speedup'] > 0:
+        parser.error("--speedup must be greater than 0")
+    
     WebTrafficGenerator(args).run()
 